@@ -84,6 +84,7 @@ def argument_parser():
     d_run_end = 'end'
     d_comment = 'no comment'
     d_doplot  = False
+    d_streaming = False
 
     h_fname   = 'input xtc file name, default = %s' % d_fname
     h_exp     = 'experiment name, default = %s' % d_exp
@@ -120,6 +121,8 @@ def argument_parser():
     h_run_end = 'last run for validity range, default = %s' % str(d_run_end)
     h_comment = 'comment added to constants metadata, default = %s' % str(d_comment)
     h_doplot  = 'plot image of pedestals, default = %s' % str(d_doplot)
+    h_streaming = 'single-pass processing with approximate 1st stage gates and O(1) frames of memory,'\
+                  ' events are distributed over MPI ranks if run under mpirun, default = %s' % str(d_streaming)
 
     parser = ArgumentParser(description='Proceses dark run xtc data for epix10ka')
     parser.add_argument('-f', '--fname',   default=d_fname,      type=str,   help=h_fname)
@@ -156,6 +159,7 @@ def argument_parser():
     parser.add_argument('-R', '--run_end', default=d_run_end,    type=str,   help=h_run_end)
     parser.add_argument('-C', '--comment', default=d_comment,    type=str,   help=h_comment)
     parser.add_argument('-P', '--doplot',  action='store_true',              help=h_doplot)
+    parser.add_argument('--streaming',     action='store_true',              help=h_streaming)
 
     return parser
 
@@ -13,9 +13,8 @@ Usage::
   a = arr3d_from_dict(d, keys=None)
   img_sta, multinds, nentries = statistics_of_pixel_arrays(rows, cols)
   img = img_from_pixel_arrays(rows, cols, weight=1.0, dtype=np.float32, vbase=0)
-  img = img_multipixel_max(img, weight, dict_pix_to_img_idx)
-  img_multipixel_max(img, weight, dict_pix_to_img_idx)
-  img_multipixel_mean(img, weight, dict_pix_to_img_idx, dict_imgidx_numentries)
+  img_multipixel_max(img, weight, multinds)
+  img_multipixel_mean(img, weight, multinds, nentries)
   size = size_for_shape(shape)
   a = ascending_index_array_for_shape(shape, dtype=np.int32)
   shape = image_shape(arr_rows, arr_cols)
@@ -27,6 +26,8 @@ Usage::
   fill_holes(img, hrows, hcols)
   statistics_of_holes(rows, cols, **kwa)
   img = img_default(arr)
+  a = ImageAssembler(rows, cols, mapmode=2, fillholes=True)
+  img = a.image(data, vbase=0, out=None)
 
   #TBD init_interpolation_parameters(rows, cols, x, y, **kwa)
   #TBD img = img_interpolated(data, interpol_pars, **kwa)
@@ -77,50 +78,44 @@ def arr3d_from_dict(d, keys=None):
 def statistics_of_pixel_arrays(rows, cols):
     """Returns:
        - 2-d image shaped numpy array with statistics of overlapped data pixels,
-       - dict for multiple entries: {<pixel-index-in-data-array> : <pixel-index-on-image>} for ravel arrays
-       - dict with number of entries: {<pixel-index-on-image> : <number-of-entries gt.1>} for ravel image array
+       - multiple entries: index arrays (<pixel-index-in-data-array>, <pixel-index-on-image>) for ravel arrays,
+         sorted by image index,
+       - number of entries: index arrays (<pixel-index-on-image>, <number-of-entries gt.1>) for ravel image array,
+         sorted by image index
     """
     assert isinstance(rows, np.ndarray)
     assert isinstance(cols, np.ndarray)
     assert rows.size == cols.size
 
-    img_shape = nrows, ncols = image_shape(rows, cols)
-
-    zipped_rows_cols = zip(rows.ravel(), cols.ravel())
+    img_shape = image_shape(rows, cols)
 
     t0_sec = time()
-    img_sta = np.zeros(img_shape, dtype=np.uint16)
-    for r,c in zipped_rows_cols: img_sta[r,c]+=1 # 1.8 sec
-    # DOES NOT WORK FOR MULTI-ENTRIES... img_sta[rows.ravel(),cols.ravel()] += np.ones(rows.size, dtype=np.uint16) # 11ms
-    logger.debug('XXX statistics_of_pixel_arrays consumed time (sec) = %.6f' % (time()-t0_sec)) # 1.8 sec
+    img_inds = np.ravel_multi_index((rows.ravel().astype(np.intp), cols.ravel().astype(np.intp)), img_shape)
+    counts = np.bincount(img_inds, minlength=img_shape[0]*img_shape[1])
+    img_sta = counts.astype(np.uint16).reshape(img_shape)
+    logger.debug('XXX statistics_of_pixel_arrays consumed time (sec) = %.6f' % (time()-t0_sec)) # 25ms for 2M pixels
     logger.debug('XXX np.bincount(img_sta): %s' % str(np.bincount(img_sta.ravel(), minlength=10)))
 
-    t0_sec = time()
-    cond = img_sta>1
-    #inds_img_multiple = np.extract(cond.ravel(), np.arange(img_sta.size))
-    #print(info_ndarr(inds_img_multiple, 'inds_img_multiple:'))
-
-    nrows, ncols = img_sta.shape
-    multinds = {i:int(r*ncols+c) for i,(r,c) in enumerate(zipped_rows_cols) if cond[r,c]}
-    #logger.debug('XXX dict multinds production time (sec) = %.6f' % (time()-t0_sec)) # 170us
-    #exit('TEST EXIT') #############
-
-
-    s = '\n multiple mapping of pixels to image:'
-    for k,v in multinds.items(): s += '\n  pix:%06d img:%06d' % (k,v)
-    logger.debug(s)
-
     # count number of entries in overlapping image pixels for epix10kaquad (4, 352, 384)
     # image bin scale size 100 - 11 multiple pixels
     # image bin scale size 101 - 10426 multiple pixels
     # image bin scale size 110 - 84571 multiple pixels
 
-    from collections import Counter
-    nentries = Counter(multinds.values())
+    pix_inds = np.flatnonzero(counts[img_inds]>1)
+    pix_inds = pix_inds[np.argsort(img_inds[pix_inds], kind='stable')]
+    multinds = (pix_inds, img_inds[pix_inds])
+
+    img_inds_multi = np.flatnonzero(counts>1)
+    nentries = (img_inds_multi, counts[img_inds_multi])
 
-    s = '\n number of multiple entries to image index:'
-    for i,(k,n) in enumerate(nentries.items()): s += '\n  %03d img_ind:%06d entries:%d' % (i+1,k,n)
-    logger.debug(s)
+    if logger.getEffectiveLevel()<=logging.DEBUG:
+        s = '\n multiple mapping of pixels to image:'
+        for k,v in zip(*multinds): s += '\n  pix:%06d img:%06d' % (k,v)
+        logger.debug(s)
+
+        s = '\n number of multiple entries to image index:'
+        for i,(k,n) in enumerate(zip(*nentries)): s += '\n  %03d img_ind:%06d entries:%d' % (i+1,k,n)
+        logger.debug(s)
 
     return img_sta, multinds, nentries
 
@@ -158,35 +153,48 @@ def img_from_pixel_arrays(rows, cols, weight=1.0, dtype=np.float32, vbase=0):
     return img
 
 
-def img_multipixel_max(img, weight, dict_pix_to_img_idx):
+def _multipixel_segments(multinds):
+    """Returns pixel indexes, image indexes of segments and segment start indexes
+       for multinds from statistics_of_pixel_arrays.
+    """
+    pix_inds, img_inds = multinds
+    starts = np.flatnonzero(np.diff(img_inds, prepend=-1))
+    return pix_inds, img_inds[starts], starts
+
+
+def img_multipixel_max(img, weight, multinds):
     imgrav = img.ravel() # ravel() does not copy like ravel()
-    for ia,i in dict_pix_to_img_idx.items(): imgrav[i] = max(imgrav[i], weight.ravel()[ia])
+    pix_inds, img_inds, starts = _multipixel_segments(multinds)
+    if pix_inds.size == 0: return
+    vmax = np.maximum.reduceat(weight.ravel()[pix_inds], starts)
+    imgrav[img_inds] = np.maximum(imgrav[img_inds], vmax)
 
     if logger.getEffectiveLevel()<=logging.DEBUG: #logger.level
         s = '\n  == img_multipixel_max cross-check'
-        for ia,i in dict_pix_to_img_idx.items():
+        for ia,i in zip(*multinds):
             s += '\n  inds in img:%06d in pixarr:%06d value: %.1f' % (i, ia, weight.ravel()[ia])
         s += '\n  == img_multipixel_max result:'
-        for i in sorted(set(dict_pix_to_img_idx.values())):
+        for i in img_inds:
             s += '\n  inds in img:%06d max: %.1f' % (i, imgrav[i])
         logger.debug(s)
     #return img
 
 
-def img_multipixel_mean(img, weight, dict_pix_to_img_idx, dict_imgidx_numentries):
+def img_multipixel_mean(img, weight, multinds, nentries):
     imgrav = img.ravel()
-    imgidx = list(dict_imgidx_numentries.keys())
-    imgrav[imgidx] = 0                                               # initialization
-    for ia,i in dict_pix_to_img_idx.items(): imgrav[i] += weight.ravel()[ia] # accumulation
-    imgrav[imgidx] /= list(dict_imgidx_numentries.values())          # normalization
+    pix_inds, img_inds, starts = _multipixel_segments(multinds)
+    if pix_inds.size == 0: return
+    vsum = np.add.reduceat(weight.ravel()[pix_inds], starts, dtype=imgrav.dtype) # accumulation
+    imgidx, numentries = nentries
+    imgrav[imgidx] = vsum / numentries                                # normalization
 
     if logger.getEffectiveLevel()<=logging.DEBUG: #logger.level
         s = '\n  == img_multipixel_mean cross-check'
-        for ia,i in dict_pix_to_img_idx.items():
+        for ia,i in zip(*multinds):
             s += '\n  inds in img:%06d in pixarr:%06d value: %.1f' % (i, ia, weight.ravel()[ia])
         s += '\n  == img_multipixel_mean result:'
-        for i in imgidx:
-            s += '\n  inds in img:%06d mean: %.1f for %d entries' % (i, imgrav[i], dict_imgidx_numentries[i])
+        for i,n in zip(imgidx, numentries):
+            s += '\n  inds in img:%06d mean: %.1f for %d entries' % (i, imgrav[i], n)
         logger.debug(s)
     #return img
 
@@ -316,6 +324,64 @@ def img_default(arr):
     return a
 
 
+class ImageAssembler:
+    """Precomputed gather tables for image assembly from data arrays with fixed pixel rows and cols.
+       image(data) returns the same as
+         img = img_from_pixel_arrays(rows, cols, weight=data, vbase=vbase) # mapmode 1
+         img_multipixel_max(img, data, multinds)                            # mapmode 2
+         img_multipixel_mean(img, data, multinds, nentries)                 # mapmode 3
+         fill_holes(img, hole_rows, hole_cols)                              # fillholes
+    """
+    def __init__(self, rows, cols, mapmode=2, fillholes=True, dtype=np.float32):
+        assert mapmode in (1,2,3), 'ImageAssembler supports mapmode 1/2/3, mapmode=%s' % str(mapmode)
+        t0_sec = time()
+        self.mapmode = mapmode
+        self.dtype = dtype
+        self.shape = image_shape(rows, cols)
+
+        # image bins with data and the last data index mapped to them (as img[rows,cols]=data)
+        img_pix_ind = image_of_pixel_array_ascending_index(rows, cols, self.shape, np.int64).ravel()
+        self.img_inds = np.flatnonzero(img_pix_ind>-1)
+        self.pix_inds = img_pix_ind[self.img_inds]
+
+        # overlapping pixels, see statistics_of_pixel_arrays
+        self.multi_pix_inds = self.multi_img_inds = self.multi_starts = self.multi_nentries = None
+        if mapmode in (2,3):
+            _, multinds, nentries = statistics_of_pixel_arrays(rows, cols)
+            self.multi_pix_inds, self.multi_img_inds, self.multi_starts = _multipixel_segments(multinds)
+            self.multi_nentries = nentries[1]
+
+        # holes and their four neighbors, see fill_holes
+        self.hole_inds = self.hole_nbrs = None
+        if fillholes:
+            hrows, hcols = hole_rows_cols(image_of_holes((img_pix_ind>-1).reshape(self.shape)))
+            self.hole_inds = np.ravel_multi_index((hrows, hcols), self.shape)
+            self.hole_nbrs = np.stack([np.ravel_multi_index(rc, self.shape, mode='wrap') for rc in\
+                ((hrows-1, hcols), (hrows+1, hcols), (hrows, hcols-1), (hrows, hcols+1))], axis=1)
+        logger.debug('ImageAssembler tables time (sec) = %.6f' % (time()-t0_sec))
+
+    def image(self, data, vbase=0, out=None):
+        """Returns image for data shaped as rows/cols, fills out if specified"""
+        if out is None:
+            out = np.empty(self.shape, dtype=self.dtype)
+        assert out.shape == self.shape and out.flags.c_contiguous
+        imgrav = out.ravel()
+        datrav = data.ravel()
+        imgrav.fill(vbase)
+        imgrav[self.img_inds] = datrav[self.pix_inds]
+
+        if self.multi_pix_inds is not None and self.multi_pix_inds.size:
+            vals = datrav[self.multi_pix_inds]
+            if self.mapmode==2:
+                imgrav[self.multi_img_inds] = np.maximum.reduceat(vals, self.multi_starts)
+            else:
+                imgrav[self.multi_img_inds] = np.add.reduceat(vals, self.multi_starts, dtype=imgrav.dtype) / self.multi_nentries
+
+        if self.hole_inds is not None and self.hole_inds.size:
+            imgrav[self.hole_inds] = imgrav[self.hole_nbrs].min(axis=1)
+        return out
+
+
 def init_interpolation_parameters(rows, cols, x, y, **kwa):
     """TBD: currently returns image of ascending index in data array
     """
@@ -215,7 +215,6 @@ class DarkProc():
 
         self.arr0       = np.zeros(shape_raw, dtype=dtype_raw)
         self.arr1       = np.ones (shape_raw, dtype=dtype_raw)
-        self.arr1u64    = np.ones (shape_raw, dtype=np.uint64)
 
         self.sta_int_lo = np.zeros(shape_raw, dtype=np.uint64)
         self.sta_int_hi = np.zeros(shape_raw, dtype=np.uint64)
@@ -254,17 +253,14 @@ class DarkProc():
         rmsnlo  = self.rmsnlo
 
         fraclm  = self.fraclm
-        counter = self.irec
+        counter = self.gated_counter()
         doplot  = self.doplot
 
-        arr_av1 = divide_protected(self.arr_sum1, self.arr_sum0)
-        arr_av2 = divide_protected(self.arr_sum2, self.arr_sum0)
+        arr_av1, arr_rms = self.average_and_rms()
 
         frac_int_lo = np.array(self.sta_int_lo/counter, dtype=np.float32)
         frac_int_hi = np.array(self.sta_int_hi/counter, dtype=np.float32)
 
-        arr_rms = np.sqrt(arr_av2 - np.square(arr_av1))
-
         logger.debug(info_ndarr(arr_rms, 'arr_rms'))
         logger.debug(info_ndarr(arr_av1, 'arr_av1'))
 
@@ -311,22 +307,36 @@ class DarkProc():
         logger.info('summary consumes %.3f sec' % (time()-t0_sec))
 
 
+    def gated_counter(self):
+        """Returns number of records used to evaluate fractions of intensities out of the gate."""
+        return self.irec
+
+
+    def average_and_rms(self):
+        """Returns per-pixel average and rms of the gated intensities."""
+        arr_av1 = divide_protected(self.arr_sum1, self.arr_sum0)
+        arr_av2 = divide_protected(self.arr_sum2, self.arr_sum0)
+        return arr_av1, np.sqrt(arr_av2 - np.square(arr_av1))
+
+
     def add_event(self, raw, irec):
         logger.debug(info_ndarr(raw, 'add_event %3d raw' % irec))
         #raw = raw & M14
 
         cond_lo = raw<self.gate_lo
         cond_hi = raw>self.gate_hi
-        condlist = (np.logical_not(np.logical_or(cond_lo, cond_hi)),)
+        cond = np.logical_not(np.logical_or(cond_lo, cond_hi))
 
         raw_f64 = raw.astype(np.float64)
 
-        self.arr_sum0   += np.select(condlist, (self.arr1u64,), 0)
-        self.arr_sum1   += np.select(condlist, (raw_f64,), 0)
-        self.arr_sum2   += np.select(condlist, (np.square(raw_f64),), 0)
+        raw_f64 *= cond
+        self.arr_sum0   += cond
+        self.arr_sum1   += raw_f64
+        raw_f64 *= raw_f64
+        self.arr_sum2   += raw_f64
 
-        self.sta_int_lo += np.select((cond_lo,), (self.arr1u64,), 0)
-        self.sta_int_hi += np.select((cond_hi,), (self.arr1u64,), 0)
+        self.sta_int_lo += cond_lo
+        self.sta_int_hi += cond_hi
 
         np.maximum(self.arr_max, raw, out=self.arr_max)
         np.minimum(self.arr_min, raw, out=self.arr_min)
@@ -404,6 +414,234 @@ class DarkProc():
         return self.arr_av1, self.arr_rms, self.arr_sta
 
 
+class DarkProcStreaming(DarkProc):
+    """single-pass dark data accumulation and processing with O(1) frames of memory.
+
+       The 1st stage gates are evaluated without the block of nrecs1 frames.
+       Quantiles fraclo, 0.5, frachi and abs_dev=median(abs(raw-med)) are initialized
+       from the first NINIT frames and then updated for each record k by the stochastic approximation
+           q += C * s/k * (frac - (raw<q)),  s = max(1.4826*abs_dev, 0.5)
+           abs_dev *= exp(C_MAD * (0.5 - (abs(raw-med)<abs_dev)) / sqrt(k))
+       Gates are approximate and the nrecs1 frames are used for gating only.
+       At the 2nd stage the gated average and rms are accumulated with Welford's algorithm
+       using in-place masked adds.
+
+       Each MPI rank may process its own events, kwa comm (mpi4py communicator of these ranks,
+       e.g. ds.comms.bd_only_comm()) turns on the reduction of statistics in summary().
+       All ranks of comm have to call summary() the same number of times,
+       nrecs and nrecs1 are counted per rank.
+    """
+    NINIT  = 5   # number of frames to initialize quantile estimators
+    C_MED  = 4   # step scale for median
+    C_TAIL = 10  # step scale for fraclo and frachi quantiles
+    C_MAD  = 0.5 # log-step scale for abs_dev
+
+    def __init__(self, **kwa):
+        DarkProc.__init__(self, **kwa)
+        self.fraclo = kwa.get('fraclo', 0.05)
+        self.frachi = kwa.get('frachi', 0.95)
+        self.comm   = kwa.get('comm', None)
+        self.ninit  = max(min(self.NINIT, self.nrecs1), 1)
+        self.arr_sum0 = None
+
+
+    def init_quantiles(self):
+        logger.info(info_ndarr(self.block, 'Stage 1 initialization of quantile estimators from data block'))
+        self.arr_qlo, self.arr_med, self.arr_qhi =\
+            np.quantile(self.block, (self.fraclo, 0.5, self.frachi), axis=0).astype(np.float32)
+        self.abs_dev = np.maximum(np.median(np.abs(self.block - self.arr_med), axis=0), 0.5).astype(np.float32)
+        self.arr_max = self.block.max(axis=0)
+        self.arr_min = self.block.min(axis=0)
+        self.block = None
+
+
+    @staticmethod
+    def update_quantile(q, raw, frac, step):
+        """In-place stochastic approximation step q += step*(frac - (raw<q))."""
+        dq = np.float32(frac) - (raw<q)
+        dq *= step
+        q += dq
+
+
+    def update_quantiles(self, raw, irec):
+        raw_f32 = raw.astype(np.float32)
+        step = np.maximum(self.abs_dev*np.float32(1.4826), np.float32(0.5))
+        step /= irec+1
+        step_tail = step*np.float32(self.C_TAIL)
+        step *= np.float32(self.C_MED)
+        self.update_quantile(self.arr_qlo, raw_f32, self.fraclo, step_tail)
+        self.update_quantile(self.arr_qhi, raw_f32, self.frachi, step_tail)
+        dev = np.abs(raw_f32 - self.arr_med, out=step_tail)
+        self.update_quantile(self.arr_med, raw_f32, 0.5, step)
+        fup = np.exp(0.5*self.C_MAD/np.sqrt(irec+1))
+        self.abs_dev *= np.where(dev<self.abs_dev, np.float32(1/fup), np.float32(fup))
+        np.maximum(self.arr_max, raw, out=self.arr_max)
+        np.minimum(self.arr_min, raw, out=self.arr_min)
+
+
+    def proc_block(self):
+        """Converts estimated quantiles to gates, the same way as proc_block does for the block of frames."""
+        dtype_raw = self.arr_max.dtype
+        self.gate_lo = np.maximum(np.floor(self.arr_qlo), self.int_lo).astype(dtype_raw)
+        self.gate_hi = np.minimum(np.ceil(self.arr_qhi), self.int_hi).astype(dtype_raw)
+        self.gate_hi[self.gate_hi<=self.gate_lo] += 1
+        logger.info('1st stage streaming quantile estimation for %d records' % self.nrecs1\
+              +info_ndarr(self.arr_med, '\n  arr_med[100:105]', first=100, last=105)\
+              +info_ndarr(self.abs_dev, '\n  abs_dev[100:105]', first=100, last=105)\
+              +info_ndarr(self.gate_lo, '\n  gate_lo[100:105]', first=100, last=105)\
+              +info_ndarr(self.gate_hi, '\n  gate_hi[100:105]', first=100, last=105))
+        del self.arr_qlo, self.arr_qhi
+
+
+    def init_proc(self):
+
+        shape_raw = self.arr_med.shape
+        dtype_raw = self.gate_lo.dtype
+
+        logger.info('Stage 2 initialization for raw shape %s and dtype %s' % (str(shape_raw), str(dtype_raw)))
+
+        self.arr_sum0   = np.zeros(shape_raw, dtype=np.float64) # float counter for fast division
+        self.arr_mean   = np.zeros(shape_raw, dtype=np.float64)
+        self.arr_m2     = np.zeros(shape_raw, dtype=np.float64)
+
+        self.arr0       = np.zeros(shape_raw, dtype=dtype_raw)
+        self.arr1       = np.ones (shape_raw, dtype=dtype_raw)
+
+        self.sta_int_lo = np.zeros(shape_raw, dtype=np.uint64)
+        self.sta_int_hi = np.zeros(shape_raw, dtype=np.uint64)
+
+        self._delta     = np.empty(shape_raw, dtype=np.float64)
+        self._work      = np.empty(shape_raw, dtype=np.float64)
+        self.nrec2      = 0
+
+
+    def add_event(self, raw, irec):
+        logger.debug(info_ndarr(raw, 'add_event %3d raw' % irec))
+
+        cond_lo = raw<self.gate_lo
+        cond_hi = raw>self.gate_hi
+        cond = np.logical_not(np.logical_or(cond_lo, cond_hi))
+
+        # masked adds as multiplication by bool arrays, ufunc where= is much slower
+        delta, work = self._delta, self._work
+        self.arr_sum0 += cond
+        np.subtract(raw, self.arr_mean, out=delta)
+        delta *= cond
+        np.maximum(self.arr_sum0, 1, out=work)
+        np.divide(delta, work, out=work)
+        self.arr_mean += work
+        np.subtract(raw, self.arr_mean, out=work)
+        work *= delta
+        self.arr_m2 += work
+
+        self.sta_int_lo += cond_lo
+        self.sta_int_hi += cond_hi
+
+        np.maximum(self.arr_max, raw, out=self.arr_max)
+        np.minimum(self.arr_min, raw, out=self.arr_min)
+        self.nrec2 += 1
+
+
+    def event(self, raw, evnum):
+        logger.debug('event %d' % evnum)
+
+        if raw is None: return self.status
+
+        if self.block is None and self.irec < 0:
+           self.block=np.zeros((self.ninit,)+tuple(raw.shape), dtype=raw.dtype)
+
+        self.irec +=1
+        if self.irec < self.ninit:
+            self.accumulate_block(raw)
+            if self.irec == self.ninit-1: self.init_quantiles()
+
+        elif self.irec < self.nrecs1:
+            self.update_quantiles(raw, self.irec)
+
+        else:
+            if self.irec == self.nrecs1:
+                self.proc_block()
+                self.init_proc()
+                print('1st stage streaming processing is completed')
+            self.add_event(raw, self.irec)
+
+        if self.irec > self.nrecs-2:
+            logger.info('record %d event loop is terminated, --nrecs=%d' % (self.irec, self.nrecs))
+            self.status = 2
+
+        return self.status
+
+
+    def gated_counter(self):
+        return self.nrec2
+
+
+    def average_and_rms(self):
+        return self.arr_mean, np.sqrt(divide_protected(self.arr_m2, self.arr_sum0))
+
+
+    def reduce_statistics(self):
+        """Merges statistics of all ranks of self.comm. Ranks without 2nd stage statistics contribute nothing.
+           Average and M2 are merged as in Chan et al.: M2 = sum(M2_i + n_i*(mean_i - mean)**2).
+        """
+        from mpi4py import MPI
+        comm = self.comm
+        t0_sec = time()
+        has_stat = self.arr_sum0 is not None
+        shapes = [v for v in comm.allgather((self.arr_med.shape, self.gate_lo.dtype) if has_stat else None) if v is not None]
+        nrec = self.irec+1 # records of this rank
+        self.irec = comm.allreduce(nrec) - 1
+        if not shapes:
+            return
+
+        shape_raw, dtype_raw = shapes[0]
+        if not has_stat:
+            self.arr_med = np.zeros(shape_raw, dtype=np.float32)
+            self.abs_dev = np.zeros(shape_raw, dtype=np.float32)
+            self.gate_lo = np.ones(shape_raw, dtype=dtype_raw) * np.iinfo(dtype_raw).max
+            self.gate_hi = np.zeros(shape_raw, dtype=dtype_raw)
+            if nrec == 0:
+                self.arr_max = np.zeros(shape_raw, dtype=dtype_raw)
+                self.arr_min = np.ones(shape_raw, dtype=dtype_raw) * np.iinfo(dtype_raw).max
+            elif self.block is not None: # frames of the not completed initialization block
+                self.arr_max = self.block[:nrec].max(axis=0)
+                self.arr_min = self.block[:nrec].min(axis=0)
+                self.block = None
+            self.init_proc()
+
+        def allreduce(arr, op=MPI.SUM):
+            comm.Allreduce(MPI.IN_PLACE, arr, op=op)
+            return arr
+
+        nranks = comm.allreduce(int(has_stat))
+        self.arr_med = allreduce(self.arr_med) / nranks
+        self.abs_dev = allreduce(self.abs_dev) / nranks
+        allreduce(self.gate_lo, MPI.MIN)
+        allreduce(self.gate_hi, MPI.MAX)
+        allreduce(self.arr_max, MPI.MAX)
+        allreduce(self.arr_min, MPI.MIN)
+        allreduce(self.sta_int_lo)
+        allreduce(self.sta_int_hi)
+        self.nrec2 = comm.allreduce(self.nrec2)
+
+        n_i = self.arr_sum0.astype(np.float64)
+        mean_i = self.arr_mean
+        arr_sum0 = allreduce(self.arr_sum0.copy())
+        arr_mean = divide_protected(allreduce(n_i*mean_i), arr_sum0)
+        self.arr_m2 = allreduce(self.arr_m2 + n_i*np.square(mean_i - arr_mean))
+        self.arr_sum0, self.arr_mean = arr_sum0, arr_mean
+        logger.info('statistics of %d ranks is reduced in %.3f sec' % (nranks, time()-t0_sec))
+
+
+    def summary(self):
+        if self.comm is not None: self.reduce_statistics()
+        if self.arr_sum0 is None:
+            logger.warning('%d records is not enough for 1st stage processing --nrecs1=%d there are no arrays to save...'\
+                           % (self.irec+1, self.nrecs1))
+            return
+        DarkProc.summary(self)
+
+
 def plot_image(nda, tit=''):
     """Plots averaged image
     """
@@ -544,12 +782,19 @@ def pedestals_calibration(**kwa):
   dirmode = kwa.get('dirmode', 0o777)
   filemode= kwa.get('filemode', 0o666)
   logmode = kwa.get('logmode', 'INFO')
+  streaming = kwa.get('streaming', False)
 
   #procname = sys._getframe().f_code.co_name # pedestals_calibration
   procname = sys.argv[0].rsplit('/')[-1]
   #save_log_record_at_start(dirrepo, procname, dirmode, filemode, tsfmt='%Y-%m-%dT%H:%M:%S%z')
 
   ds = DataSource(**datasource_kwargs(**kwa))
+  comm, is_root = None, True
+  if streaming and ds.is_mpi():
+      from mpi4py import MPI
+      comm = ds.comms.bd_only_comm()
+      # smd0 and eb ranks are not in bd_only_comm (MPI.COMM_NULL), they get no steps
+      is_root = comm != MPI.COMM_NULL and comm.Get_rank() == 0
 
   t0_sec = time()
   tdt = t0_sec
@@ -601,7 +846,7 @@ def pedestals_calibration(**kwa):
 
 
       if dpo is None:
-         dpo = DarkProc(**kwa)
+         dpo = DarkProcStreaming(comm=comm, **kwa) if streaming else DarkProc(**kwa)
          dpo.runnum = orun.runnum
          dpo.exp = expname
          dpo.ts_run, dpo.ts_now = ts_run, ts_now #uc.tstamps_run_and_now(env, fmt=uc.TSTAMP_FORMAT)
@@ -655,15 +900,19 @@ def pedestals_calibration(**kwa):
       if ievt < events: logger.info('==== Ev:%04d end of events in run %d step %d'%\
                                      (ievt, orun.runnum, istep))
 
-      if True:
-          dpo.summary()
+      dpo.summary()
+      if comm is not None:
+          # nrecs and events are counted per rank, all ranks stop after the same step
+          # because the next summary() is collective
+          break_loop = comm.allreduce(break_loop, op=MPI.LOR)
+      if is_root:
           ctypes = ('pedestals', 'pixel_rms', 'pixel_status')
           consts = arr_av1, arr_rms, arr_sta = dpo.constants_av1_rms_sta()
           dic_consts = dict(zip(ctypes, consts))
           kwa_depl = add_metadata_kwargs(orun, odet, **kwa)
           deploy_constants(dic_consts, **kwa_depl)
-          del(dpo)
-          dpo=None
+      del(dpo)
+      dpo=None
 
       if break_loop:
         logger.info('terminate_steps')
@@ -15,6 +15,12 @@ Usage::
     ucm.common_mode_rows_hsplit_nbanks(data, mask, nbanks=4, cormax=None)
     ucm.common_mode_2d_hsplit_nbanks(data, mask, nbanks=4, cormax=None)
 
+    # batched over all panels (..., <rows>, <cols>) and banks in one call
+    ucm.common_mode_rows_nbanks(arr, mask=None, nbanks=8, cormax=None, npix_min=10)
+    ucm.common_mode_cols_nbanks(arr, mask=None, nbanks=2, cormax=None, npix_min=10)
+    ucm.common_mode_banks(arr, mask=None, nbanks_rows_cols=(2,8), cormax=None, npix_min=10)
+    ucm.common_mode_apply(arrf, mask, cmpars=(0,7,100,10), nbanks_rows_cols=(2,8))
+
 This software was developed for the LCLS project.
 If you use all or part of it, please give an appropriate acknowledgment.
 
@@ -141,16 +147,98 @@ def common_mode_2d_hsplit_nbanks(data, mask=None, nbanks=4, cormax=None, npix_mi
     data[:] = np.hstack(bdata)[:]
 
 
+def masked_median(arr, good=None):
+    """Returns median along the last axis of arr and number of good pixels (None if good is None).
+       Median over good pixels is evaluated for all slices at once by sorting with bad pixels set to inf,
+       it is 0 for slices without good pixels.
+       - arr (float) - n-d array of intensities
+       - good (bool or None) - the same shape n-d array of good pixels
+    """
+    if good is None:
+        return np.median(arr, axis=-1), None
+    npix = np.count_nonzero(good, axis=-1)
+    sarr = np.where(good, arr, np.inf)
+    sarr.sort(axis=-1)
+    ilo = (np.maximum(npix, 1) - 1)//2
+    ihi = np.maximum(npix, 1)//2
+    cmode = 0.5*(np.take_along_axis(sarr, ilo[...,None], axis=-1)[...,0]\
+               + np.take_along_axis(sarr, ihi[...,None], axis=-1)[...,0])
+    cmode[npix==0] = 0
+    return cmode, npix
+
+
+def common_mode_groups(arr, mask, shape, axes, cormax=None, npix_min=10, npix_inclusive=False):
+    """Applies median common mode correction to groups of pixels of arr in one call.
+       arr is reshaped to shape (without copy for contiguous arr) and the groups are pixels along axes.
+       I/O parameters:
+       - arr (float) - i/o n-d array of intensities
+       - mask (int or None) - the same shape array of bad/good = 0/1 pixels
+       - shape (tuple) - shape of arr with rows and/or cols split in banks
+       - axes (tuple) - sorted axes of shape which are reduced in the group
+       - cormax (float or None) - maximal allowed correction in ADU
+       - npix_min (int) - minimal number of good pixels in group to evaluate and apply correction
+       - npix_inclusive (bool) - correction is applied for npix>=npix_min if True, npix>npix_min otherwise
+    """
+    axes = tuple(axes)
+    keep = tuple(i for i in range(len(shape)) if i not in axes)
+    carr = np.ascontiguousarray(arr)
+    v = carr.reshape(shape)
+    gshape = tuple(shape[i] for i in keep) + (-1,)
+    good = None if mask is None else (np.asarray(mask)>0).reshape(shape)
+
+    cmode, npix = masked_median(v.transpose(keep + axes).reshape(gshape),\
+                                None if good is None else good.transpose(keep + axes).reshape(gshape))
+    if npix is not None:
+        cmode = np.where((npix >= npix_min) if npix_inclusive else (npix > npix_min), cmode, 0)
+    if cormax is not None:
+        cmode = np.where(np.fabs(cmode) < cormax, cmode, 0)
+
+    cmode = np.expand_dims(cmode, axes).astype(v.dtype)
+    if good is None:
+        v -= cmode
+    else:
+        np.subtract(v, cmode, out=v, where=good)
+    if carr is not arr: arr[:] = carr
+
+
+def common_mode_rows_nbanks(arr, mask=None, nbanks=1, cormax=None, npix_min=10):
+    """The same as common_mode_rows_hsplit_nbanks for all 2-d panels of arr shape=(..., <rows>, <cols>) in one call.
+    """
+    sh = arr.shape
+    shape = sh[:-1] + (nbanks, sh[-1]//nbanks)
+    common_mode_groups(arr, mask, shape, (len(shape)-1,), cormax, npix_min)
+
+
+def common_mode_cols_nbanks(arr, mask=None, nbanks=1, cormax=None, npix_min=10):
+    """The same as common_mode_cols for each of nbanks vsplit banks of all 2-d panels of arr shape=(..., <rows>, <cols>) in one call.
+    """
+    sh = arr.shape
+    shape = sh[:-2] + (nbanks, sh[-2]//nbanks, sh[-1])
+    common_mode_groups(arr, mask, shape, (len(shape)-2,), cormax, npix_min)
+
+
+def common_mode_banks(arr, mask=None, nbanks_rows_cols=(2,8), cormax=None, npix_min=10):
+    """The same as common_mode_2d for each of (nbanks-rows x nbanks-cols) banks
+       of all 2-d panels of arr shape=(..., <rows>, <cols>) in one call.
+    """
+    nbr, nbc = nbanks_rows_cols
+    sh = arr.shape
+    shape = sh[:-2] + (nbr, sh[-2]//nbr, nbc, sh[-1]//nbc)
+    n = len(shape)
+    common_mode_groups(arr, mask, shape, (n-3, n-1), cormax, npix_min, npix_inclusive=True)
+
+
 def common_mode_apply(arrf, mask, cmpars=(0,7,100,10), nbanks_rows_cols=(2,8)):
     """Applies common mode correction to arrf (=raw-peds), shape=(<number-of-segments>, 704, 768).
     Example of epix100: shape=(1, 704, 768), nbanks_rows_cols=(2,8).
     If multiple correction is selected it is applied in particular order - in banks, in rows per bank, in columns per bank.
+    Each correction is applied to all segments and banks in one call.
 
     Parameters
     ----------
 
        arrf (ndarray, float) - I/O array of pedestal subtracted intensities (raw-peds).
-       mask (ndarray, int16) - mask array of 0/1 shaped as arrf.
+       mask (ndarray, int16) - mask array of 0/1 shaped as arrf or None.
        cmpars (tuple) - common mode parameters
           [0] - (int) algorithm number - currently this number does not matter, median algorithm is used everywhere.
           [1] - (uint) mode bitword - 1/2/4 : correction applied in rows per bank / columns per bank / banks.
@@ -164,20 +252,14 @@ def common_mode_apply(arrf, mask, cmpars=(0,7,100,10), nbanks_rows_cols=(2,8)):
     npixmin = cmpars[3] if len(cmpars)>3 else 10
 
     nbr, nbc = nbanks_rows_cols
-    hrows = int(arrf.shape[1]/nbr) # 704/2=352
-
-    if mode>0:
-      for s in range(arrf.shape[0]):
 
-        if mode & 4: # in banks: (704/2,768/8)=(352,96) pixels
-          common_mode_2d_hsplit_nbanks(arrf[s,:hrows,:], mask=mask[s,:hrows,:], nbanks=nbc, cormax=cormax, npix_min=npixmin)
-          common_mode_2d_hsplit_nbanks(arrf[s,hrows:,:], mask=mask[s,hrows:,:], nbanks=nbc, cormax=cormax, npix_min=npixmin)
+    if mode & 4: # in banks: (704/2,768/8)=(352,96) pixels
+        common_mode_banks(arrf, mask=mask, nbanks_rows_cols=nbanks_rows_cols, cormax=cormax, npix_min=npixmin)
 
-        if mode & 1: # in rows per bank: 768/8 = 96 pixels # ?ms
-          common_mode_rows_hsplit_nbanks(arrf[s,], mask=mask[s,], nbanks=nbc, cormax=cormax, npix_min=npixmin)
+    if mode & 1: # in rows per bank: 768/8 = 96 pixels
+        common_mode_rows_nbanks(arrf, mask=mask, nbanks=nbc, cormax=cormax, npix_min=npixmin)
 
-        if mode & 2: # in cols per bank: 704/2 = 352 pixels # ?ms
-          common_mode_cols(arrf[s,:hrows,:], mask=mask[s,:hrows,:], cormax=cormax, npix_min=npixmin)
-          common_mode_cols(arrf[s,hrows:,:], mask=mask[s,hrows:,:], cormax=cormax, npix_min=npixmin)
+    if mode & 2: # in cols per bank: 704/2 = 352 pixels
+        common_mode_cols_nbanks(arrf, mask=mask, nbanks=nbr, cormax=cormax, npix_min=npixmin)
 
 # EOF
@@ -16,6 +16,8 @@ Usage::
     cbits = cbits_config_and_data_detector_epix10ka(det_raw, evt=None)  # used in det.raw._cbits_config_and_data_detector(evt)
     cbits = cbits_config_and_data_detector_epixhr2x2(det_raw, evt=None) # used in det.raw._cbits_config_and_data_detector(evt)
     maps = gain_maps_epix10ka_any(det_raw, evt=None)
+    grinds = gain_range_index_epix10ka_any(det_raw, evt=None)
+    tab = constants_table_for_grinds(cons, default=0)
     s = def info_gain_mode_arrays(gmaps, first=0, last=5)
     gmstatist = pixel_gain_mode_statistics(gmaps)
     s = info_pixel_gain_mode_statistics(gmaps)
@@ -30,6 +32,7 @@ Usage::
     calib = calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa)
     calib = calib_epix10ka_any(det_raw, evt, cmpars=(7,2,100,10),\
                             mbits=0o7, mask=None, edge_rows=10, edge_cols=10, center_rows=5, center_cols=5)
+    calib = calib_epix10ka_any(det_raw, evt, out=np.empty(raw.shape, dtype=np.float32))
 
 This software was developed for the LCLS project.
 If you use all or part of it, please give an appropriate acknowledgment.
@@ -47,8 +50,7 @@ logger = logging.getLogger(__name__)
 
 from psana.detector.NDArrUtils import info_ndarr, divide_protected
 from psana.detector.UtilsMask import merge_masks, DTYPE_MASK
-from psana.detector.UtilsCommonMode import common_mode_cols,\
-  common_mode_rows_hsplit_nbanks, common_mode_2d_hsplit_nbanks
+from psana.detector.UtilsCommonMode import common_mode_apply
 
 GAIN_MODES    = ['FH','FM','FL','AHL-H','AML-M','AHL-L','AML-L']
 GAIN_MODES_IN = ['FH','FM','FL','AHL-H','AML-M']
@@ -72,6 +74,15 @@ class Storage:
         self.mask = None
         self.dcfg = None
         self.counter = -1
+        self.gain = None    # gain constants of ptab and gtab
+        self.peds = None    # pedestal constants of ptab and gtab
+        self.ptab = None    # pedestals table (<npixels>, NGAIN_LUT)
+        self.gtab = None    # gain factors table (<npixels>, NGAIN_LUT)
+        self.pixoffs = None # offsets of pixel rows in ptab and gtab
+        self.inds = None    # per event indices in ptab and gtab
+        self.pedest = None  # per event pedestals
+        self.factor = None  # per event gain factors
+        self.rawm = None    # per event raw data without gain bit
 
 dic_store = {} # {det.name:Storage()} in stead of singleton
 
@@ -270,6 +281,43 @@ def gain_maps_epix10ka_any(det_raw, evt=None):
            (cbitsM60 == 32)
 
 
+def gain_range_index_lut():
+    """Returns lookup table shape=(64,) dtype=uint8 of the gain range index [0,6] (7 for none)
+       for control bits & 0o77, the same as np.select over gain_maps_epix10ka_any.
+    """
+    cbits = np.arange(64)
+    return np.select(((cbits & 28) == 28,\
+                      (cbits & 28) == 12,\
+                      (cbits & 12) ==  8,\
+                      (cbits & 60) == 16,\
+                      (cbits & 60) ==  0,\
+                      (cbits & 60) == 48,\
+                      (cbits & 60) == 32), (0, 1, 2, 3, 4, 5, 6), default=7).astype(np.uint8)
+
+NGAIN_LUT = 8 # 7 gain ranges and one for pixels without gain range
+GAIN_RANGE_INDEX_LUT = gain_range_index_lut()
+GAIN_HM_LUT = np.array((1, 1, 0, 1, 1, 0, 0, 0), dtype=np.uint8) # 1 for H and M gain ranges FH,FM,AHL-H,AML-M
+
+
+def gain_range_index_epix10ka_any(det_raw, evt=None):
+    """Returns array of per pixel gain range indices [0,6] (7 for none) shape=(<number-of-segments>, <2-d-panel-shape>)
+       dtype=uint8 from a single table lookup of control bits, see gain_maps_epix10ka_any.
+    """
+    cbits = det_raw._cbits_config_and_data_detector(evt)
+    if cbits is None: return None
+    return GAIN_RANGE_INDEX_LUT[cbits & 63]
+
+
+def constants_table_for_grinds(cons, default=0):
+    """Returns contiguous table shape=(<number-of-pixels>, NGAIN_LUT) dtype=float32 of per pixel constants
+       for gain range index from 4d constants (7, <nsegs>, 352, 384). Column 7 is filled with default.
+    """
+    ngr = cons.shape[0]
+    tab = np.full((cons[0].size, NGAIN_LUT), default, dtype=np.float32)
+    tab[:,:ngr] = cons.reshape((ngr, -1)).T
+    return tab
+
+
 def info_gain_mode_arrays(gmaps, first=0, last=5):
     """ gr0, gr1, gr2, gr3, gr4, gr5, gr6 = gmaps
     """
@@ -292,6 +340,12 @@ def info_pixel_gain_mode_statistics(gmaps):
     return ', '.join(['%7d' % npix for npix in grp_stat])
 
 
+def pixel_gain_mode_statistics_for_grinds(grinds):
+    """returns statistics of pixels in defferent gain modes in array of gain range indices
+    """
+    return list(np.bincount(grinds.ravel(), minlength=NGAIN_LUT)[:len(GAIN_MODES)])
+
+
 def info_pixel_gain_mode_statistics_for_raw(det_raw, evt=None, msg='pixel gain mode statistics: '):
     """DOES ANYONE USE IT?
        returns (str) with statistics of pixels in defferent gain modes in raw data
@@ -436,7 +490,7 @@ def test_event_constants_for_gmaps(det_raw, evt, gfac, peds):
     return factor, pedest
 
 
-def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
+def calib_epix10ka_any(det_raw, evt, cmpars=None, out=None, **kwa): #cmpars=(7,2,100)):
     """
     Algorithm
     ---------
@@ -446,6 +500,10 @@ def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
     - applys common mode correction if turned on
     - apply gain factor
 
+    Per event pedestals and gain factors are gathered by gain range index from
+    per pixel tables (see constants_table_for_grinds) made once per detector
+    and remade when det_raw returns other pedestals or gain constants.
+
     Parameters
     ----------
     - det_raw (psana.Detector.raw) - Detector.raw object
@@ -456,6 +514,7 @@ def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
             alg is not used
             mode =0-correction is not applied, =1-in rows, =2-in cols-WORKS THE BEST
             i.e: cmpars=(7,0,100) or (7,2,100)
+    - out (np.ndarray) - optional float32 array shaped as raw for calibrated data
     - **kwa - used here and passed to det_raw.mask_comb
       - nda_raw - substitute for det_raw.raw(evt)
       - mbits - parameter of the det_raw.mask_comb(...)
@@ -463,7 +522,7 @@ def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
 
     Returns
     -------
-      - calibrated epix10ka data
+      - calibrated epix10ka data dtype=float32 (out if specified)
     """
 
     logger.debug('in calib_epix10ka_any')
@@ -474,6 +533,10 @@ def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
     raw = det_raw.raw(evt) if nda_raw is None else nda_raw # shape:(352, 384) or suppose to be later (<nsegs>, 352, 384) dtype:uint16
     if raw is None: return None
 
+    if out is not None and (out.shape != raw.shape or out.dtype != np.float32):
+        raise ValueError('out array shape=%s dtype=%s is not float32 shaped as raw %s'\
+                         % (str(out.shape), str(out.dtype), str(raw.shape)))
+
     _cmpars  = det_raw._common_mode() if cmpars is None else cmpars
 
     gain = det_raw._gain()      # - 4d gains  (7, <nsegs>, 352, 384)
@@ -484,50 +547,57 @@ def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
     store = dic_store.get(det_raw._det_name, None)
 
     if store is None:
-
         logger.info('create new store for %s' % det_raw._det_name)
         store = dic_store[det_raw._det_name] = Storage()
 
-        # do ONCE this initialization
+    if store.gain is not gain or store.peds is not peds:
+
+        # tables are made for the first event and for new constants
         logger.debug(info_ndarr(raw,  '\n  raw ')\
                     +info_ndarr(gain, '\n  gain')\
                     +info_ndarr(peds, '\n  peds'))
 
-        store.gfac = divide_protected(np.ones_like(gain), gain)
-        store.arr1 = np.ones_like(raw, dtype=np.int8)
+        gfac = divide_protected(np.ones_like(gain), gain)
 
-        logger.debug(info_ndarr(store.gfac,  '\n  gfac '))
+        logger.debug(info_ndarr(gfac,  '\n  gfac '))
 
         # 'FH','FM','FL','AHL-H','AML-M','AHL-L','AML-L'
         #store.gf4 = np.ones_like(raw, dtype=np.int32) * 0.25 # 0.3333 # M - perefierial
         #store.gf6 = np.ones_like(raw, dtype=np.int32) * 1    # L - center
 
-    gfac = store.gfac
+        store.gain, store.peds = gain, peds
+        store.ptab = constants_table_for_grinds(peds, default=0)
+        store.gtab = constants_table_for_grinds(gfac, default=1)
 
-    #if store.dcfg is None: store.dcfg = det_raw._config_object() #config_object_det_raw(det_raw)
-
-    gmaps = gain_maps_epix10ka_any(det_raw, evt) #tuple: 7 x shape:(4, 352, 384)
-    if gmaps is None: return None
+    if store.rawm is None or store.rawm.shape != raw.shape or store.rawm.dtype != raw.dtype:
+        # per event buffers shaped as raw
+        store.arr1 = np.ones_like(raw, dtype=np.int8)
+        store.pixoffs = np.arange(raw.size, dtype=np.intp) * NGAIN_LUT
+        store.inds = np.empty(raw.size, dtype=np.intp)
+        store.pedest = np.empty(raw.shape, dtype=np.float32)
+        store.factor = np.empty(raw.shape, dtype=np.float32)
+        store.rawm = np.empty(raw.shape, dtype=raw.dtype)
+        store.mask = None
 
-    factor = np.select(gmaps,\
-                       (gfac[0,:], gfac[1,:], gfac[2,:], gfac[3,:],\
-                        gfac[4,:], gfac[5,:], gfac[6,:]), default=1) # 2msec
+    #if store.dcfg is None: store.dcfg = det_raw._config_object() #config_object_det_raw(det_raw)
 
-    pedest = np.select(gmaps,\
-                       (peds[0,:], peds[1,:], peds[2,:], peds[3,:],\
-                        peds[4,:], peds[5,:], peds[6,:]), default=0)
+    grinds = gain_range_index_epix10ka_any(det_raw, evt) # shape:(4, 352, 384) dtype:uint8
+    if grinds is None: return None
 
-    #factor, pedest = test_event_constants_for_gmaps(det_raw, evt, gfac, peds) # 6msec
-    #factor, pedest = test_event_constants_for_grinds(det_raw, evt, gfac, peds) # 12msec
+    # gather per event constants from the (pixel, gain range) tables
+    np.add(store.pixoffs, grinds.ravel(), out=store.inds)
+    factor = np.take(store.gtab, store.inds, out=store.factor.reshape(-1), mode='clip').reshape(raw.shape)
+    pedest = np.take(store.ptab, store.inds, out=store.pedest.reshape(-1), mode='clip').reshape(raw.shape)
 
     store.counter += 1
     if not store.counter%100:
-        logger.debug(info_gain_mode_arrays(gmaps))
-        logger.debug(info_pixel_gain_mode_statistics(gmaps))
+        logger.debug('pixel gain mode statistics: %s' % ', '.join(['%7d' % npix for npix in pixel_gain_mode_statistics_for_grinds(grinds)]))
 
     logger.debug('TOTAL consumed time (sec = %.6f' % (time()-t0_sec_tot))
 
-    arrf = np.array(raw & det_raw._data_bit_mask, dtype=np.float32) - pedest
+    arrf = np.empty(raw.shape, dtype=np.float32) if out is None else out
+    np.bitwise_and(raw, det_raw._data_bit_mask, out=store.rawm)
+    np.subtract(store.rawm, pedest, out=arrf)
 
     logger.debug('common-mode correction parameters cmpars: %s' % str(_cmpars))
 
@@ -548,35 +618,21 @@ def calib_epix10ka_any(det_raw, evt, cmpars=None, **kwa): #cmpars=(7,2,100)):
       npixmin = _cmpars[3] if len(_cmpars)>3 else 10
       if mode>0:
         t0_sec_cm = time()
-        arr1 = store.arr1 # np.ones_like(mask, dtype=np.uint8)
-        gr0, gr1, gr2, gr3, gr4, gr5, gr6 = gmaps
-        grhm = np.select((gr0,  gr1,  gr3,  gr4), (arr1, arr1, arr1, arr1), default=0) if alg==7 else arr1
+        grhm = GAIN_HM_LUT[grinds] if alg==7 else store.arr1
         gmask = np.bitwise_and(grhm, mask) if mask is not None else grhm
-        #logger.debug(info_ndarr(arr1, '\n  arr1'))
         #logger.debug(info_ndarr(grhm, 'XXXX grhm'))
         #logger.debug(info_ndarr(gmask, 'XXXX gmask'))
-        #logger.debug('common-mode mask massaging (sec) = %.6f' % (time()-t2_sec_cm)) # 5msec
         logger.debug(info_ndarr(gmask, 'gmask')\
                      + '\n  per panel statistics of cm-corrected pixels: %s' % str(np.sum(gmask, axis=(1,2), dtype=np.uint32)))
 
-        #sh = (nsegs, 352, 384)
-        hrows = 176 # int(352/2)
-        for s in range(arrf.shape[0]):
-
-          if mode & 4: # in banks: (352/2,384/8)=(176,48) pixels
-            common_mode_2d_hsplit_nbanks(arrf[s,:hrows,:], mask=gmask[s,:hrows,:], nbanks=8, cormax=cormax, npix_min=npixmin)
-            common_mode_2d_hsplit_nbanks(arrf[s,hrows:,:], mask=gmask[s,hrows:,:], nbanks=8, cormax=cormax, npix_min=npixmin)
-
-          if mode & 1: # in rows per bank: 384/8 = 48 pixels # 190ms
-            common_mode_rows_hsplit_nbanks(arrf[s,], mask=gmask[s,], nbanks=8, cormax=cormax, npix_min=npixmin)
-
-          if mode & 2: # in cols per bank: 352/2 = 176 pixels # 150ms
-            common_mode_cols(arrf[s,:hrows,:], mask=gmask[s,:hrows,:], cormax=cormax, npix_min=npixmin)
-            common_mode_cols(arrf[s,hrows:,:], mask=gmask[s,hrows:,:], cormax=cormax, npix_min=npixmin)
+        # all segments in one call, banks: (352/2,384/8)=(176,48) pixels # rows: 190ms, cols: 150ms in per-segment loop
+        common_mode_apply(arrf, gmask, cmpars=(alg, mode, cormax, npixmin), nbanks_rows_cols=(2,8))
 
         logger.debug('TIME common-mode correction = %.6f sec for cmp=%s' % (time()-t0_sec_cm, str(_cmpars)))
 
-    return arrf * factor if mask is None else arrf * factor * mask # gain correction
+    np.multiply(arrf, factor, out=arrf) # gain correction
+    if mask is not None: np.multiply(arrf, mask, out=arrf)
+    return arrf
 
 
 def map_gain_range_index(det_raw, evt, **kwa):
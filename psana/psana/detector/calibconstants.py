@@ -29,6 +29,7 @@ Usage::
   v = o.pix_rc()
   v = o.pix_xyz()
   v = o.interpol_pars()
+  v = o.image_assembler(mapmode=2, fillholes=True)
 
 2022-07-07 created by Mikhail Dubrovin
 """
@@ -44,13 +45,17 @@ from psana.pscalib.geometry.GeometryAccess import GeometryAccess  # img_from_pix
 
 from psana.detector.UtilsAreaDetector import dict_from_arr3d, arr3d_from_dict,\
         img_from_pixel_arrays, statistics_of_pixel_arrays, img_multipixel_max, img_multipixel_mean,\
-        img_interpolated, init_interpolation_parameters, statistics_of_holes, fill_holes
+        img_interpolated, init_interpolation_parameters, statistics_of_holes, fill_holes, ImageAssembler
 
 import psana.detector.Utils as ut
 #import psana.pscalib.calib.CalibConstants as ccc
 from psana.detector.UtilsMask import DTYPE_MASK, DTYPE_STATUS
 #is_none = ut.is_none
 
+def _hashable(v):
+    return tuple(v) if isinstance(v, (list, np.ndarray)) else v
+
+
 class CalibConstants:
 
     def __init__(self, calibconst, **kwa):
@@ -75,8 +80,10 @@ class CalibConstants:
         self._mask_calib = None
 
         self._pix_rc = None, None
+        self._pix_rc_key = None
         self._pix_xyz = None, None, None
         self._interpol_pars = None
+        self._image_assemblers = {} # (mapmode, fillholes) : ImageAssembler for self._pix_rc
 
 
     def calibconst(self):
@@ -225,6 +232,7 @@ class CalibConstants:
 
         rows, cols = self._pix_rc = [reshape_to_3d(a)[segnums,:,:] for a in resp]
         #self._pix_rc = [dict_from_arr3d(reshape_to_3d(v)) for v in resp]
+        self._image_assemblers = {}
 
         s = 'evaluate_pixel_coord_indexes:'
         for i,a in enumerate(self._pix_rc): s += info_ndarr(a, '\n  %s '%('rows','cols')[i], last=3)
@@ -284,15 +292,22 @@ class CalibConstants:
         vbase: float, optional, default: 0
             value substituted for all image map bins without entry from data.
 
+        out: np.array, ndim=2, optional, default: None
+            image-shaped float32 array to fill and return for mapmode 1/2/3, e.g. image of previous event.
+
         Returns
         -------
         image: np.array, ndim=2
         """
         logger.debug('in CalibConstants.image')
 
-        if any(v is None for v in self._pix_rc):
+        # pixel indexes are re-evaluated if segments or geometry parameters change
+        pix_rc_key = (None if segnums is None else tuple(np.ravel(segnums)),)\
+                   + tuple(_hashable(kwa.get(k,None)) for k in ('pix_scale_size_um', 'xy0_off_pix', 'do_tilt', 'cframe', 'mapmode', 'fillholes'))
+        if any(v is None for v in self._pix_rc) or pix_rc_key != self._pix_rc_key:
             self.cached_pixel_coord_indexes(segnums, **kwa)
             if any(v is None for v in self._pix_rc): return None
+            self._pix_rc_key = pix_rc_key
 
         vbase     = kwa.get('vbase',0)
         mapmode   = kwa.get('mapmode',2)
@@ -307,17 +322,23 @@ class CalibConstants:
         logger.debug(info_ndarr(rows, 'rows ', last=3))
         logger.debug(info_ndarr(cols, 'cols ', last=3))
 
-        img = img_from_pixel_arrays(rows, cols, weight=nda, vbase=vbase) # mapmode==1
-        if   mapmode==2: img_multipixel_max(img, nda, self.dmulti_pix_to_img_idx)
-        elif mapmode==3: img_multipixel_mean(img, nda, self.dmulti_pix_to_img_idx, self.dmulti_imgidx_numentries)
+        if mapmode<4:
+            return self.image_assembler(mapmode, fillholes).image(nda, vbase=vbase, out=kwa.get('out',None))
 
-        if mapmode<4 and fillholes: fill_holes(img, self.hole_rows, self.hole_cols)
-
-        return img if mapmode<4 else\
-               img_interpolated(nda, self._cached_interpol_pars()) if mapmode==4 else\
+        return img_interpolated(nda, self._cached_interpol_pars()) if mapmode==4 else\
                self.img_entries
 
 
+    def image_assembler(self, mapmode=2, fillholes=True):
+        """Returns cached ImageAssembler for mapmode 1/2/3 and current pixel indexes self._pix_rc"""
+        key = (mapmode, fillholes)
+        a = self._image_assemblers.get(key, None)
+        if a is None:
+            rows, cols = self._pix_rc
+            a = self._image_assemblers[key] = ImageAssembler(rows, cols, mapmode=mapmode, fillholes=fillholes)
+        return a
+
+
     def pix_rc(self): return self._pix_rc
 
     def pix_xyz(self): return self._pix_xyz
@@ -43,6 +43,7 @@ class DetectorImpl(object):
         self._configs           = configinfo.configs
         self._calibconst        = calibconst
         self._sorted_segment_ids= configinfo.sorted_segment_ids
+        self._segment_id_set    = set(self._sorted_segment_ids)
         self._uniqueid          = configinfo.uniqueid
         self._dettype           = configinfo.dettype
         self._env_store         = env_store
@@ -66,17 +67,13 @@ class DetectorImpl(object):
         Look in the event to find all the dgrams for our detector/drp_class
         e.g. (xppcspad,raw) or (xppcspad,fex)
         """
-        key = (self._det_name,self._drp_class_name)
-        if key in evt._det_segments:
-            # check that all promised segments have been received
-            evt_segments = list(evt._det_segments[key].keys())
-            evt_segments.sort()
-            if evt_segments != self._sorted_segment_ids:
-                return None
-            else:
-                return evt._det_segments[key]
-        else:
+        segs = evt._get_det_segments(self._det_name,self._drp_class_name)
+        if segs is None:
             return None
+        # check that all promised segments have been received
+        if len(segs) != len(self._sorted_segment_ids) or segs.keys() != self._segment_id_set:
+            return None
+        return segs
 
     def _info(self,evt):
         # check for missing data
@@ -1,7 +1,9 @@
 import sys, os
 import time
+import mmap
 import getopt
 import pprint
+import weakref
 
 try:
     # doesn't exist on macos
@@ -9,6 +11,7 @@ try:
 except:
     pass
 from psana import dgram
+from psana.parallelreader import ParallelReader
 from psana.event import Event
 from psana.detector import detectors
 from psana.psexp.event_manager import TransitionId
@@ -42,6 +45,32 @@ def _dgSize(view):
     txSize = 3 * 4              # sizeof(XtcData::TransitionBase)
     return txSize + np.array(view, copy=False).view(dtype=np.uint32)[iExt]
 
+class ShmemLeases(object):
+    """ Reference-counted leases on shmem buffers for zero-copy L1Accepts.
+
+    A leased buffer is wrapped (not copied) in a numpy array, which becomes
+    the base object of the dgram and of all arrays built from it in dgram.cc.
+    The buffer is returned to the shmem server with freeByIndex when the last
+    python reference to it goes away. At most max_leases buffers are held,
+    beyond that lease() returns None and the caller copies the datagram.
+    """
+    def __init__(self, max_leases):
+        self.max_leases = max_leases
+        self.n_leases = 0
+
+    def lease(self, shmem_cli, view, index, size):
+        if self.n_leases >= self.max_leases:
+            return None
+        arr = np.frombuffer(view, dtype=np.uint8, count=_dgSize(view))
+        # the finalizer keeps shmem_cli alive until all its buffers are freed
+        weakref.finalize(arr, self._release, shmem_cli, index, size)
+        self.n_leases += 1
+        return arr
+
+    def _release(self, shmem_cli, index, size):
+        self.n_leases -= 1
+        shmem_cli.freeByIndex(index, size)
+
 class DgramManager(object):
 
     def __init__(self, xtc_files, configs=[], fds=[],
@@ -54,7 +83,10 @@ class DgramManager(object):
         self.shmem_cli = None
         self.shmem_kwargs = {'index':-1,'size':0,'cli_cptr':None}
         self.configs = []
-        self._timestamps = [] # built when iterating
+        self._timestamps = np.zeros(64, dtype=np.uint64) # built when iterating
+        self.n_timestamps = 0
+        # Keeps only the last PS_DM_MAX_TIMESTAMPS timestamps (0: keeps all)
+        self.max_timestamps = int(os.environ.get('PS_DM_MAX_TIMESTAMPS', '0'))
         self._run = run
         self.found_endrun = True
 
@@ -69,6 +101,10 @@ class DgramManager(object):
         self.config_consumers = config_consumers
         self.tag = tag
 
+        # Zero-copy shmem L1Accepts are opt-in: applications like AMI's pickN
+        # hold events for a long time, which holds the shmem buffers with them.
+        self.shmem_leases = ShmemLeases(int(os.environ.get('PS_SHMEM_MAX_LEASES', '0')))
+
         if isinstance(xtc_files, (str)):
             self.xtc_files = np.array([xtc_files], dtype='U%s'%FN_L)
         elif isinstance(xtc_files, (list, np.ndarray)):
@@ -96,6 +132,13 @@ class DgramManager(object):
         for fd, xtc_file in zip(self.fds, self.xtc_files):
             self.fds_map[fd] = xtc_file
 
+        # Read-only memory maps of the xtc files (keyed by fd), only
+        # populated when bigdata is read in mmap mode (PS_BD_MMAP=1).
+        self.mmaps = {}
+
+        # Block-buffered sequential reads, created by the first __next__ (see _read_dgrams)
+        self.block_reader = None
+
         given_configs = True if len(configs) > 0 else False
         if given_configs:
             self._set_configs(configs)
@@ -281,7 +324,34 @@ class DgramManager(object):
     def set_chunk_id(self, ind, new_chunk_id):
         self.chunk_ids[ind] = new_chunk_id
 
+    def get_mmap(self, ind, min_size=0):
+        """ Returns a read-only memory map of the xtc file at index ind.
+
+        Each file is mapped once. The file is remapped only when min_size
+        is beyond the current mapping (e.g. the file is still growing in
+        live mode). Returns None for an empty file.
+        """
+        fd = int(self.fds[ind])
+        mm = self.mmaps.get(fd, None)
+        if mm is None or len(mm) < min_size:
+            file_size = os.fstat(fd).st_size
+            if file_size == 0: return None
+            mm = mmap.mmap(fd, file_size, access=mmap.ACCESS_READ)
+            self.mmaps[fd] = mm
+        return mm
+
+    def drop_mmap(self, ind):
+        """ Forgets the memory map of the xtc file at index ind.
+
+        The map is not closed explicitly since dgrams created from it may
+        still be alive. It gets unmapped when the last view is released.
+        """
+        self.mmaps.pop(int(self.fds[ind]), None)
+
     def close(self):
+        self.mmaps = {}
+        if self.block_reader:
+            self.block_reader.close()
         if not self.given_fds:
             for fd in self.fds:
                 os.close(fd)
@@ -292,8 +362,9 @@ class DgramManager(object):
     def _check_missing_endrun(self, beginruns=None):
         fake_endruns = None
         if not self.found_endrun: # there's no previous EndRun
-            sec = (self._timestamps[-1] >> 32) & 0xffffffff
-            usec = int((self._timestamps[-1] & 0xffffffff) * 1e3 + 1)
+            ts = int(self._timestamps[self.n_timestamps-1])
+            sec = (ts >> 32) & 0xffffffff
+            usec = int((ts & 0xffffffff) * 1e3 + 1)
             if beginruns:
                 self.buffered_beginruns = [dgram.Dgram(config=config,
                         view=d, offset=0, size=d._size)
@@ -311,7 +382,7 @@ class DgramManager(object):
         if self.buffered_beginruns:
             self.found_endrun = False
             evt = Event(self.buffered_beginruns, run=self._run)
-            self._timestamps += [evt.timestamp]
+            self._add_timestamp(evt.timestamp)
             self.buffered_beginruns = []
             return evt
 
@@ -325,9 +396,18 @@ class DgramManager(object):
                 # and creating a deadlock situation. could revisit this
                 # later and only deep-copy arrays inside pickN, for example
                 # but would be more fragile.
-                barray = bytes(view[:_dgSize(view)])
-                self.shmem_cli.freeByIndex(self.shmem_kwargs['index'], self.shmem_kwargs['size'])
-                view = memoryview(barray)
+                # PS_SHMEM_MAX_LEASES > 0 leases L1Accept buffers up to this number
+                # instead, see ShmemLeases.
+                leased = None
+                if _service(view) == TransitionId.L1Accept:
+                    leased = self.shmem_leases.lease(self.shmem_cli, view,
+                            self.shmem_kwargs['index'], self.shmem_kwargs['size'])
+                if leased is not None:
+                    view = leased
+                else:
+                    barray = bytes(view[:_dgSize(view)])
+                    self.shmem_cli.freeByIndex(self.shmem_kwargs['index'], self.shmem_kwargs['size'])
+                    view = memoryview(barray)
                 # use the most recent configure datagram
                 config = self.configs[len(self.configs)-1]
                 d = dgram.Dgram(config=config,view=view)
@@ -342,7 +422,7 @@ class DgramManager(object):
             dgrams = [d]
         else:
             try:
-                dgrams = [dgram.Dgram(config=config, max_retries=self.max_retries) for config in self.configs]
+                dgrams = self._read_dgrams()
             except StopIteration as err:
                 fake_endruns = self._check_missing_endrun()
                 if fake_endruns:
@@ -367,9 +447,42 @@ class DgramManager(object):
             return self.__next__()
 
         evt = Event(dgrams, run=self.get_run())
-        self._timestamps += [evt.timestamp]
+        self._add_timestamp(evt.timestamp)
         return evt
 
+    def _add_timestamp(self, timestamp):
+        if self.n_timestamps == self._timestamps.shape[0]:
+            if 0 < self.max_timestamps <= self.n_timestamps // 2:
+                # moves the last max_timestamps to the front instead of growing
+                self._timestamps[:self.max_timestamps] = self._timestamps[self.n_timestamps-self.max_timestamps:self.n_timestamps]
+                self.n_timestamps = self.max_timestamps
+            else:
+                self._timestamps = np.resize(self._timestamps, 2 * self.n_timestamps)
+        self._timestamps[self.n_timestamps] = timestamp
+        self.n_timestamps += 1
+
+    def _read_dgrams(self):
+        """ Reads the next dgram of each file for sequential read.
+
+        Dgrams are copied out of large blocks that ParallelReader reads with
+        one read per file per PS_DM_CHUNKSIZE bytes (default 16 MB) instead of
+        separate header and payload reads for each dgram. PS_DM_CHUNKSIZE=0 and
+        live mode (waiting for data with retries) read dgram by dgram.
+        """
+        if self.block_reader is None:
+            chunksize = int(os.environ.get('PS_DM_CHUNKSIZE', 0x1000000))
+            if chunksize > 0 and self.max_retries == 0:
+                self.block_reader = ParallelReader(self.fds, chunksize)
+            else:
+                self.block_reader = False
+        if not self.block_reader:
+            return [dgram.Dgram(config=config, max_retries=self.max_retries) for config in self.configs]
+
+        dgrambytes = self.block_reader.read_dgrams()
+        if dgrambytes is None:
+            raise StopIteration('No more dgrams in the files')
+        return [dgram.Dgram(config=config, view=view) for config, view in zip(self.configs, dgrambytes)]
+
     def jumps(self, dgram_i, offset, size):
         if offset == 0 and size == 0:
             d = None
@@ -395,7 +508,13 @@ class DgramManager(object):
         return evt
 
     def get_timestamps(self):
-        return np.asarray(self._timestamps, dtype=np.uint64) # return numpy array for easy search later
+        """ Returns a read-only view (no copy) of the timestamps seen so far
+        (the last PS_DM_MAX_TIMESTAMPS if set). The view is only valid until
+        the next event - copy it to keep it."""
+        start = max(0, self.n_timestamps - self.max_timestamps) if self.max_timestamps else 0
+        timestamps = self._timestamps[start:self.n_timestamps]
+        timestamps.flags.writeable = False
+        return timestamps
 
     def set_run(self, run):
         self._run = run
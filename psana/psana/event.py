@@ -100,38 +100,62 @@ class Event():
     def run(self):
         return self._run
 
-    def _assign_det_segments(self):
+    def _get_det_segments(self, det_name, drp_class_name):
         """
+        Returns {segment: drp_class} of one (det_name, drp_class_name)
+        e.g. ("xppcspad", "raw") or None if no dgram has it. Only the
+        requested detector is looked up and the result is cached.
         """
-        self._det_segments = {}
+        key = (det_name, drp_class_name)
+        if key in self._det_segments_cache:
+            return self._det_segments_cache[key]
+
+        segs = {}
         for evt_dgram in self._dgrams:
             
             if evt_dgram: # dgram can be None (missing) in an event
 
+                segment_dict = evt_dgram.__dict__.get(det_name)
+                if not isinstance(segment_dict, dict): continue
+
+                for segment, det in segment_dict.items():
+                    drp_class = det.__dict__.get(drp_class_name)
+                    if drp_class is None: continue
+
+                    if det_name not in ['runinfo','smdinfo','chunkinfo'] :
+                        assert segment not in segs, f'Found duplicate segment: {segment} for {key}'
+                    segs[segment] = drp_class
+
+        if not segs: segs = None
+        self._det_segments_cache[key] = segs
+        return segs
+
+    @property
+    def _det_segments(self):
+        """
+        Segment dicts of all (det_name, drp_class_name) in the event
+        """
+        det_segments = {}
+        for evt_dgram in self._dgrams:
+            if evt_dgram: # dgram can be None (missing) in an event
                 # detector name (e.g. "xppcspad")
                 for det_name, segment_dict in evt_dgram.__dict__.items():
                     # skip hidden dgram attributes
-                    if det_name.startswith('_'): continue
+                    if det_name.startswith('_') or not isinstance(segment_dict, dict): continue
 
                     # drp class name (e.g. "raw", "fex")
-                    for segment, det in segment_dict.items():
-                        for drp_class_name, drp_class in det.__dict__.items():
-                            class_identifier = (det_name,drp_class_name)
-                        
-                            if class_identifier not in self._det_segments.keys():
-                                self._det_segments[class_identifier] = {}
-                            segs = self._det_segments[class_identifier]
-
-                            if det_name not in ['runinfo','smdinfo','chunkinfo'] :
-                                assert segment not in segs, f'Found duplicate segment: {segment} for {class_identifier}'
-                            segs[segment] = drp_class
-                            
-        return
+                    for det in segment_dict.values():
+                        for drp_class_name in det.__dict__:
+                            key = (det_name, drp_class_name)
+                            if key not in det_segments:
+                                det_segments[key] = self._get_det_segments(*key)
+        return det_segments
 
     # this routine is called when all the dgrams have been inserted into
     # the event (e.g. by the eventbuilder calling _replace())
     def _complete(self):
-        self._assign_det_segments()
+        # segment dicts are looked up on demand (see _get_det_segments)
+        self._det_segments_cache = {}
 
     @property
     def _has_offset(self):
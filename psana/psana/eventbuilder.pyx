@@ -18,6 +18,17 @@ import time
 
 MAX_BATCH_SIZE = 10000
 
+cdef int _is_selected(uint64_t[:] sorted_ts, uint64_t ts):
+    """ Binary search for ts in the sorted user-selected timestamps """
+    cdef Py_ssize_t lo = 0, hi = sorted_ts.shape[0], mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sorted_ts[mid] < ts:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo < sorted_ts.shape[0] and sorted_ts[lo] == ts
+
 cdef class ProxyEvent:
     """ EventBuilder uses this class to store event-related info
     while walking through each view buffer. Values such as timestamps, 
@@ -232,7 +243,7 @@ cdef class EventBuilder:
         prometheus_counter = <object> self.prometheus_counter
 
         # Get parameters from dsparms
-        filter_timestamps = dsparms.timestamps
+        cdef uint64_t[:] filter_timestamps = dsparms.timestamps
         filter_fn = dsparms.filter
         destination = dsparms.destination
         
@@ -267,7 +278,7 @@ cdef class EventBuilder:
                 # check if user selected this timestamp (only applies to L1)
                 accept_filter_ts = 1
                 if filter_timestamps.shape[0] > 0:
-                    while pydg.timestamp() not in filter_timestamps and pydg.service() == TransitionId.L1Accept:
+                    while not _is_selected(filter_timestamps, pydg.timestamp()) and pydg.service() == TransitionId.L1Accept:
                         if mypybuf.offset == mypybuf.size:         # Nothing left, we skipped everything in this view.
                             accept_filter_ts = 0
                             break
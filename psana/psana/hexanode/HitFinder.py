@@ -1,96 +1,180 @@
 import numpy as np
 
 
+def ragged_arange(starts, counts):
+    """Returns concatenated ranges [starts[k], starts[k]+counts[k]) and index k of each element."""
+    k = np.repeat(np.arange(counts.size), counts)
+    offsets = np.cumsum(counts) - counts
+    return starts[k] + np.arange(k.size) - offsets[k], k
+
+
+class SortedSignals:
+    """Signal times of a batch of events sorted by (event, time) for windowed search."""
+
+    def __init__(self, sigs):
+        sigs = [np.asarray(sig, dtype=np.float64) for sig in sigs]
+        events = np.repeat(np.arange(len(sigs)), [sig.size for sig in sigs])
+        times = np.concatenate(sigs) if sigs else np.empty(0)
+        self.order = np.lexsort((times, events))
+        self.is_sorted = bool(np.all(self.order[1:] > self.order[:-1]))
+        self.events = events[self.order]
+        self.times = times[self.order]
+        # signals of event k are [starts[k], ends[k])
+        self.starts = np.searchsorted(self.events, np.arange(len(sigs)), 'left')
+        self.ends = np.searchsorted(self.events, np.arange(len(sigs)), 'right')
+
+    def search(self, events, times, side):
+        """Returns indexes of times in the signals of their events like np.searchsorted.
+
+        Queries and signals are merged by (event, time) with the stable np.lexsort, queries
+        in front of equal signals for side='left' and behind them for side='right'.
+        The index of a query is the number of signals in front of it.
+        """
+        nsigs, nqueries = self.times.size, len(times)
+        if side == 'left':
+            merged = np.lexsort((np.concatenate((times, self.times)), np.concatenate((events, self.events))))
+            is_query = merged < nqueries
+            i_query = merged[is_query]
+        else:
+            merged = np.lexsort((np.concatenate((self.times, times)), np.concatenate((self.events, events))))
+            is_query = merged >= nsigs
+            i_query = merged[is_query] - nsigs
+        ind = np.empty(nqueries, dtype=np.int64)
+        ind[i_query] = np.cumsum(~is_query)[is_query]
+        return np.clip(ind, self.starts[events], self.ends[events])
+
+    def window(self, events, t_low, t_high):
+        """Returns ranges [beg, end) of signals in open time windows (t_low, t_high)."""
+        beg = self.search(events, t_low, 'right')
+        end = self.search(events, t_high, 'left')
+        return beg, np.maximum(end, beg)
+
+
 class HitFinder:
 
     def __init__(self, params):
 
         self.uRunTime = params['runtime_u']
-        
-        self.vRunTime = params['runtime_v']        
-        
+
+        self.vRunTime = params['runtime_v']
+
         self.uTSumAvg = params['tsum_avg_u']
         self.uTSumLow = self.uTSumAvg - params['tsum_hw_u']
         self.uTSumHigh = self.uTSumAvg + params['tsum_hw_u']
-        
-        self.vTSumAvg = params['tsum_avg_v'] 
+
+        self.vTSumAvg = params['tsum_avg_v']
         self.vTSumLow = self.vTSumAvg - params['tsum_hw_v']
-        self.vTSumHigh = self.vTSumAvg + params['tsum_hw_v']        
-        
+        self.vTSumHigh = self.vTSumAvg + params['tsum_hw_v']
+
         self.f_u = params['f_u']
-        self.f_v = params['f_v']        
+        self.f_v = params['f_v']
         self.Rmax = params['Rmax']
-         
+
         self.sqrt3 = np.sqrt(3.)
-             
-    def FindHits(self, McpSig, u1Sig, u2Sig, v1Sig, v2Sig):
-       
+
+        self._xyt = np.empty((3, 0))
+        self.nhits = np.zeros(0, dtype=np.int64)
+
+    def FindHits(self, McpSig, u1Sig, u2Sig, v1Sig, v2Sig, reuse=False):
+        self.FindHitsBatch([McpSig], [u1Sig], [u2Sig], [v1Sig], [v2Sig], reuse=reuse)
+
+    def FindHitsBatch(self, McpSigs, u1Sigs, u2Sigs, v1Sigs, v2Sigs, reuse=False):
+        """Finds hits for a batch of events, arguments are sequences of per-event signal times.
+
+        Anode signals are sorted once and matched to each MCP signal with searchsorted windows.
+        Results of all events are concatenated in the order of events and MCP signals,
+        see GetXYT, GetSumSub and GetNumberOfHits. With reuse=True X, Y, T are written to
+        a buffer kept by the HitFinder, which is overwritten by the next call.
+        """
+        McpSig = np.concatenate([np.asarray(sig, dtype=np.float64) for sig in McpSigs]) if len(McpSigs) else np.empty(0)
+        McpEvt = np.repeat(np.arange(len(McpSigs)), [len(sig) for sig in McpSigs])
+
         t1u = (-self.uRunTime+2*McpSig+self.uTSumAvg)/2
         t2u = (self.uRunTime+2*McpSig+self.uTSumAvg)/2
-            
+
         t1v = (-self.vRunTime+2*McpSig+self.vTSumAvg)/2
         t2v = (self.vRunTime+2*McpSig+self.vTSumAvg)/2
-        
+
         self.subf = {}
         self.sumf = {}
-        
-        for k in ['u','v']:
-            self.subf[k] = np.array([])
-            self.sumf[k] = np.array([])        
-        
-        self.Xf = np.array([])
-        self.Yf = np.array([])
-        self.Tf = np.array([])
-               
-        for i_McpT, McpT in enumerate(McpSig):
-           
-            u1 = u1Sig[(u1Sig>t1u[i_McpT]) & (u1Sig<t2u[i_McpT])]
-            u2 = u2Sig[(u2Sig>t1u[i_McpT]) & (u2Sig<t2u[i_McpT])]
-            v1 = v1Sig[(v1Sig>t1v[i_McpT]) & (v1Sig<t2v[i_McpT])]
-            v2 = v2Sig[(v2Sig>t1v[i_McpT]) & (v2Sig<t2v[i_McpT])]   
-           
-            
-            u1u2_sum = u1[:,np.newaxis] + u2[np.newaxis,:] - 2*McpT 
-            v1v2_sum = v1[:,np.newaxis] + v2[np.newaxis,:] - 2*McpT            
-            
-            u1_ind, u2_ind = np.where((u1u2_sum>self.uTSumLow) & (u1u2_sum<self.uTSumHigh))
-            v1_ind, v2_ind = np.where((v1v2_sum>self.vTSumLow) & (v1v2_sum<self.vTSumHigh))            
-            
-           
-            sub_u = u1[u1_ind]-u2[u2_ind]
-            sub_v = v1[v1_ind]-v2[v2_ind]
-            
-            sub_uf = sub_u*self.f_u/2
-            sub_vf = sub_v*self.f_v/2
-           
-            sum_u = u1[u1_ind]+u2[u2_ind] - 2*McpT 
-            sum_v = v1[v1_ind]+v2[v2_ind] - 2*McpT            
-
-            self.subf['u'] = np.concatenate([self.subf['u'],sub_u],axis=0)
-            self.subf['v'] = np.concatenate([self.subf['v'],sub_v],axis=0)
-            
-            self.sumf['u'] = np.concatenate([self.sumf['u'],sum_u],axis=0)
-            self.sumf['v'] = np.concatenate([self.sumf['v'],sum_v],axis=0)
-            
-            Xuv = sub_uf[:,np.newaxis] + 0*sub_vf[np.newaxis,:]
-            Yuv = 0*sub_uf[:,np.newaxis] + sub_vf[np.newaxis,:] 
-            
-            Xuv = np.ravel(Xuv)
-            Yuv = np.ravel(Yuv)
-            
-            Ruv = np.sqrt(Xuv**2 + Yuv**2)
-            ind_R = Ruv<self.Rmax               
-            
-            self.Xf = np.concatenate([self.Xf,Xuv[ind_R]],axis=0)
-            self.Yf = np.concatenate([self.Yf,Yuv[ind_R]],axis=0)
-            self.Tf = np.concatenate([self.Tf,McpT*np.ones(len(Xuv[ind_R]))],axis=0)
-            
+        i_mcp = {}
+        for k, sigs1, sigs2, t1, t2, tsum_low, tsum_high in\
+                (('u', u1Sigs, u2Sigs, t1u, t2u, self.uTSumLow, self.uTSumHigh),
+                 ('v', v1Sigs, v2Sigs, t1v, t2v, self.vTSumLow, self.vTSumHigh)):
+            i_mcp[k], s1, s2 = self._find_pairs(McpSig, McpEvt, SortedSignals(sigs1), SortedSignals(sigs2),
+                                                t1, t2, tsum_low, tsum_high)
+            self.subf[k] = s1 - s2
+            self.sumf[k] = s1 + s2 - 2*McpSig[i_mcp[k]]
+
+        sub_uf = self.subf['u']*self.f_u/2
+        sub_vf = self.subf['v']*self.f_v/2
+
+        # all combinations of u and v pairs of the same MCP signal, u pairs in outer loop
+        nu = np.bincount(i_mcp['u'], minlength=McpSig.size)
+        nv = np.bincount(i_mcp['v'], minlength=McpSig.size)
+        k, i_m = ragged_arange(np.zeros(McpSig.size, dtype=np.int64), nu*nv)
+        i_u = (np.cumsum(nu) - nu)[i_m] + k // nv[i_m]
+        i_v = (np.cumsum(nv) - nv)[i_m] + k % nv[i_m]
+
+        Xuv = sub_uf[i_u]
+        Yuv = sub_vf[i_v]
+
+        Ruv = np.sqrt(Xuv**2 + Yuv**2)
+        ind_R = Ruv<self.Rmax
+
+        if reuse:
+            nhits = np.count_nonzero(ind_R)
+            if nhits > self._xyt.shape[1]:
+                self._xyt = np.empty((3, max(nhits, 2*self._xyt.shape[1])))
+            self.Xf, self.Yf, self.Tf = self._xyt[:,:nhits]
+            np.compress(ind_R, Xuv, out=self.Xf)
+            np.compress(ind_R, Yuv, out=self.Yf)
+            np.compress(ind_R, McpSig[i_m], out=self.Tf)
+        else:
+            self.Xf, self.Yf, self.Tf = Xuv[ind_R], Yuv[ind_R], McpSig[i_m[ind_R]]
+        self.nhits = np.bincount(McpEvt[i_m[ind_R]], minlength=len(McpSigs))
+
+    def _find_pairs(self, McpSig, McpEvt, sig1, sig2, t1, t2, tsum_low, tsum_high):
+        """Returns MCP index, signal 1 and signal 2 times of pairs with
+           sig1 and sig2 in (t1, t2) and sig1 + sig2 - 2*McpT in (tsum_low, tsum_high).
+        """
+        beg1, end1 = sig1.window(McpEvt, t1, t2)
+        beg2, end2 = sig2.window(McpEvt, t1, t2)
+        i1, i_mcp = ragged_arange(beg1, end1 - beg1)
+        s1 = sig1.times[i1]
+        McpT = McpSig[i_mcp]
+
+        # sig2 range from time sum limits, widened for rounding and checked exactly below
+        lo = 2*McpT + tsum_low - s1
+        hi = 2*McpT + tsum_high - s1
+        margin = 1e-12*(np.abs(s1) + np.abs(2*McpT) + abs(tsum_low) + abs(tsum_high))
+        beg = np.maximum(sig2.search(McpEvt[i_mcp], lo - margin, 'left'), beg2[i_mcp])
+        end = np.minimum(sig2.search(McpEvt[i_mcp], hi + margin, 'right'), end2[i_mcp])
+        i2, k = ragged_arange(beg, np.maximum(end - beg, 0))
+        i1, i_mcp, s1, McpT = i1[k], i_mcp[k], s1[k], McpT[k]
+        s2 = sig2.times[i2]
+
+        s12_sum = s1 + s2 - 2*McpT
+        sel = (s12_sum>tsum_low) & (s12_sum<tsum_high)
+        i1, i2, i_mcp, s1, s2 = i1[sel], i2[sel], i_mcp[sel], s1[sel], s2[sel]
+
+        if not (sig1.is_sorted and sig2.is_sorted):
+            # keep pairs in the order of input signals
+            order = np.lexsort((sig2.order[i2], sig1.order[i1], i_mcp))
+            i_mcp, s1, s2 = i_mcp[order], s1[order], s2[order]
+        return i_mcp, s1, s2
+
     def GetXYT(self):
+        """Returns X, Y, T of the hits of the last FindHits or FindHitsBatch call.
+
+        After a call with reuse=True these are views of a buffer that the next call
+        with reuse=True overwrites, copy them to keep the hits.
+        """
         return self.Xf,self.Yf,self.Tf
-        
+
     def GetSumSub(self):
         return self.sumf, self.subf
 
-
-
-
+    def GetNumberOfHits(self):
+        """Returns number of X,Y,T hits per event of the last batch."""
+        return self.nhits
@@ -2,7 +2,60 @@
 
 
 import numpy as np
-from scipy.optimize import bisect
+
+BISECT_RTOL = 4*np.finfo(float).eps # default rtol of scipy.optimize.bisect
+BISECT_MAXITER = 100
+
+
+def newton_polynomial3_coefficients(x_arr, y_arr):
+    """Returns coefficients c0,c1,c2,c3 of the Newton polynomials through 4 points for arrays of shape (N,4)."""
+    d_0_1 = (y_arr[:,1] - y_arr[:,0])/(x_arr[:,1] - x_arr[:,0])
+    d_1_2 = (y_arr[:,2] - y_arr[:,1])/(x_arr[:,2] - x_arr[:,1])
+    d_2_3 = (y_arr[:,3] - y_arr[:,2])/(x_arr[:,3] - x_arr[:,2])
+
+    d_0_1_2 = (d_1_2 - d_0_1)/(x_arr[:,2] - x_arr[:,0])
+    d_1_2_3 = (d_2_3 - d_1_2)/(x_arr[:,3] - x_arr[:,1])
+    d_0_1_2_3 = (d_1_2_3 - d_0_1_2)/(x_arr[:,3] - x_arr[:,0])
+
+    return y_arr[:,0], d_0_1, d_0_1_2, d_0_1_2_3
+
+
+def newton_polynomial3(x, x_arr, coefs):
+    """Vectorized PyCFD.NewtonPolynomial3 for x of shape (N,) and x_arr of shape (N,4)."""
+    c0, c1, c2, c3 = coefs
+    return c0 + c1*(x-x_arr[:,0]) + c2*(x-x_arr[:,0])*(x-x_arr[:,1]) + c3*(x-x_arr[:,0])*(x-x_arr[:,1])*(x-x_arr[:,2])
+
+
+def bisect_newton_polynomial3(x_arr, y_arr, xtol, rtol=BISECT_RTOL, maxiter=BISECT_MAXITER):
+    """Finds roots of the Newton polynomials through points (x_arr, y_arr) of shape (N,4) in [x_arr[:,1], x_arr[:,2]].
+
+    Runs the same iterations as scipy.optimize.bisect for all polynomials at once.
+    Returns roots and a mask of polynomials with sign change in the interval,
+    roots are undefined where the mask is False.
+    """
+    coefs = newton_polynomial3_coefficients(x_arr, y_arr)
+    xa = x_arr[:,1].copy()
+    xb = x_arr[:,2]
+    fa = newton_polynomial3(xa, x_arr, coefs)
+    fb = newton_polynomial3(xb, x_arr, coefs)
+    xtol = np.broadcast_to(xtol, xa.shape)
+
+    ok = fa*fb <= 0
+    roots = np.where(fa == 0, xa, xb)
+    dm = xb - xa
+    inds = np.nonzero(ok & (fa != 0) & (fb != 0))[0]
+    for i in range(maxiter):
+        if inds.size == 0: break
+        dm[inds] *= .5
+        xm = xa[inds] + dm[inds]
+        fm = newton_polynomial3(xm, x_arr[inds], [c[inds] for c in coefs])
+        move = fm*fa[inds] >= 0
+        xa[inds[move]] = xm[move]
+        done = (fm == 0) | (np.abs(dm[inds]) < xtol[inds] + rtol*np.abs(xm))
+        roots[inds[done]] = xm[done]
+        inds = inds[~done]
+    roots[inds] = xa[inds] # not converged in maxiter
+    return roots, ok
 
 
 class PyCFD:
@@ -18,6 +71,7 @@ class PyCFD:
         self.timerange_high = params['timerange_high']
         self.offset = params['offset']
         self.xtol = 0.1*self.sample_interval
+        self._batch = None
 
         
     def NewtonPolynomial3(self,x,x_arr,y_arr):
@@ -38,49 +92,109 @@ class PyCFD:
         return c0 + c1*(x-x_arr[0]) + c2*(x-x_arr[0])*(x-x_arr[1]) + c3*(x-x_arr[0])*(x-x_arr[1])*(x-x_arr[2])
         
             
-    def CFD(self,wf, wt):        
-        
-        wf = wf[(wt>self.timerange_low)&(wt<self.timerange_high)] 
-        wt = wt[(wt>self.timerange_low)&(wt<self.timerange_high)] #choose the time window of interest        
-        
-        wf_1 = wf[:-self.delay] #original waveform
-        wf_2 = wf[self.delay:] #delayed waveform
-       
-        wf_cal = wf_1 - self.fraction*wf_2 #bipolar waveform
-        wf_cal_m_walk = self.polarity*wf_cal-self.walk+self.polarity*(self.fraction*self.offset-self.offset) #bipolar signal minus the walk level
-        wf_cal_m_walk_sign = np.sign(wf_cal_m_walk) 
+    def CFD(self,wf, wt):
+        """Returns array of CFD times for waveform wf with sample times wt."""
+        if self._batch is None:
+            self._batch = PyCFDBatch([self])
+        t_cfd_arr, nhits = self._batch(wf[np.newaxis,:], wt[np.newaxis,:])
+        return t_cfd_arr.copy()
 
-        wf_cal_ind = np.where((wf_cal_m_walk_sign[:-1] < wf_cal_m_walk_sign[1:]) & 
-        (wf_cal_m_walk_sign[1:] != 0) & ((wf_cal_m_walk[1:] - wf_cal_m_walk[:-1]) >= 1e-8))[0] #find the sign change locations of wf_cal_m_walk
 
-        #check if the orignal signal is above the threhold at sign change locations of wf_cal_m_walk
-        wf_cal_ind_ind = np.where(self.polarity*wf_1[wf_cal_ind] > (self.threshold+self.polarity*self.offset))[0]  
+class PyCFDBatch:
+    """Constant fraction discriminator for all channels of the event at once.
 
-        
-        t_cfd_arr = np.empty([0,])
-        
-        
-        #The arrival time t_cfd is obtained from the Newton Polynomial fitted to the 4 data points around the location found from above.
-        try:
-            for ind in wf_cal_ind_ind:
+    Usage::
 
-                t_arr = wt[(wf_cal_ind[ind]-1):(wf_cal_ind[ind]+3)]
+        cfds = PyCFDBatch([PyCFD(params) for params in list_of_channel_params])
+        t_cfd, nhits = cfds(wfs, wts) # wfs, wts shape=(nchannels, nsamples)
+        offsets = np.cumsum(nhits) - nhits
+        t_cfd[offsets[ch]:offsets[ch]+nhits[ch]] # times of channel ch
 
-                wf_cal_m_walk_arr = wf_cal_m_walk[(wf_cal_ind[ind]-1):(wf_cal_ind[ind]+3)]
-            
-                if len(t_arr) != 4 or len(wf_cal_m_walk_arr) != 4:
-                    continue
-            
-                if (t_arr[1] - t_arr[0])==0 or (t_arr[2] - t_arr[1])==0 or (t_arr[3] - t_arr[2])==0:
-                    continue
-                
-                if (t_arr[2] - t_arr[0])==0 or (t_arr[3] - t_arr[1])==0 or (t_arr[3] - t_arr[0])==0:
-                    continue
-            
-                t_cfd = bisect(self.NewtonPolynomial3,t_arr[1],t_arr[2],args=(t_arr, wf_cal_m_walk_arr),xtol=self.xtol)
-            
-                t_cfd_arr = np.append(t_cfd_arr,t_cfd)
-        except:
-            t_cfd_arr = np.append(t_cfd_arr,wt[wf_cal_ind[ind]])
+    Finds the same crossings as PyCFD.CFD did with a loop per channel and per crossing
+    and solves all of them with vectorized bisection of the Newton polynomials.
+    Times are returned in a preallocated buffer, which is reused by the next call.
+    """
+    def __init__(self, cfds, capacity=1024):
+        self.cfds = [cfd if isinstance(cfd, PyCFD) else PyCFD(cfd) for cfd in cfds]
+        def par(name): return np.array([getattr(cfd, name) for cfd in self.cfds])[:,np.newaxis]
+        self.delay = par('delay')
+        self.fraction = par('fraction')
+        self.threshold = par('threshold')
+        self.walk = par('walk')
+        self.polarity = par('polarity')
+        self.timerange_low = par('timerange_low')
+        self.timerange_high = par('timerange_high')
+        self.offset = par('offset')
+        self.xtol = par('xtol')[:,0]
+        self._t_cfd = np.empty(capacity)
+        self._nhits = np.zeros(len(self.cfds), dtype=np.int64)
+
+
+    def window(self, wfs, wts):
+        """Returns waveforms and times in (timerange_low, timerange_high) left-aligned per channel
+           and number of samples in the window per channel."""
+        inwin = (wts>self.timerange_low)&(wts<self.timerange_high)
+        nwin = inwin.sum(axis=1)
+        nsamp = max(int(nwin.max()), 1) if nwin.size else 1
+        ibeg = inwin.argmax(axis=1)
+        iend = wts.shape[1] - inwin[:,::-1].argmax(axis=1)
+        if np.all(nwin == nwin[0]) and np.all(ibeg == ibeg[0]) and np.all(iend - ibeg == nwin):
+            return wfs[:,ibeg[0]:ibeg[0]+nsamp], wts[:,ibeg[0]:ibeg[0]+nsamp], nwin
+        elif np.all((iend - ibeg == nwin) | (nwin == 0)):
+            wfs_win = np.zeros((wfs.shape[0], nsamp), dtype=wfs.dtype)
+            wts_win = np.zeros((wts.shape[0], nsamp), dtype=wts.dtype)
+            for ch, (i, n) in enumerate(zip(ibeg, nwin)):
+                wfs_win[ch,:n] = wfs[ch,i:i+n]
+                wts_win[ch,:n] = wts[ch,i:i+n]
+            return wfs_win, wts_win, nwin
+        # time window is not contiguous
+        inds = np.argsort(~inwin, axis=1, kind='stable')[:,:nsamp]
+        return np.take_along_axis(wfs, inds, axis=1), np.take_along_axis(wts, inds, axis=1), nwin
+
+
+    def __call__(self, wfs, wts):
+        """Returns (flat array of CFD times of all channels, number of hits per channel)."""
+        wfs, wts, nwin = self.window(wfs, wts)
+        nsamp = wfs.shape[1]
+        delay = self.delay[:,0]
+        # length of the bipolar waveform per channel, wf[:-delay] is empty for delay 0
+        ncal = np.where(delay>0, nwin - delay, 0)
+
+        #bipolar waveform wf_1 - fraction*wf_2 of original wf_1 and delayed wf_2 waveforms
+        dmin = max(delay.min(), 1)
+        if np.all(delay == dmin):
+            wf_cal = wfs[:,:-dmin] - self.fraction*wfs[:,dmin:]
+        else:
+            wf_cal = np.zeros((wfs.shape[0], max(nsamp-dmin, 0)))
+            for ch, d in enumerate(delay):
+                if 0 < d < nsamp:
+                    wf_cal[ch,:nsamp-d] = wfs[ch,:-d] - self.fraction[ch]*wfs[ch,d:]
+        wf_cal_m_walk = self.polarity*wf_cal-self.walk+self.polarity*(self.fraction*self.offset-self.offset) #bipolar signal minus the walk level
+
+        #sign change locations of wf_cal_m_walk, sign(y[i]) < sign(y[i+1]) != 0 is y[i] <= 0 < y[i+1],
+        #where the orignal signal is above the threhold
+        ncol = wf_cal_m_walk.shape[1] - 1
+        chans, inds = np.nonzero((self.polarity*wfs[:,:ncol] > (self.threshold+self.polarity*self.offset)) &\
+                                 (wf_cal_m_walk[:,:-1] <= 0) & (wf_cal_m_walk[:,1:] > 0))
+
+        #4 data points around the crossing have to be in the bipolar waveform
+        sel = (inds >= 1) & (inds + 3 <= ncal[chans])
+        chans, inds = chans[sel], inds[sel]
+        i4 = inds[:,np.newaxis] + np.arange(-1, 3)
+        t_arr = wts[chans[:,np.newaxis], i4]
+        wf_cal_m_walk_arr = wf_cal_m_walk[chans[:,np.newaxis], i4]
+
+        dt = t_arr[:,[1,2,3,2,3,3]] - t_arr[:,[0,1,2,0,1,0]]
+        sel = ((wf_cal_m_walk_arr[:,2] - wf_cal_m_walk_arr[:,1]) >= 1e-8) & np.all(dt != 0, axis=1)
+        chans, t_arr, wf_cal_m_walk_arr = chans[sel], t_arr[sel], wf_cal_m_walk_arr[sel]
+
+        #The arrival time t_cfd is obtained from the Newton Polynomial fitted to the 4 data points around the location found from above.
+        t_cfd, ok = bisect_newton_polynomial3(t_arr, wf_cal_m_walk_arr, self.xtol[chans])
+        t_cfd[~ok] = t_arr[~ok,1]
 
-        return t_cfd_arr
+        nhits = t_cfd.size
+        if nhits > self._t_cfd.size:
+            self._t_cfd = np.empty(max(nhits, 2*self._t_cfd.size))
+        self._t_cfd[:nhits] = t_cfd
+        self._nhits[:] = np.bincount(chans, minlength=len(self.cfds))
+        return self._t_cfd[:nhits], self._nhits
@@ -38,7 +38,7 @@ import psana.pyalgos.generic.Utils as gu
 from psana.pyalgos.generic.NDArrUtils import print_ndarr
 from ndarray import wfpkfinder_cfd # from psana.pycalgos
 from psana.hexanode.WFUtils import peak_finder_v2, peak_finder_v3
-from psana.hexanode.PyCFD import PyCFD
+from psana.hexanode.PyCFD import PyCFD, PyCFDBatch
 
 
 class WFPeaks :
@@ -123,6 +123,8 @@ class WFPeaks :
                 elif isinstance(paramsCFD,dict):
                     self.PyCFDs = [PyCFD(param) for k, param in paramsCFD.items()]
 
+            self.cfd_batch = PyCFDBatch(self.PyCFDs[:self.NUM_CHANNELS])
+
 
     def _init_arrays(self) :
         self._number_of_hits = np.zeros((self.NUM_CHANNELS), dtype=np.int)
@@ -153,6 +155,10 @@ class WFPeaks :
             self.wfsprep = wfs[:,self.WFBINBEG:self.WFBINEND] - offsets.reshape(-1, 1) # subtract wf-offset
         self.wtsprep = wts[:,self.WFBINBEG:self.WFBINEND] # sec
 
+        if self.VERSION == 4 :
+            t_cfd, nhits_cfd = self.cfd_batch(self.wfsprep, self.wtsprep)
+            offsets_cfd = np.cumsum(nhits_cfd) - nhits_cfd
+
         for ch in range(self.NUM_CHANNELS) :
 
             wf = self.wfsprep[ch,:]
@@ -168,7 +174,7 @@ class WFPeaks :
                 npeaks = peak_finder_v2(wf, self.SIGMABINS, self.THR, self.DEADBINS,\
                                         self._pkvals[ch,:], self._pkinds[ch,:])
             elif self.VERSION == 4 :
-                t_list = self.PyCFDs[ch].CFD(wf,wt)
+                t_list = t_cfd[offsets_cfd[ch]:offsets_cfd[ch]+nhits_cfd[ch]]
                 npeaks = self._pkinds[ch,:].size if self._pkinds[ch,:].size<=len(t_list) else len(t_list)
                 if wt.size==0: continue
                 # need it in V4 to convert _pktsec to _pkinds and _pkvals
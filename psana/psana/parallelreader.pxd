@@ -1,7 +1,7 @@
 ## cython: linetrace=True
 ## distutils: define_macros=CYTHON_TRACE_NOGIL=1
 
-from libc.stdlib cimport malloc, free
+from libc.stdlib cimport malloc, realloc, free
 from libc.string cimport memcpy
 from posix.unistd cimport read, sleep
 from libc.errno cimport errno
@@ -38,7 +38,16 @@ cdef class ParallelReader:
     cdef uint64_t   got                  # summing the size of new reads used by prometheus
     cdef uint64_t   chunk_overflown
     cdef int        num_threads
+    cdef int        prefetch             # read next chunks in the background (PS_SMD0_PREFETCH)
+    cdef char**     next_chunks          # background read buffers (one per file)
+    cdef int64_t*   next_gots            # no. of bytes read into next_chunks (after the tail)
+    cdef uint64_t*  next_tails           # size of the leftover tail copied to the front of next_chunks
+    cdef list       prefetches           # pending background read (future) of each file
+    cdef int*       prefetched           # set by just_read for files with a finished background read
 
     cdef void _init_buffers(self)
     cdef void _reset_buffers(self, Buffer* bufs)
     cdef void just_read(self)
+    cdef void _prefetch(self, Py_ssize_t i)
+    cdef void wait_prefetch(self)
+    cdef void _grow(self, size_t chunksize)
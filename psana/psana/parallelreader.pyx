@@ -5,8 +5,21 @@ from parallelreader cimport Buffer
 from cython.parallel import prange
 import os
 from dgramlite cimport Xtc, Sequence, Dgram
+from cpython.bytearray cimport PyByteArray_FromStringAndSize
 cimport cython
 from psana.psexp import TransitionId
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared by all ParallelReaders (sized by PS_SMD0_NUM_THREADS)
+_prefetch_executor = None
+
+def _get_prefetch_executor():
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get('PS_SMD0_NUM_THREADS', '16')),
+                thread_name_prefix='smd0_prefetch')
+    return _prefetch_executor
 
 cdef class ParallelReader:
     
@@ -22,8 +35,10 @@ cdef class ParallelReader:
         self.step_bufs          = <Buffer *>malloc(sizeof(Buffer)*self.nfiles)
         self.got                = 0
         self.chunk_overflown    = 0     # set to dgram size if it's too big
-        self._init_buffers()
         self.num_threads        = int(os.environ.get('PS_SMD0_NUM_THREADS', '16'))
+        self.prefetch           = int(os.environ.get('PS_SMD0_PREFETCH', '0'))
+        self.prefetches         = [None] * self.nfiles
+        self._init_buffers()
 
 
     def __dealloc__(self):
@@ -37,6 +52,15 @@ cdef class ParallelReader:
                 free(self.step_bufs[i].chunk)
             free(self.step_bufs)
 
+        free(self.prefetched)
+
+        if self.next_chunks:
+            for i in range(self.nfiles):
+                free(self.next_chunks[i])
+            free(self.next_chunks)
+            free(self.next_gots)
+            free(self.next_tails)
+
     cdef void _init_buffers(self):
         cdef Py_ssize_t i
         self._reset_buffers(self.bufs)
@@ -44,6 +68,19 @@ cdef class ParallelReader:
         for i in range(self.nfiles):
             self.bufs[i].chunk      = <char *>malloc(self.chunksize)
             self.step_bufs[i].chunk = <char *>malloc(self.chunksize)
+        self.prefetched = <int *>malloc(sizeof(int) * self.nfiles)
+        
+        # Second chunk per file for reading ahead. This doubles the memory
+        # used by the data buffers so it's only allocated when asked for.
+        self.next_chunks = NULL
+        if self.prefetch:
+            self.next_chunks    = <char **>malloc(sizeof(char *) * self.nfiles)
+            self.next_gots      = <int64_t *>malloc(sizeof(int64_t) * self.nfiles)
+            self.next_tails     = <uint64_t *>malloc(sizeof(uint64_t) * self.nfiles)
+            for i in range(self.nfiles):
+                self.next_chunks[i] = <char *>malloc(self.chunksize)
+                self.next_gots[i]   = 0
+                self.next_tails[i]  = 0
     
     cdef void _reset_buffers(self, Buffer* bufs):
         cdef Py_ssize_t i
@@ -71,6 +108,9 @@ cdef class ParallelReader:
         - ready_offset = offset of the last event that fits in the buffer
         - n_ready_events = no. of total events that fit in the buffer
 
+        With prefetch, the next chunk of each file that was just read is 
+        read in the background (see _prefetch) and the next call swaps it
+        in instead of copying the remaining data and reading. 
         """
         cdef Py_ssize_t i       = 0
         cdef int64_t got       = 0
@@ -80,8 +120,19 @@ cdef class ParallelReader:
         cdef Buffer* buf
         cdef Buffer* step_buf
         cdef uint64_t payload   = 0
+        cdef char* tmp_chunk
+        cdef int*  prefetched   = self.prefetched
         self.got                = 0
         
+        # Wait for background reads of the buffers we are about to refill
+        for i in range(self.nfiles):
+            prefetched[i] = 0
+            if self.prefetches[i] is None: continue
+            if self.bufs[i].n_ready_events - self.bufs[i].n_seen_events > 0: continue
+            self.prefetches[i].result()
+            self.prefetches[i] = None
+            prefetched[i] = 1
+
         for i in prange(self.nfiles, nogil=True, num_threads=self.num_threads):
             gots[i] = 0
             buf = &(self.bufs[i])
@@ -90,13 +141,22 @@ cdef class ParallelReader:
             # skip reading this buffer if there is/are still some event(s).
             if buf.n_ready_events - buf.n_seen_events > 0: continue 
             
-            # copy remaining data if any 
-            if buf.got - buf.ready_offset > 0 and buf.ready_offset > 0:
+            if prefetched[i] == 1:
+                # next chunk already has the remaining data at the front
+                tmp_chunk = buf.chunk
+                buf.chunk = self.next_chunks[i]
+                self.next_chunks[i] = tmp_chunk
+                buf.ready_offset = buf.got - self.next_tails[i]
+                gots[i] = self.next_gots[i]
+            elif buf.got - buf.ready_offset > 0 and buf.ready_offset > 0:
+                # copy remaining data if any 
                 memcpy(buf.chunk, buf.chunk + buf.ready_offset, buf.got - buf.ready_offset)
             
-            # read more data to fill up the buffer
-            gots[i] = read( self.file_descriptors[i], buf.chunk + (buf.got - buf.ready_offset), \
-                    self.chunksize - (buf.got - buf.ready_offset) )
+            # read more data to fill up the buffer (also when background 
+            # read found no new data e.g. file is still being written)
+            if gots[i] <= 0:
+                gots[i] = read( self.file_descriptors[i], buf.chunk + (buf.got - buf.ready_offset), \
+                        self.chunksize - (buf.got - buf.ready_offset) )
 
             # summing the size of all the new reads
             self.got += gots[i]
@@ -154,4 +214,94 @@ cdef class ParallelReader:
             
             # end while buf.ready_offset < buf.got:
 
+        # end for i in prange
+
+        if self.prefetch:
+            for i in range(self.nfiles):
+                if gots[i] > 0:
+                    self._prefetch(i)
+
+    cdef void _prefetch(self, Py_ssize_t i):
+        """ Starts reading the next chunk of file i in the background.
+
+        The remaining data (cut-off dgram) at the bottom of the current
+        chunk is copied to the front of the next chunk first so that
+        the two chunks can be swapped when the current one is used up.
+        """
+        cdef Buffer* buf = &(self.bufs[i])
+        self.next_tails[i] = buf.got - buf.ready_offset
+        if self.next_tails[i] > 0:
+            memcpy(self.next_chunks[i], buf.chunk + buf.ready_offset, self.next_tails[i])
+        self.next_gots[i] = 0
+        self.prefetches[i] = _get_prefetch_executor().submit(self._read_next, i)
+
+    def _read_next(self, Py_ssize_t i):
+        cdef int fd = self.file_descriptors[i]
+        cdef char* chunk = self.next_chunks[i] + self.next_tails[i]
+        cdef size_t size = self.chunksize - self.next_tails[i]
+        cdef int64_t got
+        with nogil:
+            got = read(fd, chunk, size)
+        self.next_gots[i] = got
+
+    cdef void wait_prefetch(self):
+        """ Waits for all background reads (e.g. before closing the files) """
+        cdef Py_ssize_t i
+        for i in range(self.nfiles):
+            if self.prefetches[i] is not None:
+                self.prefetches[i].result()
+
+    cdef void _grow(self, size_t chunksize):
+        """ Resizes all chunks to chunksize keeping their data """
+        cdef Py_ssize_t i
+        self.wait_prefetch()
+        for i in range(self.nfiles):
+            self.bufs[i].chunk      = <char *>realloc(self.bufs[i].chunk, chunksize)
+            self.step_bufs[i].chunk = <char *>realloc(self.step_bufs[i].chunk, chunksize)
+            if self.next_chunks:
+                self.next_chunks[i] = <char *>realloc(self.next_chunks[i], chunksize)
+        self.chunksize = chunksize
+
+    def read_dgrams(self):
+        """ Returns copies (bytearrays) of the next dgram of each file or None
+        when one of the files has no more dgrams.
+
+        Used for sequential reading in DgramManager. The chunks are refilled with
+        one read per file when they run out of dgrams instead of reading each
+        dgram header and payload separately. Chunks grow when a dgram doesn't fit.
+        """
+        cdef Py_ssize_t i
+        cdef Buffer* buf
+        cdef uint64_t st, en
+        cdef int n_empty = 0
+
+        for i in range(self.nfiles):
+            if self.bufs[i].n_ready_events == self.bufs[i].n_seen_events:
+                n_empty += 1
+
+        # a prefetched chunk may not have a complete dgram, keep reading
+        # until all files have one or there's no more data
+        while n_empty > 0:
+            self.just_read()
+            if self.chunk_overflown > self.chunksize:
+                self._grow(max(self.chunk_overflown, 2 * self.chunksize))
+            elif self.got == 0:
+                return None
+            n_empty = 0
+            for i in range(self.nfiles):
+                if self.bufs[i].n_ready_events == self.bufs[i].n_seen_events:
+                    n_empty += 1
+
+        dgrams = []
+        for i in range(self.nfiles):
+            buf = &(self.bufs[i])
+            st = buf.st_offset_arr[buf.n_seen_events]
+            en = buf.en_offset_arr[buf.n_seen_events]
+            dgrams.append(PyByteArray_FromStringAndSize(buf.chunk + st, en - st))
+            buf.seen_offset = en
+            buf.n_seen_events += 1
+        return dgrams
 
+    def close(self):
+        """ Waits for background reads so that the files can be closed """
+        self.wait_prefetch()
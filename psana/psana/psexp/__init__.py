@@ -10,6 +10,7 @@ from .packet_footer import PacketFooter
 from .step import Step
 from . import TransitionId
 from .events import Events
+from .smd_index import SmdIndex
 from . import legion_node
 from .ds_base import DataSourceBase
 from .run import Run, RunShmem, RunSingleFile, RunLegion, RunSerial
@@ -10,7 +10,7 @@ import time
 
 from psana.dgrammanager import DgramManager
 
-from psana.psexp import PrometheusManager, SmdReaderManager
+from psana.psexp import PrometheusManager, SmdReaderManager, SmdIndex
 import threading
 from psana import dgram
 
@@ -55,6 +55,8 @@ class DsParms:
     def set_timestamps(self):
         if isinstance(self.timestamps, str):
             self.timestamps = self.read_ts_npy_file()
+        # Sorted for binary search in EventBuilder
+        self.timestamps = np.unique(np.asarray(self.timestamps, dtype=np.uint64))
 
     @property
     def intg_stream_id(self):
@@ -443,6 +445,7 @@ class DataSourceBase(abc.ABC):
             logger.debug(f'ds_base: smd0 opened tmp smd_fds: {smd_fds}')
             smdr_man = SmdReaderManager(smd_fds, self.dsparms)
             all_configs = smdr_man.get_next_dgrams()
+            smdr_man.smdr.close()
 
             xtc_files = []
             smd_files = []
@@ -531,9 +534,38 @@ class DataSourceBase(abc.ABC):
                 timestamp = beginrun_dgram.timestamp()
         return expt, runnum, timestamp
 
+    def _open_smd_files(self):
+        """ Opens smd files and returns their file descriptors.
+
+        With PS_SMD_INDEX=1 and user-selected timestamps, each smd file is
+        replaced with an in-memory file that only has the transitions and
+        the selected L1Accepts, located with the cached SmdIndex. This
+        skips reading all other smalldata.
+        """
+        smd_fds = np.array([os.open(smd_file, os.O_RDONLY) for smd_file in self.smd_files], dtype=np.int32)
+        
+        use_index = int(os.environ.get('PS_SMD_INDEX', '0'))
+        if not use_index or self.dsparms.live: 
+            return smd_fds
+
+        timestamps = self.dsparms.timestamps
+        if isinstance(timestamps, str):
+            timestamps = self.dsparms.read_ts_npy_file()
+        if timestamps.shape[0] == 0:
+            return smd_fds
+
+        for i_smd, smd_file in enumerate(self.smd_files):
+            smd_index = SmdIndex(smd_file).load(smd_fds[i_smd])
+            selected_fd = smd_index.open_selected(smd_fds[i_smd], smd_index.select(timestamps))
+            os.close(smd_fds[i_smd])
+            smd_fds[i_smd] = selected_fd
+        return smd_fds
+
     def _close_opened_smd_files(self):
         # Make sure to close all smd files opened by previous run
         if self.smd_fds is not None:
+            if getattr(self, 'smdr_man', None) is not None:
+                self.smdr_man.smdr.close()
             for fd in self.smd_fds:
                 os.close(fd)
             logger.debug(f'ds_base: close smd fds: {self.smd_fds}')
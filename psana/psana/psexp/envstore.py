@@ -1,6 +1,7 @@
 from psana.psexp import PacketFooter
 import numpy as np
 from collections import defaultdict
+from bisect import bisect_left, bisect_right
 import os
 from psana.detector.detector_impl import DetectorImpl
 
@@ -15,14 +16,15 @@ class EnvManager(object):
         self.config     = config
         self.env_name   = env_name
         self.dgrams     = []
-        self._timestamps= [] # save as a list of d.timestamp
+        self._timestamps= np.zeros(64, dtype=np.uint64) # growable (first n_items are used)
         self.n_items    = 0
+        self._columns   = {} # var_name: EnvColumn (built on first lookup)
 
         self._init_env_variables()
 
     @property
     def timestamps(self):
-        return np.asarray(self._timestamps, dtype=np.uint64)
+        return self._timestamps[:self.n_items]
 
     def _init_env_variables(self):
         """ From the given config, build a list of variables from
@@ -33,6 +35,7 @@ class EnvManager(object):
         epics_mappers = {var_name: epics_name} # only valid for epics
         """
         self.env_variables = {}
+        self.var_locs = {}  # var_name: (alg, segment_id)
         self.epics_mapper = {}
         self.epics_inv_mapper = {}
         if hasattr(self.config.software, self.env_name):
@@ -65,9 +68,17 @@ class EnvManager(object):
                         
                     self.env_variables[alg] = {segment_id: env_vars}
 
+        # Same lookup order as scanning env_variables (first match wins)
+        for alg, envs in self.env_variables.items():
+            for segment_id, var_dict in envs.items():
+                for var_name in var_dict:
+                    self.var_locs.setdefault(var_name, (alg, segment_id))
+
     def add(self, d):
+        if self.n_items == self._timestamps.shape[0]:
+            self._timestamps = np.resize(self._timestamps, 2 * self.n_items)
         self.dgrams.append(d)
-        self._timestamps.append(d.timestamp())
+        self._timestamps[self.n_items] = d.timestamp()
         self.n_items += 1
     
     def is_empty(self):
@@ -76,11 +87,51 @@ class EnvManager(object):
     def locate_variable(self, var_name):
         """ Returns algorithm name and segment_id from the given env variable
         specifically for this config."""
-        for alg, envs in self.env_variables.items():
-            for segment_id, var_dict in envs.items():
-                if var_name in var_dict:
-                    return alg, segment_id
-        return None
+        return self.var_locs.get(var_name)
+
+    def get_column(self, var_name):
+        """ Returns EnvColumn of var_name updated with all added dgrams
+        or None if this config doesn't have the variable."""
+        if var_name not in self._columns:
+            var_loc = self.locate_variable(var_name)
+            if var_loc is None:
+                return None
+            self._columns[var_name] = EnvColumn(var_name, *var_loc)
+        column = self._columns[var_name]
+        column.update(self.dgrams, self.n_items, self.env_name)
+        return column
+
+class EnvColumn(object):
+    """ Positions (in EnvManager.dgrams) of the dgrams that have one 
+    variable and its values there. Only dgrams added since the last 
+    update are checked.
+    """
+
+    def __init__(self, var_name, alg, segment_id):
+        self.var_name   = var_name
+        self.alg        = alg
+        self.segment_id = segment_id
+        self._positions = np.zeros(64, dtype=np.int64) # growable (first n_items are used)
+        self.vals       = []
+        self.n_items    = 0
+        self.n_scanned  = 0
+
+    @property
+    def positions(self):
+        return self._positions[:self.n_items]
+
+    def update(self, dgrams, n_dgrams, env_name):
+        for p in range(self.n_scanned, n_dgrams):
+            envs = getattr(dgrams[p], env_name, None)
+            if envs is None or self.segment_id not in envs: continue
+            seg_alg = getattr(envs[self.segment_id], self.alg, None)
+            if seg_alg is None: continue
+            if self.n_items == self._positions.shape[0]:
+                self._positions = np.resize(self._positions, 2 * self.n_items)
+            self._positions[self.n_items] = p
+            self.vals.append(getattr(seg_alg, self.var_name))
+            self.n_items += 1
+        self.n_scanned = n_dgrams
 
 class EnvStore(object):
     """ Manages Env data 
@@ -91,6 +142,7 @@ class EnvStore(object):
         self.n_files = 0
         self.env_managers = []
         self.env_variables = defaultdict(list)
+        self.var_locs      = {} # var_name: (alg, segment_id)
         self.epics_mapper  = defaultdict(list)
         self.epics_inv_mapper = defaultdict(list)
         self.env_name = env_name
@@ -109,6 +161,11 @@ class EnvStore(object):
                     else:
                         for segment_id, var_dict in env_dict.items():
                             self.env_variables[alg].update({segment_id: var_dict})
+
+            for alg, envs in self.env_variables.items():
+                for segment_id, var_dict in envs.items():
+                    for var_name in var_dict:
+                        self.var_locs.setdefault(var_name, (alg, segment_id))
             
             self.env_info = []
             for alg, env_dict in self.env_variables.items():
@@ -122,11 +179,7 @@ class EnvStore(object):
 
     def locate_variable(self, var_name):
         """ Returns algorithm name and segment_id from the given env variable. """
-        for alg, envs in self.env_variables.items():
-            for segment_id, var_dict in envs.items():
-                if var_name in var_dict:
-                    return alg, segment_id
-        return None
+        return self.var_locs.get(var_name)
     
     def add_to(self, dgram, env_manager_idx):
         self.env_managers[env_manager_idx].add(dgram)
@@ -164,40 +217,54 @@ class EnvStore(object):
         fast/slow) then for that env file, locate position of env dgram that
         has ts_env <= ts_evt. If the dgram at found position has the algorithm
         then returns the value, otherwise keeps searching backward until 
-        PS_N_env_SEARCH_STEPS is reached."""
+        PS_N_env_SEARCH_STEPS is reached.
+        
+        All events are looked up together using the variable's EnvColumn 
+        (positions of the dgrams that have it)."""
         
         PS_N_STEP_SEARCH_STEPS = int(os.environ.get("PS_N_STEP_SEARCH_STEPS", "10"))
-        env_values = []
-
-        for evt in events:
-            event_timestamp = np.array([evt.timestamp], dtype=np.uint64)
-
-            # For epics and scan detectors, locate variable and return its value
-            for i, env_man in enumerate(self.env_managers):
-                val = None
-                env_var_loc = env_man.locate_variable(env_variable) # check if this xtc has the variable
-                if env_var_loc:
-                    alg, segment_id = env_var_loc
-                    found_pos = np.searchsorted(env_man.timestamps, event_timestamp)[0]
-                    
-                    if found_pos == env_man.n_items: # this event is the last step or the events after
-                        found_pos -= 1
-                    
-                    for p in range(found_pos, found_pos - PS_N_STEP_SEARCH_STEPS, -1):
-                        if p < 0:
-                            break
-                        env_d = env_man.dgrams[p]
-                        if hasattr(env_man.dgrams[p], self.env_name):
-                            envs = getattr(env_man.dgrams[p], self.env_name)[segment_id]
-                            if hasattr(envs, alg):
-                                val = getattr(getattr(envs, alg), env_variable)
-                                break
-                    
-                    if val is not None: break # found the value from this env manager
-            env_values.append(val)
+        if len(events) == 1:
+            return [self._value(events[0].timestamp, env_variable, PS_N_STEP_SEARCH_STEPS)]
+
+        env_values = [None] * len(events)
+        if not events: return env_values
+
+        event_timestamps = np.fromiter((evt.timestamp for evt in events), dtype=np.uint64, count=len(events))
+        not_found = np.ones(len(events), dtype=bool)
+
+        # For epics and scan detectors, locate variable and return its value
+        for env_man in self.env_managers:
+            column = env_man.get_column(env_variable) # check if this xtc has the variable
+            if column is None or column.n_items == 0: continue
+
+            found_pos = np.searchsorted(env_man.timestamps, event_timestamps)
+            # events at or after the last step use the last dgram
+            found_pos[found_pos == env_man.n_items] -= 1
+
+            # Latest dgram at or before found_pos that has the variable
+            i_cols = np.searchsorted(column.positions, found_pos, side='right') - 1
+            has_val = (i_cols >= 0) & not_found
+            has_val[has_val] = found_pos[has_val] - column.positions[i_cols[has_val]] < PS_N_STEP_SEARCH_STEPS
+            for i_evt in np.flatnonzero(has_val):
+                env_values[i_evt] = column.vals[i_cols[i_evt]]
+            not_found &= ~has_val
+            if not not_found.any(): break # found the values from this env manager
 
         return env_values
 
+    def _value(self, timestamp, env_variable, n_search_steps):
+        """ Same as values() for one event without numpy overhead. """
+        for env_man in self.env_managers:
+            column = env_man.get_column(env_variable)
+            if column is None or column.n_items == 0: continue
+            found_pos = bisect_left(env_man.timestamps, timestamp)
+            if found_pos == env_man.n_items: 
+                found_pos -= 1
+            i_col = bisect_right(column.positions, found_pos) - 1
+            if i_col >= 0 and found_pos - column.positions[i_col] < n_search_steps:
+                return column.vals[i_col]
+        return None
+
     def get_info(self):
         info = {}
         for alg, segment_dict in self.env_variables.items():
@@ -1,9 +1,12 @@
 from psana       import dgram
+from psana.smdindexer import index_smd_batch, smdinfo_names_id
 from psana.event import Event
 from psana.psexp import PacketFooter, TransitionId, PrometheusManager
 import numpy as np
 import os
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import logging
 logger = logging.getLogger(__name__)
@@ -12,10 +15,57 @@ s_bd_just_read = PrometheusManager.get_metric('psana_bd_just_read')
 s_bd_gen_smd_batch = PrometheusManager.get_metric('psana_bd_gen_smd_batch')
 s_bd_gen_evt = PrometheusManager.get_metric('psana_bd_gen_evt')
 
+_prefetch_executor = None
+
+def _get_prefetch_executor():
+    """ Returns the thread pool shared by all EventManagers for
+    bigdata read-ahead (created on first use). os.pread releases the
+    GIL so reads overlap with event processing."""
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        n_threads = int(os.environ.get('PS_BD_PREFETCH_THREADS', '4'))
+        _prefetch_executor = ThreadPoolExecutor(max_workers=n_threads, 
+                thread_name_prefix='psana_bd_prefetch')
+    return _prefetch_executor
+
 class ExitId:
     NoError = 0
     BdReadFail = 1
 
+@s_bd_just_read.time()
+def _pread(fd, size, offset, max_retries=0, prometheus_counter=None, filename=''):
+    """ Returns size bytes read at offset of fd, shorter if the read could 
+    not be completed after max_retries (live mode). Also called in the 
+    prefetch threads, so it does not keep a reference to the EventManager."""
+    st = time.monotonic()
+    chunk = bytearray()
+    
+    request_size = size
+    for i_retry in range(max_retries+1):
+        new_read = os.pread(fd, size, offset)
+        chunk.extend(new_read)
+        got = memoryview(new_read).nbytes
+        if memoryview(chunk).nbytes == request_size or i_retry == max_retries:
+            break
+
+        offset += got
+        size -= got
+        
+        print(f'Warning: bigdata read retry#{i_retry}/{max_retries} fd:{fd} {filename} ask={size} offset={offset} got={got}') 
+
+        time.sleep(1)
+    
+    en = time.monotonic()
+    sum_read_nbytes = memoryview(chunk).nbytes # for prometheus counter
+    rate = 0
+    if sum_read_nbytes > 0:
+        rate = (sum_read_nbytes/1e6)/(en-st)
+    logger.debug(f"bd reads chunk {sum_read_nbytes/1e6:.5f} MB took {en-st:.2f} s (Rate: {rate:.2f} MB/s)")
+    if prometheus_counter:
+        prometheus_counter.labels('MB','None').inc(sum_read_nbytes/1e6)
+        prometheus_counter.labels('seconds','None').inc(en-st)
+    return chunk
+
 class EventManager(object):
     """ Return an event from the received smalldata memoryview (view)
 
@@ -25,6 +75,13 @@ class EventManager(object):
         - w/o filter fn, fetch one big chunk of bigdata and
           replace smalldata view with the read out bigdata.
           Yield one bigdata event.
+
+    With PS_BD_MMAP=1, bigdata chunks are memoryview slices of the
+    memory-mapped xtc files instead of copies read with pread.
+
+    With PS_BD_PREFETCH_DEPTH=n (n > 0), up to n chunks ahead of the
+    current one are read in background threads for every stream, as
+    long as the total prefetched bytes stay below PS_BD_PREFETCH_MAX_BYTES.
     """
     def __init__(self, view, smd_configs, dm, esm, 
             filter_fn=0, prometheus_counter=None, 
@@ -51,6 +108,9 @@ class EventManager(object):
         # Each chunk must fit in BD_CHUNKSIZE and we only fill bd buffers
         # when bd_offset reaches the size of buffer.
         self.BD_CHUNKSIZE = int(os.environ.get('PS_BD_CHUNKSIZE', 0x1000000))
+        self.use_mmap = bool(int(os.environ.get('PS_BD_MMAP', '0')))
+        self.prefetch_depth = int(os.environ.get('PS_BD_PREFETCH_DEPTH', '0'))
+        self.prefetch_max_bytes = int(os.environ.get('PS_BD_PREFETCH_MAX_BYTES', 0x10000000))
         self._get_offset_and_size()
         if self.dm.n_files > 0:
             self._init_bd_chunks()
@@ -58,6 +118,17 @@ class EventManager(object):
     def __iter__(self):
         return self
 
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """ Cancels or waits for the reads of prefetched chunks that are 
+        not used (last event reached, failed read or EventManager abandoned)
+        so that no read is left in flight on the bigdata files."""
+        if not hasattr(self, 'prefetched'): return
+        for i_smd in range(self.n_smd_files):
+            self._drop_prefetched(i_smd)
+
     def _inc_prometheus_counter(self, unit, value=1):
         if self.prometheus_counter:
             self.prometheus_counter.labels(unit,'None').inc(value)
@@ -67,9 +138,11 @@ class EventManager(object):
         # Check in case there are some failures (I/O) happened on a core.
         # For MPI Mode, this allows clean exit.
         if self.exit_id > 0:
+            self.close()
             raise StopIteration
 
         if self.i_evt == self.n_events: 
+            self.close()
             raise StopIteration
         
         evt = self._get_next_evt()
@@ -98,6 +171,33 @@ class EventManager(object):
 
         current_bd_offsets[i_smd] = self.bd_offset_array[i_evt, i_smd] + self.bd_size_array[i_evt, i_smd]
         
+    def _set_new_chunk_id(self, d, i_evt, i_smd):
+        """ Stores new chunk id and filename found in an Enable dgram """
+        # We only support chunking on bigdata
+        if self.dm.n_files == 0: return
+        _chunk_ids = [getattr(d.chunkinfo[seg_id].chunkinfo, 'chunkid') for seg_id in d.chunkinfo]
+        _chunk_filenames = [getattr(d.chunkinfo[seg_id].chunkinfo, 'filename') for seg_id in d.chunkinfo]
+        # Only flag new chunk when there's chunkinfo and that chunkid is new
+        if _chunk_ids: 
+            # There must be only one unique chunkid name 
+            new_chunk_id = _chunk_ids[0]
+            new_filename = _chunk_filenames[0]
+            current_chunk_id = self.dm.get_chunk_id(i_smd)
+            if new_chunk_id > current_chunk_id:
+                self.new_chunk_id_array[i_evt, i_smd] = new_chunk_id
+                self.chunkinfo[(i_smd, new_chunk_id)] = new_filename 
+
+    def _alloc_offset_and_size_arrays(self, n_events):
+        dtype = np.int64
+        # Row - events, col = smd files
+        self.bd_offset_array    = np.zeros((n_events, self.n_smd_files), dtype=dtype) 
+        self.bd_size_array      = np.zeros((n_events, self.n_smd_files), dtype=dtype)
+        self.smd_offset_array   = np.zeros((n_events, self.n_smd_files), dtype=dtype)
+        self.smd_size_array     = np.zeros((n_events, self.n_smd_files), dtype=dtype)
+        self.new_chunk_id_array = np.zeros((n_events, self.n_smd_files), dtype=dtype)
+        self.cutoff_flag_array  = np.ones((n_events, self.n_smd_files), dtype=dtype)
+        self.services           = np.zeros(n_events, dtype=dtype)
+        
     @s_bd_gen_smd_batch.time()
     def _get_offset_and_size(self):
         """
@@ -107,19 +207,47 @@ class EventManager(object):
           [[d_bytes][d_bytes]....[evt_footer]] <-- 1 event 
           [[d_bytes][d_bytes]....[evt_footer]]
           [chunk_footer]]
+
+        The compiled indexer fills all arrays from the dgram headers. Only
+        Enable dgrams (for chunkinfo) are created here. If the indexer finds 
+        an unexpected smd dgram layout, we step through the view with full 
+        dgrams instead.
         """
+        smd_chunk_pf = PacketFooter(view=self.smd_view)
+        self._alloc_offset_and_size_arrays(smd_chunk_pf.n_packets)
+        use_smds = np.zeros(self.n_smd_files, dtype=np.uint8)
+        use_smds[:len(self.use_smds)] = self.use_smds
+        smdinfo_names_ids = np.array([smdinfo_names_id(config) for config in self.smd_configs], 
+                dtype=np.int64)
+        indexed = smd_chunk_pf.n_packets == 0 or index_smd_batch(self.smd_view, use_smds, 
+                smdinfo_names_ids, int(self.dm.n_files > 0), self.BD_CHUNKSIZE, 
+                self.smd_offset_array, self.smd_size_array,
+                self.bd_offset_array, self.bd_size_array,
+                self.cutoff_flag_array, self.services)
+        if indexed:
+            if self.dm.n_files > 0:
+                for i_evt in np.where(self.services == TransitionId.Enable)[0]:
+                    for i_smd in range(self.n_smd_files):
+                        if self.smd_size_array[i_evt, i_smd] == 0: continue
+                        d = dgram.Dgram(config=self.smd_configs[i_smd], view=self.smd_view, 
+                                offset=self.smd_offset_array[i_evt, i_smd])
+                        if hasattr(d, 'chunkinfo'):
+                            self._set_new_chunk_id(d, i_evt, i_smd)
+        else:
+            self._alloc_offset_and_size_arrays(smd_chunk_pf.n_packets)
+            self._step_through_smd_view(smd_chunk_pf)
+
+        # Precalculate cutoff indices
+        self.cutoff_indices = []
+        self.chunk_indices  = np.zeros(self.n_smd_files, dtype=np.int64)
+        for i_smd in range(self.n_smd_files):
+            self.cutoff_indices.append(np.where(self.cutoff_flag_array[:, i_smd] == 1)[0])
+
+    def _step_through_smd_view(self, smd_chunk_pf):
+        """ Fills offset and size arrays by creating every smd dgram """
         offset = 0
         i_smd = 0
-        smd_chunk_pf = PacketFooter(view=self.smd_view)
         dtype = np.int64
-        # Row - events, col = smd files
-        self.bd_offset_array    = np.zeros((smd_chunk_pf.n_packets, self.n_smd_files), dtype=dtype) 
-        self.bd_size_array      = np.zeros((smd_chunk_pf.n_packets, self.n_smd_files), dtype=dtype)
-        self.smd_offset_array   = np.zeros((smd_chunk_pf.n_packets, self.n_smd_files), dtype=dtype)
-        self.smd_size_array     = np.zeros((smd_chunk_pf.n_packets, self.n_smd_files), dtype=dtype)
-        self.new_chunk_id_array = np.zeros((smd_chunk_pf.n_packets, self.n_smd_files), dtype=dtype)
-        self.cutoff_flag_array  = np.ones((smd_chunk_pf.n_packets, self.n_smd_files), dtype=dtype)
-        self.services           = np.zeros(smd_chunk_pf.n_packets, dtype=dtype)
         smd_aux_sizes           = np.zeros(self.n_smd_files, dtype=dtype)
         # For comparing if the next dgram should be in the same read
         current_bd_offsets      = np.zeros(self.n_smd_files, dtype=dtype) 
@@ -152,19 +280,7 @@ class EventManager(object):
                         i_first_L1 = i_evt
                     self._get_bd_offset_and_size(d, current_bd_offsets, current_bd_chunk_sizes, i_evt, i_smd, i_first_L1)
                 elif d.service() == TransitionId.Enable and hasattr(d, 'chunkinfo'):
-                    # We only support chunking on bigdata
-                    if self.dm.n_files > 0: 
-                        _chunk_ids = [getattr(d.chunkinfo[seg_id].chunkinfo, 'chunkid') for seg_id in d.chunkinfo]
-                        _chunk_filenames = [getattr(d.chunkinfo[seg_id].chunkinfo, 'filename') for seg_id in d.chunkinfo]
-                        # Only flag new chunk when there's chunkinfo and that chunkid is new
-                        if _chunk_ids: 
-                            # There must be only one unique chunkid name 
-                            new_chunk_id = _chunk_ids[0]
-                            new_filename = _chunk_filenames[0]
-                            current_chunk_id = self.dm.get_chunk_id(i_smd)
-                            if new_chunk_id > current_chunk_id:
-                                self.new_chunk_id_array[i_evt, i_smd] = new_chunk_id
-                                self.chunkinfo[(i_smd, new_chunk_id)] = new_filename 
+                    self._set_new_chunk_id(d, i_evt, i_smd)
             
             offset += smd_aux_sizes[i_smd]            
             i_smd += 1
@@ -175,13 +291,9 @@ class EventManager(object):
         
         # end while offset
 
-        # Precalculate cutoff indices
-        self.cutoff_indices = []
-        self.chunk_indices  = np.zeros(self.n_smd_files, dtype=dtype)
-        for i_smd in range(self.n_smd_files):
-            self.cutoff_indices.append(np.where(self.cutoff_flag_array[:, i_smd] == 1)[0])
-
     def _open_new_bd_file(self, i_smd, new_chunk_id):
+        self._drop_prefetched(i_smd)
+        self.dm.drop_mmap(i_smd)
         os.close(self.dm.fds[i_smd])
         xtc_dir = os.path.dirname(self.dm.xtc_files[i_smd])
         new_filename = os.path.join(xtc_dir, self.chunkinfo[(i_smd, new_chunk_id)])
@@ -190,52 +302,131 @@ class EventManager(object):
         self.dm.xtc_files[i_smd] = new_filename
         self.dm.set_chunk_id(i_smd, new_chunk_id)
     
-    @s_bd_just_read.time()
     def _read(self, fd, size, offset):
-        st = time.monotonic()
-        chunk = bytearray()
-        
-        request_size = size
+        chunk = _pread(fd, size, offset, max_retries=self.max_retries, 
+                prometheus_counter=self.prometheus_counter, 
+                filename=self.dm.fds_map.get(fd, ''))
+        self._check_read(chunk, size)
+        return chunk
+
+    def _check_read(self, chunk, size):
+        """ Flags failure for system exit if chunk is not completely read """
+        got = memoryview(chunk).nbytes
+        if got < size:
+            if self.max_retries > 0:
+                # Live mode use max_retries
+                print(f'Error: maximum no. of retries reached. exit.')
+            else:
+                # Normal mode
+                print(f'Error: not able to completely read big data (asked: {size} bytes/ got: {got} bytes)')
+            self.exit_id = ExitId.BdReadFail
+
+    @s_bd_just_read.time()
+    def _read_mmap(self, i_smd, size, offset):
+        """ Returns a zero-copy view of size bytes at offset of the
+        memory-mapped bigdata file. Retries (live mode) when the file
+        is not yet long enough."""
+        fd = self.dm.fds[i_smd]
+        end = offset + size
         for i_retry in range(self.max_retries+1):
-            new_read = os.pread(fd, size, offset)
-            chunk.extend(new_read)
-            got = memoryview(new_read).nbytes
-            if memoryview(chunk).nbytes == request_size:
-                break
-            
-            # Check if we should exit when asked amount is not fulfilled
-            if i_retry == self.max_retries and got < size:
+            mm = self.dm.get_mmap(i_smd, min_size=end)
+            got = 0 if mm is None else max(0, min(len(mm), end) - offset)
+            if got == size:
+                self._inc_prometheus_counter('MB', size/1e6)
+                return memoryview(mm)[offset:end]
+
+            if i_retry == self.max_retries:
                 if self.max_retries > 0:
-                    # Live mode use max_retries
                     print(f'Error: maximum no. of retries reached. exit.')
                 else:
-                    # Normal mode
                     print(f'Error: not able to completely read big data (asked: {size} bytes/ got: {got} bytes)')
-
-                # Flag failure for system exit
                 self.exit_id = ExitId.BdReadFail
                 break
 
-            offset += got
-            size -= got
-            
-            print(f'Warning: bigdata read retry#{i_retry}/{self.max_retries} fd:{fd} {self.dm.fds_map[fd]} ask={size} offset={offset} got={got}') 
+            print(f'Warning: bigdata mmap retry#{i_retry}/{self.max_retries} fd:{fd} {self.dm.fds_map[fd]} ask={size} offset={offset} got={got}') 
 
             time.sleep(1)
-        
-        en = time.monotonic()
-        sum_read_nbytes = memoryview(chunk).nbytes # for prometheus counter
-        rate = 0
-        if sum_read_nbytes > 0:
-            rate = (sum_read_nbytes/1e6)/(en-st)
-        logger.debug(f"bd reads chunk {sum_read_nbytes/1e6:.5f} MB took {en-st:.2f} s (Rate: {rate:.2f} MB/s)")
-        self._inc_prometheus_counter('MB', sum_read_nbytes/1e6)
-        self._inc_prometheus_counter('seconds', en-st)
-        return chunk
+        return bytearray()
 
     def _init_bd_chunks(self):
         self.bd_bufs = [bytearray() for i in range(self.n_smd_files)]
         self.bd_buf_offsets = np.zeros(self.n_smd_files, dtype=np.int64)
+        # Prefetched chunks per stream as (chunk index, nbytes, future)
+        self.prefetched = [deque() for i in range(self.n_smd_files)]
+        self.prefetched_nbytes = 0
+        # Events where a stream switches to a new bigdata chunk file.
+        # Prefetching never goes past these.
+        self.chunk_switch_evts = [np.nonzero(self.new_chunk_id_array[:, i_smd])[0] 
+                for i_smd in range(self.n_smd_files)]
+
+    def _get_chunk_range(self, i_smd, i_chunk):
+        """ Returns (offset, size) on disk of chunk no. i_chunk of this stream.
+
+        For last chunk, read size is the sum of all bd dgrams all the
+        way to the end of the array. Otherwise, only sum to the next chunk.
+        """
+        cutoff_indices = self.cutoff_indices[i_smd]
+        i_evt_cutoff = cutoff_indices[i_chunk]
+        begin_chunk_offset = self.bd_offset_array[i_evt_cutoff, i_smd]
+        if i_chunk == cutoff_indices.shape[0] - 1:
+            read_size = np.sum(self.bd_size_array[i_evt_cutoff:, i_smd])
+        else:
+            i_next_evt_cutoff = cutoff_indices[i_chunk + 1]
+            read_size = np.sum(self.bd_size_array[i_evt_cutoff:i_next_evt_cutoff, i_smd])
+        return begin_chunk_offset, read_size
+
+    def _drop_prefetched(self, i_smd):
+        """ Forgets the prefetched chunks of this stream. Reads that already
+        started are waited for so that the file can be closed."""
+        queue = self.prefetched[i_smd]
+        while queue:
+            _, nbytes, future = queue.popleft()
+            self.prefetched_nbytes -= nbytes
+            if not future.cancel():
+                wait([future])
+
+    def _get_prefetched_chunk(self, i_smd, i_chunk):
+        """ Returns the prefetched chunk i_chunk of this stream or None
+        if it was not prefetched. Waits for the read if still in flight."""
+        queue = self.prefetched[i_smd]
+        while queue and queue[0][0] < i_chunk:
+            _, nbytes, future = queue.popleft()
+            self.prefetched_nbytes -= nbytes
+            future.cancel()
+        if not queue or queue[0][0] != i_chunk:
+            return None
+        _, nbytes, future = queue.popleft()
+        self.prefetched_nbytes -= nbytes
+        chunk = future.result()
+        self._check_read(chunk, nbytes)
+        return chunk
+
+    def _prefetch_bd_chunks(self, i_smd, i_chunk):
+        """ Issues background reads for chunks after i_chunk of this stream. 
+        Zero-size chunks (transitions) are skipped and do not count toward
+        the depth."""
+        queue = self.prefetched[i_smd]
+        cutoff_indices = self.cutoff_indices[i_smd]
+        switch_evts = self.chunk_switch_evts[i_smd]
+        i_switch = np.searchsorted(switch_evts, self.i_evt, side='right')
+        i_evt_switch = switch_evts[i_switch] if i_switch < switch_evts.shape[0] else self.n_events
+        
+        next_i_chunk = queue[-1][0] + 1 if queue else i_chunk + 1
+        while len(queue) < self.prefetch_depth and next_i_chunk < cutoff_indices.shape[0]:
+            if cutoff_indices[next_i_chunk] >= i_evt_switch:
+                break
+            offset, size = self._get_chunk_range(i_smd, next_i_chunk)
+            if size > 0:
+                if self.prefetched_nbytes + size > self.prefetch_max_bytes:
+                    break
+                future = _get_prefetch_executor().submit(_pread, 
+                        self.dm.fds[i_smd], size, offset, 
+                        max_retries=self.max_retries, 
+                        prometheus_counter=self.prometheus_counter, 
+                        filename=self.dm.xtc_files[i_smd])
+                queue.append((next_i_chunk, size, future))
+                self.prefetched_nbytes += size
+            next_i_chunk += 1
     
     def _fill_bd_chunk(self, i_smd):
         """
@@ -255,19 +446,20 @@ class EventManager(object):
         # Reset buffer offset with new filling
         self.bd_buf_offsets[i_smd] = 0
 
-        cutoff_indices = self.cutoff_indices[i_smd]
-        i_evt_cutoff = cutoff_indices[self.chunk_indices[i_smd]]
-        begin_chunk_offset = self.bd_offset_array[i_evt_cutoff, i_smd]
+        i_chunk = self.chunk_indices[i_smd]
+        begin_chunk_offset, read_size = self._get_chunk_range(i_smd, i_chunk)
+        if self.use_mmap:
+            self.bd_bufs[i_smd] = self._read_mmap(i_smd, int(read_size), int(begin_chunk_offset))
+            return
 
-        # Calculate read size:
-        # For last chunk, read size is the sum of all bd dgrams all the
-        # way to the end of the array. Otherwise, only sum to the next chunk.
-        if self.chunk_indices[i_smd] == cutoff_indices.shape[0] - 1:
-            read_size = np.sum(self.bd_size_array[i_evt_cutoff:, i_smd])
-        else:
-            i_next_evt_cutoff = cutoff_indices[self.chunk_indices[i_smd] + 1]
-            read_size = np.sum(self.bd_size_array[i_evt_cutoff:i_next_evt_cutoff, i_smd])
-        self.bd_bufs[i_smd] = self._read(self.dm.fds[i_smd], read_size, begin_chunk_offset)
+        chunk = None
+        if self.prefetch_depth > 0:
+            chunk = self._get_prefetched_chunk(i_smd, i_chunk)
+        if chunk is None:
+            chunk = self._read(self.dm.fds[i_smd], read_size, begin_chunk_offset)
+        self.bd_bufs[i_smd] = chunk
+        if self.prefetch_depth > 0:
+            self._prefetch_bd_chunks(i_smd, i_chunk)
 
     def _get_next_evt(self):
         """ Generate bd evt for different cases:
@@ -30,7 +30,9 @@ class Events:
             # RunSerial
 
             # Checks if users ask to exit
-            if self.dsparms.terminate_flag: raise StopIteration
+            if self.dsparms.terminate_flag: 
+                if isinstance(self._evt_man, EventManager): self._evt_man.close()
+                raise StopIteration
 
             try:
                 evt = next(self._evt_man)
@@ -141,7 +141,7 @@ class MPIDataSource(DataSourceBase):
         g_ts = self.prom_man.get_metric("psana_timestamp")
         if nodetype == 'smd0':
             super()._close_opened_smd_files()
-            self.smd_fds  = np.array([os.open(smd_file, os.O_RDONLY) for smd_file in self.smd_files], dtype=np.int32)
+            self.smd_fds  = super()._open_smd_files()
             logger.debug(f'mpi_ds: smd0 opened smd_fds: {self.smd_fds}')
             self.smdr_man = SmdReaderManager(self.smd_fds, self.dsparms)
             configs = self.smdr_man.get_next_dgrams()
@@ -161,6 +161,11 @@ class StepHistory(object):
                     self.send_history[idx][i_smd] += dg_bytes.nbytes
     
 
+    def extend_buffers_unsent(self, views):
+        """ Adds step data that no client has received yet. """
+        for i_smd, view in enumerate(views):
+            self.bufs[i_smd].extend(view)
+
     def update_history(self, views, client_id):
         indexed_id = client_id - 1 # rank 0 has no send history.
         for i, view in enumerate(views):
@@ -263,6 +268,22 @@ class Smd0(object):
             st_req = time.monotonic()
             logger.debug(f'RANK{self.comms.world_rank} 1. SMD0GOTCHUNK {st_req}')
 
+            # Skip windows with none of the user-selected timestamps. Their
+            # transitions reach all EventBuilders as missing steps.
+            if not self.smdr_man.smdr.window_selected:
+                step_views = [self.smdr_man.smdr.show(i, step_buf=True) for i in range(self.smdr_man.n_files)]
+                self.step_hist.extend_buffers_unsent(step_views)
+                logger.debug(f'RANK{self.comms.world_rank} 1.1 SMD0SKIPCHUNK no selected timestamps')
+                # Check for terminating signal
+                t_req_test = t_req.Test()
+                if t_req_test:
+                    logger.debug(f'smd0 got terminating signal from world rank {t_rankreq[0]} (t_req_test:{t_req_test})')
+                    break
+                if self.smdr_man.smdr.found_endrun():
+                    logger.debug("smd0 found_endrun")
+                    break
+                continue
+
             req = self.comms.smd_comm.Irecv(rankreq, source=MPI.ANY_SOURCE)
             req.Wait()
             en_req = time.monotonic()
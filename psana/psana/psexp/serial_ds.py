@@ -27,7 +27,7 @@ class SerialDataSource(DataSourceBase):
 
     def _get_configs(self):
         super()._close_opened_smd_files()
-        self.smd_fds  = np.array([os.open(smd_file, os.O_RDONLY) for smd_file in self.smd_files], dtype=np.int32)
+        self.smd_fds  = super()._open_smd_files()
         logger.debug(f'serial_ds: opened smd_fds: {self.smd_fds}')
         self.smdr_man = SmdReaderManager(self.smd_fds, self.dsparms)
         # Reading configs (first dgram of the smd files)
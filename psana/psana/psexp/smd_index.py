@@ -0,0 +1,108 @@
+import os
+import time
+import tempfile
+import numpy as np
+
+from psana.smdindexer import index_smd_file
+from psana.psexp import TransitionId
+
+import logging
+logger = logging.getLogger(__name__)
+
+class SmdIndex(object):
+    """ Columnar index of one smd file (one row per dgram)
+
+    Columns are timestamps, services, smd_offsets and smd_sizes. Bigdata
+    offsets are not indexed, they are read from the selected smd dgrams
+    as usual. The index is cached next to the smalldata as
+    index/<smd file>.idx.npz or in PS_SMD_INDEX_DIR if set. A cached index
+    is only used when it was built from a file of the same size and
+    modification time.
+    """
+    columns = ('timestamps', 'services', 'smd_offsets', 'smd_sizes')
+
+    def __init__(self, smd_file):
+        self.smd_file = smd_file
+        index_dir = os.environ.get('PS_SMD_INDEX_DIR',
+                os.path.join(os.path.dirname(smd_file), 'index'))
+        self.index_file = os.path.join(index_dir, os.path.basename(smd_file) + '.idx.npz')
+        self.cols = {}
+
+    def load(self, fd):
+        """ Loads the cached index or builds (and caches) a new one from fd """
+        st = os.fstat(fd)
+        file_stat = (st.st_size, st.st_mtime_ns)
+        if os.path.isfile(self.index_file):
+            with np.load(self.index_file) as index_f:
+                if 'file_mtime_ns' in index_f.files and \
+                        (int(index_f['file_size']), int(index_f['file_mtime_ns'])) == file_stat:
+                    self.cols = {key: index_f[key] for key in self.columns}
+                    logger.debug(f'smd_index: loaded {self.index_file}')
+                    return self
+
+        self._build(fd)
+
+        # Files still being written will have a different size next time
+        if not self.smd_file.endswith('.inprogress'):
+            self._save(*file_stat)
+        return self
+
+    def _build(self, fd):
+        st = time.monotonic()
+        self.cols = index_smd_file(fd)
+        en = time.monotonic()
+        logger.debug(f'smd_index: built index of {self.smd_file} ({self.n_dgrams} dgrams) in {en-st:.2f}s')
+
+    def _save(self, file_size, file_mtime_ns):
+        """ Writes the index atomically. Failing to write (e.g. read-only
+        experiment folder) only costs a rebuild next time. """
+        try:
+            index_dir = os.path.dirname(self.index_file)
+            os.makedirs(index_dir, exist_ok=True)
+            tmp_fd, tmp_file = tempfile.mkstemp(dir=index_dir, suffix='.npz')
+            with os.fdopen(tmp_fd, 'wb') as tmp_f:
+                np.savez(tmp_f, file_size=np.uint64(file_size), 
+                        file_mtime_ns=np.int64(file_mtime_ns), **self.cols)
+            os.replace(tmp_file, self.index_file)
+            logger.debug(f'smd_index: saved {self.index_file}')
+        except OSError as err:
+            logger.debug(f'smd_index: cannot save {self.index_file} ({err})')
+
+    @property
+    def n_dgrams(self):
+        return self.cols['timestamps'].shape[0]
+
+    def select(self, timestamps):
+        """ Returns mask of all transitions and L1Accepts with the given timestamps """
+        return (self.cols['services'] != TransitionId.L1Accept) | \
+                np.isin(self.cols['timestamps'], timestamps)
+
+    def open_selected(self, fd, mask, blocksize=0x1000000):
+        """ Returns fd of an anonymous file that has only the selected dgrams.
+
+        Adjacent selected dgrams are copied with one read.
+        """
+        if hasattr(os, 'memfd_create'):
+            out_fd = os.memfd_create(os.path.basename(self.smd_file))
+        else:
+            out_fd, tmp_file = tempfile.mkstemp()
+            os.unlink(tmp_file)
+
+        offsets = self.cols['smd_offsets'][mask].astype(np.int64)
+        ends = offsets + self.cols['smd_sizes'][mask].astype(np.int64)
+        breaks = np.nonzero(offsets[1:] != ends[:-1])[0] + 1
+        i_starts = np.concatenate(([0], breaks))
+        i_stops = np.concatenate((breaks, [offsets.shape[0]]))
+        for i_start, i_stop in zip(i_starts, i_stops):
+            if i_start == i_stop: continue
+            offset = int(offsets[i_start])
+            end = int(ends[i_stop - 1])
+            while offset < end:
+                block = os.pread(fd, min(blocksize, end - offset), offset)
+                if not block: break
+                os.write(out_fd, block)
+                offset += len(block)
+
+        os.lseek(out_fd, 0, os.SEEK_SET)
+        logger.debug(f'smd_index: selected {np.count_nonzero(mask)}/{self.n_dgrams} dgrams of {self.smd_file}')
+        return out_fd
@@ -78,6 +78,14 @@ class SmdReaderManager(object):
         self.chunksize = int(os.environ.get('PS_SMD_CHUNKSIZE', 0x1000000))
 
         self.smdr = SmdReader(smd_fds, self.chunksize, self.dsparms.max_retries)
+        
+        # Lets SmdReader flag viewing windows with none of the selected
+        # timestamps. Smd0 only loads the timestamp file here (mpi_ts).
+        timestamps = self.dsparms.timestamps
+        if isinstance(timestamps, str):
+            timestamps = self.dsparms.read_ts_npy_file()
+        if timestamps.shape[0] > 0:
+            self.smdr.set_timestamps(timestamps)
         self.processed_events = 0
         self.got_events = -1
         self._run = None
@@ -155,7 +163,8 @@ class SmdReaderManager(object):
             if not self.smdr.is_complete():
                 raise StopIteration
         self.smdr.view(batch_size=self.smd0_n_events, intg_stream_id=intg_stream_id)
-        mmrv_bufs = [self.smdr.show(i) for i in range(self.n_files)]
+        # Only transitions are needed when this window has no selected timestamps
+        mmrv_bufs = [self.smdr.show(i, step_buf=not self.smdr.window_selected) for i in range(self.n_files)]
         batch_iter = BatchIterator(mmrv_bufs, self.configs, self._run, self.dsparms)
         self.got_events = self.smdr.view_size
         self.processed_events += self.got_events
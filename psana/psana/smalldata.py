@@ -43,6 +43,9 @@ Analysis consists of two different process types:
 Some Notes:
   * number of servers to use is set by PS_SRV_NODES
     environment variable
+  * each server writes full caches in a writer thread
+    while it keeps receiving (PS_SRV_WRITER_THREAD=0
+    writes in the receiving thread instead)
   * if running in psana parallel mode, clients ARE
     BD nodes (they are the same processes)
   * eventual time-stamp sorting would be doable with
@@ -60,6 +63,8 @@ Some Notes:
 """                          
 
 import os
+import queue
+import threading
 import numpy as np
 import h5py
 from collections.abc import MutableMapping
@@ -93,6 +98,8 @@ FLOAT_TYPES = [float, np.float16, np.float32, np.float64, np.float128, float]
 RAGGED_PREFIX   = 'ragged_'
 UNALIGED_PREFIX = 'unaligned_'
 
+COLUMNS_TAG     = 1  # MPI tag of the ColumnBatch data buffer
+
 def is_unaligned(dset_name):
     return dset_name.split('/')[-1].startswith(UNALIGED_PREFIX)
 
@@ -133,6 +140,117 @@ def _format_srv_filename(dirname, basename, rank):
     srv_fn = os.path.join(dirname, srv_basename)
     return srv_fn
 
+def _dset_type(dataset_name, data):
+    """
+    Returns (dtype, shape) of the dataset for its first data
+    """
+    if type(data) == int:
+        return np.dtype('i8'), ()
+    elif type(data) == float:
+        return np.dtype('f8'), ()
+    elif hasattr(data, 'dtype'):
+        return data.dtype, data.shape
+    raise TypeError('Type: Dataset %s type %s not compatible' % (dataset_name, type(data)))
+
+
+class ColumnBatch:
+    """
+    Columnar form of a batch of event dicts (client -> server).
+
+    Each dataset has a presence bitmap (one bit per event) and a 
+    contiguous array of its values in the events that have it. All
+    of these are in one uint8 buffer so that a batch is sent as a
+    small pickled header (meta) followed by one buffer-based Send.
+
+    meta = {'n_events': int, 'nbytes': int,
+            'dsets': [(name, py_type, dtype.str, shape, n_present, 
+                       mask_offset, values_offset), ...]}
+    where py_type is 'int'/'float' for python scalars (restored
+    as such for callbacks) or '' for numpy data.
+    """
+
+    ALIGN = 16
+
+    def __init__(self, meta, buf):
+        self.meta = meta
+        self.buf = buf
+
+    @property
+    def n_events(self):
+        return self.meta['n_events']
+
+    @classmethod
+    def from_events(cls, batch):
+        n_events = len(batch)
+        names = {}
+        for event_data_dict in batch:
+            names.update(dict.fromkeys(event_data_dict))
+
+        align = lambda offset: -(-offset // cls.ALIGN) * cls.ALIGN
+        nbytes = 0
+        dsets = []
+        columns = []
+        for dataset_name in names:
+            values = [d[dataset_name] for d in batch if dataset_name in d]
+            dtype, shape = _dset_type(dataset_name, values[0])
+            py_type = type(values[0]).__name__ if type(values[0]) in (int, float) else ''
+            mask_offset = nbytes
+            values_offset = align(mask_offset + (n_events + 7) // 8)
+            nbytes = align(values_offset + len(values) * dtype.itemsize * int(np.prod(shape)))
+            dsets.append((dataset_name, py_type, dtype.str, shape, len(values), mask_offset, values_offset))
+            columns.append(values)
+
+        cbatch = cls({'n_events': n_events, 'nbytes': nbytes, 'dsets': dsets},
+                     np.empty(nbytes, dtype=np.uint8))
+        for dset, values in zip(dsets, columns):
+            dataset_name, mask_offset = dset[0], dset[5]
+            present = np.fromiter((dataset_name in d for d in batch), dtype=bool, count=n_events)
+            cbatch.buf[mask_offset:mask_offset + (n_events + 7) // 8] = np.packbits(present)
+            cbatch._values(dset)[...] = values
+        return cbatch
+
+    def _values(self, dset):
+        _, _, dtype, shape, n_present, _, values_offset = dset
+        dtype = np.dtype(dtype)
+        nbytes = n_present * dtype.itemsize * int(np.prod(shape))
+        return self.buf[values_offset:values_offset + nbytes].view(dtype).reshape((n_present,) + tuple(shape))
+
+    def columns(self):
+        """
+        Yields (dataset_name, present, values) for each dataset where
+        present is a bool array (n_events,) and values a view of the buffer
+        shaped as (n_present,) + shape.
+        """
+        n_events = self.n_events
+        for dset in self.meta['dsets']:
+            dataset_name, mask_offset = dset[0], dset[5]
+            present = np.unpackbits(self.buf[mask_offset:mask_offset + (n_events + 7) // 8],
+                                    count=n_events).astype(bool)
+            yield dataset_name, present, self._values(dset)
+
+    def first_values(self):
+        """
+        Returns {dataset_name: first value in the form it was given}
+        """
+        return {dataset_name: self._py_value(py_type, values[0]) \
+                for (dataset_name, present, values), (_, py_type, *_) \
+                in zip(self.columns(), self.meta['dsets'])}
+
+    def events(self):
+        """
+        Returns the batch as a list of event dicts
+        """
+        batch = [{} for i in range(self.n_events)]
+        for (dataset_name, present, values), (_, py_type, *_) in zip(self.columns(), self.meta['dsets']):
+            for j, i in enumerate(np.flatnonzero(present)):
+                batch[i][dataset_name] = self._py_value(py_type, values[j])
+        return batch
+
+    @staticmethod
+    def _py_value(py_type, value):
+        return value.item() if py_type else value
+
+
 # FOR NEXT TIME
 # CONSIDER MAKING A FileServer CLASS
 # CLASS BASECLASS METHOD THEN HANDLES HDF5
@@ -154,6 +272,10 @@ class CacheArray:
                              dtype=self.dtype)
         self.reset()
 
+        # cleared while the cache is queued for writing
+        self.written = threading.Event()
+        self.written.set()
+
         return
 
     def append(self, data):
@@ -161,6 +283,15 @@ class CacheArray:
         self.n_events += 1
         return
 
+    def extend(self, data):
+        """
+        Copies as many rows of data as fit, returns the number copied
+        """
+        n = min(data.shape[0], self.cache_size - self.n_events)
+        self.data[self.n_events:self.n_events+n,...] = data[:n]
+        self.n_events += n
+        return n
+
     def reset(self):
         self.n_events = 0
         return
@@ -169,7 +300,7 @@ class CacheArray:
 class Server: # (hdf5 handling)
 
     def __init__(self, filename=None, smdcomm=None, cache_size=10000,
-                 callbacks=[]):
+                 callbacks=[], writer_thread=True):
 
         self.filename   = filename
         self.smdcomm    = smdcomm
@@ -182,10 +313,22 @@ class Server: # (hdf5 handling)
         # maps dataset_name --> CacheArray()
         self._cache = {}
 
+        # maps dataset_name --> CacheArray() being written (double buffer)
+        self._spare_cache = {}
+
         self.num_events_seen = 0
 
+        self._write_queue = None
+        self._write_error = None
+
         if (self.filename is not None):
             self.file_handle = h5py.File(self.filename, 'w')
+            if writer_thread:
+                self._write_queue = queue.Queue()
+                self._writer = threading.Thread(target=self._write_loop,
+                                                name='SmallDataWriter',
+                                                daemon=True)
+                self._writer.start()
 
         return
 
@@ -193,10 +336,15 @@ class Server: # (hdf5 handling)
 
         num_clients_done = 0
         num_clients = self.smdcomm.Get_size() - 1
+        status = MPI.Status()
         while num_clients_done < num_clients:
-            msg = self.smdcomm.recv(source=MPI.ANY_SOURCE)
+            msg = self.smdcomm.recv(source=MPI.ANY_SOURCE, tag=0, status=status)
             if type(msg) is list:
                 self.handle(msg)
+            elif type(msg) is dict: # ColumnBatch header, data follows
+                buf = np.empty(msg['nbytes'], dtype=np.uint8)
+                self.smdcomm.Recv(buf, source=status.Get_source(), tag=COLUMNS_TAG)
+                self.handle_columns(ColumnBatch(msg, buf))
             elif msg == 'done':
                 num_clients_done += 1
 
@@ -234,22 +382,52 @@ class Server: # (hdf5 handling)
         return
 
 
+    def handle_columns(self, cbatch):
+        """
+        Same as handle for a ColumnBatch - each dataset is added to 
+        its cache as a whole column.
+        """
+
+        if self.callbacks:
+            for event_data_dict in cbatch.events():
+                for cb in self.callbacks:
+                    cb(event_data_dict)
+
+        if self.filename is not None:
+
+            to_backfill = set(self._dsets.keys())
+            first_values = None
+
+            for dataset_name, present, values in cbatch.columns():
+
+                if dataset_name not in self._dsets.keys():
+                    if first_values is None: first_values = cbatch.first_values()
+                    self.new_dset(dataset_name, first_values[dataset_name])
+                else:
+                    to_backfill.discard(dataset_name)
+
+                if is_unaligned(dataset_name) or values.shape[0] == cbatch.n_events:
+                    self.extend_cache(dataset_name, values)
+                else:
+                    dtype, shape = self._dsets[dataset_name]
+                    column = np.empty((cbatch.n_events,) + shape, dtype=dtype)
+                    column.fill(_get_missing_value(dtype))
+                    column[present] = values
+                    self.extend_cache(dataset_name, column)
+
+            for dataset_name in to_backfill:
+                if not is_unaligned(dataset_name):
+                    self.backfill(dataset_name, cbatch.n_events)
+
+        self.num_events_seen += cbatch.n_events
+
+        return
+
+
     def new_dset(self, dataset_name, data):
 
-        if type(data) == int:
-            shape = ()
-            maxshape = (None,)
-            dtype = 'i8'
-        elif type(data) == float:
-            shape = ()
-            maxshape = (None,)
-            dtype = 'f8'
-        elif hasattr(data, 'dtype'):
-            shape = data.shape
-            maxshape = (None,) + data.shape
-            dtype = data.dtype
-        else:
-            raise TypeError('Type: Dataset %s type %s not compatible' % (dataset_name, type(data)))
+        dtype, shape = _dset_type(dataset_name, data)
+        maxshape = (None,) + shape
 
         if shape==(0,): raise ValueError('Dataset %s has illegal shape (0,)' % dataset_name)
 
@@ -283,7 +461,76 @@ class Server: # (hdf5 handling)
         return
 
 
+    def extend_cache(self, dataset_name, data):
+        """
+        Appends all rows of data (n_rows,) + shape to the cache
+        """
+
+        if dataset_name not in self._cache.keys():
+            dtype, shape = self._dsets[dataset_name]
+            cache = CacheArray(shape, dtype, self.cache_size)
+            self._cache[dataset_name] = cache
+        else:
+            cache = self._cache[dataset_name]
+
+        i_row = 0
+        while i_row < data.shape[0]:
+            i_row += cache.extend(data[i_row:])
+            if cache.n_events == self.cache_size:
+                self.write_to_file(dataset_name, cache)
+                cache = self._cache[dataset_name]
+
+        return
+
+
     def write_to_file(self, dataset_name, cache):
+        """
+        Writes the cache to file. With the writer thread, the cache is
+        queued and replaced by its spare so that receiving can go on.
+        """
+
+        if self._write_queue is None:
+            self._write(dataset_name, cache)
+            return
+
+        spare = self._spare_cache.get(dataset_name)
+        if spare is None:
+            spare = CacheArray(cache.singleton_shape, cache.dtype, cache.cache_size)
+
+        # wait until the previous write of this dataset is done
+        spare.written.wait()
+        self._check_writer()
+
+        cache.written.clear()
+        self._cache[dataset_name] = spare
+        self._spare_cache[dataset_name] = cache
+        self._write_queue.put((dataset_name, cache))
+        return
+
+
+    def _write_loop(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None: break
+            dataset_name, cache = item
+            try:
+                if self._write_error is None:
+                    self._write(dataset_name, cache)
+            except Exception as err:
+                self._write_error = err
+            finally:
+                cache.written.set()
+        return
+
+
+    def _check_writer(self):
+        if self._write_error is not None:
+            raise RuntimeError('SmallData server failed to write %s' \
+                               % self.filename) from self._write_error
+        return
+
+
+    def _write(self, dataset_name, cache):
         dset = self.file_handle.get(dataset_name)
         new_size = (dset.shape[0] + cache.n_events,) + dset.shape[1:]
         dset.resize(new_size)
@@ -298,11 +545,13 @@ class Server: # (hdf5 handling)
         dtype, shape = self._dsets[dataset_name]
 
         missing_value = _get_missing_value(dtype) 
-        fill_data = np.empty(shape, dtype=dtype)
+        fill_data = np.empty((min(num_to_backfill, self.cache_size),) + shape, dtype=dtype)
         fill_data.fill(missing_value)
     
-        for i in range(num_to_backfill):
-            self.append_to_cache(dataset_name, fill_data)
+        while num_to_backfill > 0:
+            n = min(num_to_backfill, fill_data.shape[0])
+            self.extend_cache(dataset_name, fill_data[:n])
+            num_to_backfill -= n
         
         return
 
@@ -310,9 +559,13 @@ class Server: # (hdf5 handling)
     def done(self):
         if (self.filename is not None):
             # flush the data caches (in case did not hit cache_size yet)
-            for dset, cache in self._cache.items():
+            for dset, cache in list(self._cache.items()):
                 if cache.n_events > 0:
                     self.write_to_file(dset, cache)
+            if self._write_queue is not None:
+                self._write_queue.put(None)
+                self._writer.join()
+                self._check_writer()
             self.file_handle.close()
         return
 
@@ -379,6 +632,8 @@ class SmallData: # (client)
             self._dirname  = os.path.dirname(filename)
         self._first_open = True # filename has not been opened yet
 
+        writer_thread = int(os.environ.get('PS_SRV_WRITER_THREAD', '1')) == 1
+
         if MODE == 'PARALLEL':
 
             # hide intermediate files -- join later via VDS
@@ -393,7 +648,8 @@ class SmallData: # (client)
                 self._server = Server(filename=self._srv_filename, 
                                       smdcomm=self._srvcomm, 
                                       cache_size=cache_size,
-                                      callbacks=callbacks)
+                                      callbacks=callbacks,
+                                      writer_thread=writer_thread)
                 self._server.recv_loop()
 
         elif MODE == 'SERIAL':
@@ -401,7 +657,8 @@ class SmallData: # (client)
             self._type = 'serial'
             self._server = Server(filename=self._srv_filename,
                                   cache_size=cache_size,
-                                  callbacks=callbacks)
+                                  callbacks=callbacks,
+                                  writer_thread=writer_thread)
 
         return
 
@@ -491,7 +748,7 @@ class SmallData: # (client)
                 if MODE == 'SERIAL':
                     self._server.handle(self._batch)
                 elif MODE == 'PARALLEL':
-                    self._srvcomm.send(self._batch, dest=0)
+                    self._send_batch()
                 self._batch = []           
 
             event_data_dict['timestamp'] = timestamp
@@ -515,6 +772,16 @@ class SmallData: # (client)
         return
 
 
+    def _send_batch(self):
+        """
+        Sends the batch to the server as a ColumnBatch
+        """
+        cbatch = ColumnBatch.from_events(self._batch)
+        self._srvcomm.send(cbatch.meta, dest=0)
+        self._srvcomm.Send(cbatch.buf, dest=0, tag=COLUMNS_TAG)
+        return
+
+
     @property
     def summary(self):
         """
@@ -676,7 +943,7 @@ class SmallData: # (client)
         if self._type == 'client':
             # we want to send the finish signal to the server
             if len(self._batch) > 0:
-                self._srvcomm.send(self._batch, dest=0)
+                self._send_batch()
             self._srvcomm.send('done', dest=0)
 
         elif self._type == 'server':
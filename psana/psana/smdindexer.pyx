@@ -0,0 +1,279 @@
+## cython: linetrace=True
+## distutils: define_macros=CYTHON_TRACE_NOGIL=1
+
+from dgramlite cimport Xtc, Sequence, Dgram
+from libc.stdint cimport uint16_t, uint32_t, uint64_t, int64_t
+from libc.string cimport strncmp
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_ANY_CONTIGUOUS, PyBUF_SIMPLE
+cimport cython
+import numpy as np
+import os
+from psana.psexp import TransitionId
+
+# Full Xtc header (dgramlite.Xtc only exposes the extent)
+cdef struct XtcHeader:
+    uint32_t src
+    uint16_t damage
+    uint16_t contains
+    uint32_t extent
+
+# XtcData::TypeId::Type
+cdef enum:
+    TypeIdParent     = 0
+    TypeIdShapesData = 1
+    TypeIdShapes     = 2
+    TypeIdData       = 3
+    TypeIdNames      = 4
+    TypeIdMask       = 0x0fff
+
+# XtcData::Src value (NamesId of Names and ShapesData) and XtcData::NameInfo
+# (numArrays, detType, detName, ...) at the start of the Names payload
+cdef enum:
+    SrcValueMask     = 0x0fffffff
+    MaxNameSize      = 256
+    NameInfoDetName  = 4 + MaxNameSize # offset of detName after numArrays and detType
+
+# Data payload of the smdinfo ShapesData written by XtcData::Smd::generate
+cdef struct SmdInfo:
+    uint64_t intOffset
+    uint64_t intDgramSize
+
+cdef unsigned L1Accept = TransitionId.L1Accept
+
+
+cdef int64_t _find_names_id(XtcHeader* parent, const char* det_name):
+    # Depth-first search of the Names with det_name in the parent's children
+    cdef char* pos = <char *>parent + sizeof(XtcHeader)
+    cdef char* end = <char *>parent + parent.extent
+    cdef XtcHeader* xtc
+    cdef int64_t names_id
+    while pos + sizeof(XtcHeader) <= end:
+        xtc = <XtcHeader *>pos
+        if xtc.extent < sizeof(XtcHeader) or pos + xtc.extent > end:
+            break
+        if (xtc.contains & TypeIdMask) == TypeIdParent:
+            names_id = _find_names_id(xtc, det_name)
+            if names_id >= 0:
+                return names_id
+        elif (xtc.contains & TypeIdMask) == TypeIdNames \
+                and xtc.extent >= sizeof(XtcHeader) + NameInfoDetName + MaxNameSize:
+            if strncmp(pos + sizeof(XtcHeader) + NameInfoDetName, det_name, MaxNameSize) == 0:
+                return xtc.src & SrcValueMask
+        pos += xtc.extent
+    return -1
+
+
+cdef SmdInfo* _get_smdinfo(Dgram* d, int64_t names_id):
+    # Returns the smdinfo payload of an L1Accept smd dgram, NULL if the only
+    # child is not a ShapesData with names_id. Data is the first child of the
+    # ShapesData or follows the (empty) Shapes, see XtcData::ShapesData::data.
+    cdef char* end = <char *>&d.xtc + d.xtc.extent
+    cdef XtcHeader* shapes_xtc = <XtcHeader *>(<char *>d + sizeof(Dgram))
+    cdef XtcHeader* data_xtc
+    if <char *>shapes_xtc + sizeof(XtcHeader) > end \
+            or (shapes_xtc.contains & TypeIdMask) != TypeIdShapesData \
+            or (shapes_xtc.src & SrcValueMask) != names_id \
+            or <char *>shapes_xtc + shapes_xtc.extent > end:
+        return NULL
+    end = <char *>shapes_xtc + shapes_xtc.extent
+    data_xtc = <XtcHeader *>(<char *>shapes_xtc + sizeof(XtcHeader))
+    if <char *>data_xtc + sizeof(XtcHeader) <= end \
+            and (data_xtc.contains & TypeIdMask) == TypeIdShapes \
+            and data_xtc.extent >= sizeof(XtcHeader):
+        data_xtc = <XtcHeader *>(<char *>data_xtc + data_xtc.extent)
+    if <char *>data_xtc + sizeof(XtcHeader) + sizeof(SmdInfo) > end \
+            or (data_xtc.contains & TypeIdMask) != TypeIdData \
+            or data_xtc.extent < sizeof(XtcHeader) + sizeof(SmdInfo):
+        return NULL
+    return <SmdInfo *>(<char *>data_xtc + sizeof(XtcHeader))
+
+
+def smdinfo_names_id(config):
+    """ Returns the NamesId of the smdinfo Names in a Configure dgram
+    (-1 if the dgram has none, e.g. a bigdata file used as smd).
+    """
+    cdef Py_buffer buf
+    cdef Dgram* d
+    cdef int64_t names_id = -1
+    PyObject_GetBuffer(config, &buf, PyBUF_SIMPLE | PyBUF_ANY_CONTIGUOUS)
+    try:
+        d = <Dgram *>buf.buf
+        if <size_t>buf.len >= sizeof(Dgram) \
+                and <size_t>buf.len >= sizeof(Dgram) + d.xtc.extent - sizeof(Xtc):
+            names_id = _find_names_id(<XtcHeader *>&d.xtc, b'smdinfo')
+    finally:
+        PyBuffer_Release(&buf)
+    return names_id
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def index_smd_batch(view, unsigned char[:] use_smds, int64_t[:] smdinfo_names_ids,
+        int has_bd, int64_t bd_chunksize,
+        int64_t[:,:] smd_offset_array, int64_t[:,:] smd_size_array,
+        int64_t[:,:] bd_offset_array, int64_t[:,:] bd_size_array,
+        int64_t[:,:] cutoff_flag_array, int64_t[:] services):
+    """ Fills offset, size, service and cutoff arrays of an smd batch in one pass.
+
+    The batch (view) is laid out as
+    [
+      [[d_bytes][d_bytes]....[evt_footer]] <-- 1 event
+      [[d_bytes][d_bytes]....[evt_footer]]
+      [chunk_footer]]
+
+    Only the packet footers and the fixed-layout Dgram/Xtc headers are read.
+    L1Accept bigdata offset and size are taken from the smdinfo ShapesData,
+    which is the only child of L1Accept smd dgrams and must have the NamesId
+    of the smdinfo Names in the smd file's Configure (smdinfo_names_ids, see
+    smdinfo_names_id). Returns False without
+    completing the arrays if a dgram does not have this layout so that
+    the caller can fall back to creating full dgrams.
+    """
+    cdef Py_buffer buf
+    cdef char* base
+    cdef Py_ssize_t n_events, n_smds, i_evt, i_smd
+    cdef uint32_t* evt_sizes
+    cdef uint32_t* dgram_sizes
+    cdef int64_t evt_offset = 0
+    cdef int64_t offset
+    cdef int64_t i_first_L1 = -1
+    cdef Dgram* d
+    cdef SmdInfo* smdinfo
+    cdef unsigned service
+    cdef int64_t bd_offset, bd_size
+    cdef int64_t[:] current_bd_offsets
+    cdef int64_t[:] current_bd_chunk_sizes
+    cdef bint ok = True
+
+    n_smds = smd_offset_array.shape[1]
+    # For comparing if the next dgram should be in the same read
+    current_bd_offsets = np.zeros(n_smds, dtype=np.int64)
+    # Current chunk size (gets reset at boundary)
+    current_bd_chunk_sizes = np.zeros(n_smds, dtype=np.int64)
+
+    PyObject_GetBuffer(view, &buf, PyBUF_SIMPLE | PyBUF_ANY_CONTIGUOUS)
+    try:
+        base = <char *>buf.buf
+        n_events = (<uint32_t *>(base + buf.len - sizeof(uint32_t)))[0]
+        evt_sizes = <uint32_t *>(base + buf.len - sizeof(uint32_t) * (n_events + 1))
+
+        for i_evt in range(n_events):
+            # Event footer holds sizes of the dgrams (0 for missing dgram)
+            dgram_sizes = <uint32_t *>(base + evt_offset + evt_sizes[i_evt] - sizeof(uint32_t) * (n_smds + 1))
+            offset = evt_offset
+            for i_smd in range(n_smds):
+                if dgram_sizes[i_smd] == 0:
+                    cutoff_flag_array[i_evt, i_smd] = 0
+                    continue
+
+                d = <Dgram *>(base + offset)
+                service = (d.env>>24)&0xf
+                smd_offset_array[i_evt, i_smd] = offset
+                smd_size_array[i_evt, i_smd] = sizeof(Dgram) + d.xtc.extent - sizeof(Xtc)
+                services[i_evt] = service
+
+                if service == L1Accept and has_bd:
+                    if i_first_L1 == -1:
+                        i_first_L1 = i_evt
+                    if use_smds[i_smd]:
+                        offset += dgram_sizes[i_smd]
+                        continue
+
+                    smdinfo = _get_smdinfo(d, smdinfo_names_ids[i_smd])
+                    if smdinfo == NULL:
+                        ok = False
+                        break
+                    bd_offset = smdinfo.intOffset
+                    bd_size = smdinfo.intDgramSize
+                    bd_offset_array[i_evt, i_smd] = bd_offset
+                    bd_size_array[i_evt, i_smd] = bd_size
+
+                    # Check continuous chunk
+                    if current_bd_offsets[i_smd] == bd_offset \
+                            and i_evt != i_first_L1           \
+                            and current_bd_chunk_sizes[i_smd] + bd_size < bd_chunksize:
+                        cutoff_flag_array[i_evt, i_smd] = 0
+                        current_bd_chunk_sizes[i_smd] += bd_size
+                    else:
+                        current_bd_chunk_sizes[i_smd] = bd_size
+                    current_bd_offsets[i_smd] = bd_offset + bd_size
+
+                offset += dgram_sizes[i_smd]
+            # end for i_smd
+
+            if not ok: break
+            evt_offset += evt_sizes[i_evt]
+        # end for i_evt
+    finally:
+        PyBuffer_Release(&buf)
+
+    return ok
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def index_smd_file(int fd, size_t chunksize=0x1000000):
+    """ Returns per-dgram columns of a whole smd file.
+
+    Reads the file from offset 0 in blocks of chunksize (grown if a dgram
+    does not fit) and returns a dict of numpy arrays:
+    timestamps, services, smd_offsets, smd_sizes.
+    """
+    cdef bytearray block = bytearray(chunksize)
+    cdef char* base
+    cdef Py_ssize_t n = 0, capacity = 0x10000
+    cdef Py_ssize_t got, pos, block_len
+    cdef int64_t file_offset = 0
+    cdef uint64_t size
+    cdef Dgram* d
+    
+    cols = {'timestamps':   np.zeros(capacity, dtype=np.uint64),
+            'services':     np.zeros(capacity, dtype=np.uint8),
+            'smd_offsets':  np.zeros(capacity, dtype=np.uint64),
+            'smd_sizes':    np.zeros(capacity, dtype=np.uint64),
+           }
+    cdef uint64_t[:] timestamps  = cols['timestamps']
+    cdef unsigned char[:] services = cols['services']
+    cdef uint64_t[:] smd_offsets = cols['smd_offsets']
+    cdef uint64_t[:] smd_sizes   = cols['smd_sizes']
+
+    while True:
+        block_len = len(block)
+        got = os.preadv(fd, [block], file_offset)
+        if got == 0: break
+        base = <char *>block
+        pos = 0
+        while got - pos >= <Py_ssize_t>sizeof(Dgram):
+            d = <Dgram *>(base + pos)
+            size = sizeof(Dgram) + d.xtc.extent - sizeof(Xtc)
+            if got - pos < <Py_ssize_t>size: 
+                # Incomplete dgram - grow block if it can never fit
+                if size > <uint64_t>len(block):
+                    block = bytearray(size)
+                break
+            
+            if n == capacity:
+                capacity *= 2
+                for key in cols:
+                    cols[key] = np.resize(cols[key], capacity)
+                timestamps  = cols['timestamps']
+                services    = cols['services']
+                smd_offsets = cols['smd_offsets']
+                smd_sizes   = cols['smd_sizes']
+            
+            timestamps[n]  = <uint64_t>d.seq.high << 32 | d.seq.low
+            services[n]    = (d.env>>24)&0xf
+            smd_offsets[n] = file_offset + pos
+            smd_sizes[n]   = size
+            n += 1
+            pos += size
+        # end while got - pos
+
+        if pos == 0 and got < block_len:
+            # Truncated dgram at the end of file (e.g. file still being written)
+            break
+        file_offset += pos
+
+    for key in cols:
+        cols[key] = cols[key][:n].copy()
+    return cols
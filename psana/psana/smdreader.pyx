@@ -14,6 +14,30 @@ from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_ANY_CONT
 from psana.dgramedit import DgramEdit
 
 
+@cython.boundscheck(False)
+cdef inline uint64_t _find_last_le(uint64_t* ts_arr, uint64_t i_st, uint64_t n, uint64_t limit_ts) nogil:
+    """ Returns the last index i in [i_st, n) with ts_arr[i] <= limit_ts.
+
+    Requires ts_arr[i_st] <= limit_ts. Gallops forward from i_st with steps 
+    1, 2, 4, ... then binary searches the last step so that the cost is 
+    O(log k) for a boundary k events away.
+    """
+    cdef uint64_t lo = i_st, step = 1, hi, mid
+    while lo + step < n and ts_arr[lo + step] <= limit_ts:
+        lo += step
+        step <<= 1
+    hi = lo + step
+    if hi > n: 
+        hi = n
+    while hi - lo > 1:
+        mid = lo + (hi - lo) // 2
+        if ts_arr[mid] <= limit_ts:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
 cdef class SmdReader:
     cdef ParallelReader prl_reader
     cdef int         winner, n_view_events
@@ -43,6 +67,8 @@ cdef class SmdReader:
     cdef bytearray   _fakebuf
     cdef unsigned    _fakebuf_maxsize
     cdef unsigned    _fakebuf_size
+    cdef object      sel_ts                     # sorted user-selected timestamps (empty: no selection)
+    cdef int         window_selected            # set by view() if the window may have selected events
 
     def __init__(self, int[:] fds, int chunksize, int max_retries):
         assert fds.size > 0, "Empty file descriptor list (fds.size=0)."
@@ -70,6 +96,8 @@ cdef class SmdReader:
         self._fakebuf_maxsize   = 0x1000
         self._fakebuf           = bytearray(self._fakebuf_maxsize)
         self._fakebuf_size      = 0
+        self.sel_ts             = np.empty(0, dtype=np.uint64)
+        self.window_selected    = 1
 
         # Repack footer contains constant (per run) no. of smd files
         self.repack_footer[fds.size] = fds.size 
@@ -111,12 +139,22 @@ cdef class SmdReader:
 
         return is_complete
 
+    def close(self):
+        """ Waits for background reads (PS_SMD0_PREFETCH) so that the 
+        files can be closed. """
+        self.prl_reader.wait_prefetch()
+
     def set_configs(self, configs):
         # SmdReaderManager calls view (with batch_size=1)  at the beginning
         # to read config dgrams. It passes the configs to SmdReader for
         # creating any fake dgrams using DgramEdit.
         self.configs = configs
 
+    def set_timestamps(self, timestamps):
+        """ Sets user-selected timestamps used by view() to flag windows
+        that have none of them (see window_selected)."""
+        self.sel_ts = np.unique(np.asarray(timestamps, dtype=np.uint64))
+
     def get(self, smd_inprogress_converted):
         """SmdReaderManager only calls this function when there's no more event
         in one or more buffers. Reset the indices for buffers that need re-read."""
@@ -236,20 +274,7 @@ cdef class SmdReader:
             i_ends[i] = i_starts[i] 
             if i_ends[i] < buf.n_ready_events:
                 if buf.ts_arr[i_ends[i]] != limit_ts:
-                    ## Reduce the size of the search by searching from the next unseen event
-                    #i_ends[i] = np.searchsorted(buf_ts_arr[buf.n_seen_events:buf.n_ready_events], limit_ts) + buf.n_seen_events
-
-                    ## Note that limit_ts should be at this found index or its left index
-                    ## If the found index is 0, then this buffer has nothing to share.
-                    #if buf.ts_arr[i_ends[i]] != limit_ts:
-                    #    if i_ends[i] == 0:
-                    #        i_ends[i] = i_starts[i] - 1
-                    #    else:
-                    #        i_ends[i] -= 1
-                    
-                    while buf.ts_arr[i_ends[i] + 1] <= limit_ts \
-                            and i_ends[i] < buf.n_ready_events - 1:
-                        i_ends[i] += 1
+                    i_ends[i] = _find_last_le(buf.ts_arr, i_ends[i], buf.n_ready_events, limit_ts)
                 
                 block_sizes[i] = buf.en_offset_arr[i_ends[i]] - buf.st_offset_arr[i_starts[i]]
                
@@ -273,9 +298,7 @@ cdef class SmdReader:
             i_stepbuf_ends[i] = i_stepbuf_starts[i] 
             if i_stepbuf_ends[i] <  buf.n_ready_events \
                     and buf.ts_arr[i_stepbuf_ends[i]] <= limit_ts: 
-                while buf.ts_arr[i_stepbuf_ends[i] + 1] <= limit_ts \
-                        and i_stepbuf_ends[i] < buf.n_ready_events - 1:
-                    i_stepbuf_ends[i] += 1
+                i_stepbuf_ends[i] = _find_last_le(buf.ts_arr, i_stepbuf_ends[i], buf.n_ready_events, limit_ts)
                 
                 block_sizes[i] = buf.en_offset_arr[i_stepbuf_ends[i]] - buf.st_offset_arr[i_stepbuf_starts[i]]
                 
@@ -287,6 +310,22 @@ cdef class SmdReader:
                 i_stepbuf_starts[i]  = i_stepbuf_ends[i] + 1
 
         # end for i in ...
+        
+        # With user-selected timestamps, check if any of them falls in
+        # [earliest ts in the window, limit_ts]. All streams' windows lie 
+        # in this range so a window without one can be skipped as a whole.
+        cdef uint64_t min_ts = limit_ts
+        cdef Py_ssize_t i_sel
+        self.window_selected = 1
+        if self.sel_ts.shape[0] > 0:
+            for i in range(self.prl_reader.nfiles):
+                buf = &(self.prl_reader.bufs[i])
+                if block_size_bufs[i] > 0 and buf.ts_arr[i_st_bufs[i]] < min_ts:
+                    min_ts = buf.ts_arr[i_st_bufs[i]]
+            i_sel = np.searchsorted(self.sel_ts, min_ts, side='left')
+            if i_sel == self.sel_ts.shape[0] or self.sel_ts[i_sel] > limit_ts:
+                self.window_selected = 0
+
         en_all = time.monotonic()
 
         self.total_time += en_all - st_all
@@ -388,6 +427,10 @@ cdef class SmdReader:
             total_size += self.block_size_bufs[i]
         return total_size
 
+    @property
+    def window_selected(self):
+        return self.window_selected
+
     @property
     def view_size(self):
         return self.n_view_events
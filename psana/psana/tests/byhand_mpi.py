@@ -47,3 +47,9 @@ class Test:
         env['PS_SRV_NODES'] = '2'
         run_smalldata = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'run_smalldata.py')
         subprocess.check_call(['mpirun','-n','6','python',run_smalldata], env=env)
+
+    def test_dark_proc_mpi(self):
+        # reduction of DarkProcStreaming statistics over ranks
+        run_dark_proc_mpi = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'run_dark_proc_mpi.py')
+        subprocess.check_call(['mpirun','-n','3','python',run_dark_proc_mpi])
+        subprocess.check_call(['mpirun','-n','4','python',run_dark_proc_mpi])
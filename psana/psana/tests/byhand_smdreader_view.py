@@ -0,0 +1,72 @@
+""" Microbenchmark for SmdReader.view
+
+Writes synthetic smd files (empty L1Accept dgrams) where stream 0 is
+slower than the others by --ratio, then times only the view() calls.
+Each view has to find its boundary --ratio * --batch-size events into
+the fast streams, which is the case that large PS_SMD0_CHUNKSIZE hits.
+
+Usage:
+    python byhand_smdreader_view.py --n-streams 16 --n-events 1000000 --chunksize 0x1000000
+
+Keep chunksize / 24 below 0x100000 (max. events per SmdReader buffer).
+"""
+import os, time
+import argparse
+import struct
+import tempfile
+import numpy as np
+from psana.smdreader import SmdReader
+from psana.psexp import TransitionId
+
+DGRAM_SIZE = 24
+
+def write_smd_file(filename, n_events, ts_step):
+    # Dgram header: seq (low, high), env, xtc (src, damage, contains, extent)
+    env = TransitionId.L1Accept << 24
+    with open(filename, 'wb') as f:
+        for i_evt in range(n_events):
+            ts = (i_evt + 1) * ts_step
+            f.write(struct.pack('<IIIIHHI', ts & 0xffffffff, ts >> 32, env, 0, 0, 0, 12))
+
+def run_view(fds, chunksize, batch_size):
+    smdr = SmdReader(np.asarray(fds, dtype=np.int32), chunksize, 0)
+    n_views = 0
+    n_events = 0
+    while True:
+        if not smdr.is_complete():
+            smdr.get(None)
+            if not smdr.is_complete(): break
+        smdr.view(batch_size=batch_size)
+        n_views += 1
+        n_events += smdr.view_size
+    return n_views, n_events, smdr.total_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-streams', type=int, default=16)
+    parser.add_argument('--n-events', type=int, default=1000000, help='no. of events in each fast stream')
+    parser.add_argument('--ratio', type=int, default=100, help='fast to slow stream event ratio')
+    parser.add_argument('--chunksize', type=lambda x: int(x, 0), default=0x1000000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filenames = []
+        for i in range(args.n_streams):
+            filename = os.path.join(tmp_dir, f'data-s{i:02d}.smd.xtc2')
+            if i == 0:
+                write_smd_file(filename, max(args.n_events // args.ratio, 1), args.ratio)
+            else:
+                write_smd_file(filename, args.n_events, 1)
+            filenames.append(filename)
+
+        fds = [os.open(filename, os.O_RDONLY) for filename in filenames]
+        st = time.monotonic()
+        n_views, n_events, view_time = run_view(fds, args.chunksize, args.batch_size)
+        en = time.monotonic()
+        for fd in fds:
+            os.close(fd)
+
+    mb = args.n_events * (args.n_streams - 1) * DGRAM_SIZE / 1e6
+    print(f'streams={args.n_streams} events/stream={args.n_events} chunksize={args.chunksize/1e6:.1f}MB batch_size={args.batch_size}')
+    print(f'views={n_views} winner events={n_events} view time={view_time:.4f}s ({view_time*1e6/max(n_views,1):.1f}us/view) total={en-st:.2f}s ({mb/(en-st):.1f} MB/s)')
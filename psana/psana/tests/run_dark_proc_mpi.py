@@ -0,0 +1,55 @@
+# mpirun -n 3 python run_dark_proc_mpi.py
+# Checks the reduction of DarkProcStreaming statistics over ranks against
+# the statistics of all frames of all ranks with the gates of each rank.
+# The last two ranks have less than nrecs1 and NINIT frames (no 2nd stage statistics).
+import numpy as np
+from mpi4py import MPI
+import psana.detector.UtilsCalib as uc
+
+comm = MPI.COMM_WORLD
+rank, size = comm.Get_rank(), comm.Get_size()
+
+shape = (2, 16, 24)
+nrecs1 = 50
+nframes = [200]*(size-2) + [30, 3]
+
+def rank_frames(r):
+    rng = np.random.default_rng(r)
+    ped = np.random.default_rng(100).uniform(500, 3000, size=shape)
+    frames = np.round(ped + 10*rng.normal(size=(nframes[r],)+shape))
+    hits = rng.random(frames.shape) < 0.02
+    frames[hits] += 1000
+    return frames.astype(np.uint16)
+
+frames = rank_frames(rank)
+dpo = uc.DarkProcStreaming(nrecs=1000, nrecs1=nrecs1, comm=comm)
+for i, raw in enumerate(frames):
+    dpo.event(raw, i)
+gates = comm.allgather((dpo.gate_lo.copy(), dpo.gate_hi.copy()) if nframes[rank] > nrecs1 else None)
+dpo.summary()
+arr_av1, arr_rms, arr_sta = dpo.constants_av1_rms_sta()
+
+blocks, goods = [], []
+lo = hi = 0
+for r in range(size):
+    if gates[r] is None: continue
+    block = rank_frames(r)[nrecs1:].astype(np.float64)
+    blocks.append(block)
+    goods.append((block >= gates[r][0]) & (block <= gates[r][1]))
+    lo = lo + (block < gates[r][0]).sum(axis=0)
+    hi = hi + (block > gates[r][1]).sum(axis=0)
+sum0 = sum(good.sum(axis=0) for good in goods)
+mean = sum((block*good).sum(axis=0) for block, good in zip(blocks, goods))/sum0
+m2 = sum((np.square(block - mean)*good).sum(axis=0) for block, good in zip(blocks, goods))
+all_frames = np.concatenate([rank_frames(r) for r in range(size)])
+
+assert dpo.nrec2 == sum(n - nrecs1 for n in nframes if n > nrecs1)
+assert np.array_equal(dpo.arr_sum0, sum0)
+assert np.allclose(arr_av1, mean)
+assert np.allclose(arr_rms, np.sqrt(m2/sum0))
+assert np.array_equal(dpo.sta_int_lo, lo)
+assert np.array_equal(dpo.sta_int_hi, hi)
+assert np.array_equal(dpo.arr_max, all_frames.max(axis=0))
+assert np.array_equal(dpo.arr_min, all_frames.min(axis=0))
+assert np.array_equal(dpo.gate_lo, np.min([g[0] for g in gates if g is not None], axis=0))
+assert np.array_equal(dpo.gate_hi, np.max([g[1] for g in gates if g is not None], axis=0))
@@ -11,13 +11,20 @@ def launch_client(pid):
     run = next(ds.runs())
     cspad = run.Detector('xppcspad')
     hsd = run.Detector('xpphsd')
+    # hold arrays of recent events to check that their shmem buffers
+    # are not reused while referenced (see PS_SHMEM_MAX_LEASES)
+    held = []
     for evt in run.events():
         assert(hsd.raw.calib(evt).shape==(5,))
         assert(hsd.fex.calib(evt).shape==(6,))
         padarray = vals.padarray
         assert(np.array_equal(cspad.raw.calib(evt),np.stack((padarray,padarray))))
         assert(np.array_equal(cspad.raw.image(evt),np.vstack((padarray,padarray))))
+        raw = cspad.raw._segments(evt)[0].arrayRaw # no copy of the dgram data
+        held = held[-7:] + [(raw, raw.copy())]
         dg_count += 1
+    for raw, raw_copy in held:
+        assert(np.array_equal(raw, raw_copy))
     return dg_count  
 
 #------------------------------
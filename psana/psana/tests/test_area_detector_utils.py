@@ -0,0 +1,61 @@
+import numpy as np
+import psana.detector.UtilsAreaDetector as uad
+
+def test_multipixel_reductions():
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, 40, size=(2, 16, 20))
+    cols = rng.integers(0, 50, size=(2, 16, 20))
+    weight = rng.normal(size=rows.shape).astype(np.float32)
+    img_sta, multinds, nentries = uad.statistics_of_pixel_arrays(rows, cols)
+
+    # reference: loop over pixels
+    expected_sta = np.zeros(img_sta.shape, dtype=np.uint16)
+    for r, c in zip(rows.ravel(), cols.ravel()): expected_sta[r, c] += 1
+    assert np.array_equal(img_sta, expected_sta)
+
+    img_inds = rows.ravel() * img_sta.shape[1] + cols.ravel()
+    expected_max = {}
+    expected_sum = {}
+    for w, i in zip(weight.ravel(), img_inds):
+        if expected_sta.ravel()[i] < 2: continue
+        expected_max[i] = max(expected_max.get(i, w), w)
+        expected_sum[i] = expected_sum.get(i, 0) + w
+    assert set(multinds[1]) == set(expected_max) == set(nentries[0])
+
+    img = uad.img_from_pixel_arrays(rows, cols, weight=weight)
+    uad.img_multipixel_max(img, weight, multinds)
+    for i, v in expected_max.items(): assert img.ravel()[i] == v
+
+    img = uad.img_from_pixel_arrays(rows, cols, weight=weight)
+    uad.img_multipixel_mean(img, weight, multinds, nentries)
+    for i, v in expected_sum.items():
+        assert np.isclose(img.ravel()[i], v / expected_sta.ravel()[i], atol=1e-5)
+
+def test_image_assembler():
+    rng = np.random.default_rng(1)
+    r, c = np.meshgrid(np.arange(30), np.arange(40), indexing='ij')
+    rows = np.stack([np.floor((r+0.5)*1.1 + 2), np.floor((r+0.5)*0.9 + 40)]).astype(np.int64)
+    cols = np.stack([np.floor((c+0.5)*0.9 + 2), np.floor((c+0.5)*1.1 + 3)]).astype(np.int64)
+    # single pixel holes inside the panels
+    cols[0, 10:20:3, 5:30:4] += 1
+    data = rng.normal(size=rows.shape).astype(np.float32)
+    _, multinds, nentries = uad.statistics_of_pixel_arrays(rows, cols)
+    _, _, hole_rows, hole_cols, _ = uad.statistics_of_holes(rows, cols)
+    assert hole_rows.size > 0
+
+    for mapmode in (1, 2, 3):
+        for fillholes in (False, True):
+            expected = uad.img_from_pixel_arrays(rows, cols, weight=data, vbase=5)
+            if mapmode == 2: uad.img_multipixel_max(expected, data, multinds)
+            if mapmode == 3: uad.img_multipixel_mean(expected, data, multinds, nentries)
+            if fillholes: uad.fill_holes(expected, hole_rows, hole_cols)
+
+            assembler = uad.ImageAssembler(rows, cols, mapmode=mapmode, fillholes=fillholes)
+            out = np.zeros(assembler.shape, dtype=np.float32)
+            img = assembler.image(data, vbase=5, out=out)
+            assert img is out
+            assert np.array_equal(img, expected)
+
+if __name__ == "__main__":
+    test_multipixel_reductions()
+    test_image_assembler()
@@ -0,0 +1,34 @@
+import numpy as np
+import psana.detector.UtilsCommonMode as ucm
+
+def common_mode_apply_per_panel(arrf, mask, cmpars, nbanks_rows_cols):
+    # Reference: per panel and per bank correction
+    alg, mode, cormax, npixmin = cmpars
+    nbr, nbc = nbanks_rows_cols
+    hrows = int(arrf.shape[1]/nbr)
+    for s in range(arrf.shape[0]):
+        if mode & 4:
+            ucm.common_mode_2d_hsplit_nbanks(arrf[s,:hrows,:], mask=mask[s,:hrows,:], nbanks=nbc, cormax=cormax, npix_min=npixmin)
+            ucm.common_mode_2d_hsplit_nbanks(arrf[s,hrows:,:], mask=mask[s,hrows:,:], nbanks=nbc, cormax=cormax, npix_min=npixmin)
+        if mode & 1:
+            ucm.common_mode_rows_hsplit_nbanks(arrf[s,], mask=mask[s,], nbanks=nbc, cormax=cormax, npix_min=npixmin)
+        if mode & 2:
+            ucm.common_mode_cols(arrf[s,:hrows,:], mask=mask[s,:hrows,:], cormax=cormax, npix_min=npixmin)
+            ucm.common_mode_cols(arrf[s,hrows:,:], mask=mask[s,hrows:,:], cormax=cormax, npix_min=npixmin)
+
+def test_common_mode_apply():
+    rng = np.random.default_rng(0)
+    shape = (2, 64, 96)
+    arrf = (rng.normal(0, 5, size=shape) + rng.normal(0, 20, size=shape[:2] + (1,))).astype(np.float32)
+    for bad_frac in (0.1, 0.9):
+        mask = (rng.random(shape) > bad_frac).astype(np.uint8)
+        for mode in range(1, 8):
+            cmpars = (7, mode, 30, 10)
+            expected = arrf.copy()
+            common_mode_apply_per_panel(expected, mask, cmpars, (2,8))
+            result = arrf.copy()
+            ucm.common_mode_apply(result, mask, cmpars=cmpars, nbanks_rows_cols=(2,8))
+            assert np.allclose(expected, result, atol=1e-4)
+
+if __name__ == "__main__":
+    test_common_mode_apply()
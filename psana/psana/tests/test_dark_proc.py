@@ -0,0 +1,42 @@
+import numpy as np
+import psana.detector.UtilsCalib as uc
+
+def test_dark_proc_streaming():
+    rng = np.random.default_rng(0)
+    shape = (2, 32, 48)
+    ped = rng.uniform(500, 3000, size=shape)
+    sigma = rng.uniform(2, 20, size=shape)
+    nrecs, nrecs1 = 400, 100
+
+    dpo = uc.DarkProcStreaming(nrecs=nrecs, nrecs1=nrecs1)
+    frames = []
+    for i in range(nrecs):
+        raw = ped + sigma * rng.normal(size=shape)
+        hits = rng.random(shape) < 0.02
+        raw[hits] += rng.uniform(100, 3000, size=hits.sum())
+        raw = np.round(raw).astype(np.uint16)
+        frames.append(raw)
+        status = dpo.event(raw, i)
+    assert status == 2
+    assert dpo.block is None
+    dpo.summary()
+    arr_av1, arr_rms, arr_sta = dpo.constants_av1_rms_sta()
+
+    # pedestals within a fraction of noise, rms of +-5% gated gaussian is ~0.8 of sigma
+    assert np.median(np.abs(arr_av1 - ped) / sigma) < 0.1
+    assert 0.7 < np.median(arr_rms / sigma) < 0.95
+    assert np.count_nonzero(arr_sta) < 0.2 * arr_sta.size
+
+    # 2nd stage statistics are exact for the estimated gates
+    block = np.array(frames[nrecs1:], dtype=np.float64)
+    good = (block >= dpo.gate_lo) & (block <= dpo.gate_hi)
+    n = good.sum(axis=0)
+    mean = (block * good).sum(axis=0) / n
+    rms = np.sqrt((np.square(block - mean) * good).sum(axis=0) / n)
+    assert np.allclose(arr_av1, mean)
+    assert np.allclose(arr_rms, rms)
+    assert np.array_equal(dpo.arr_max, np.max(frames, axis=0))
+    assert np.array_equal(dpo.arr_min, np.min(frames, axis=0))
+
+if __name__ == "__main__":
+    test_dark_proc_streaming()
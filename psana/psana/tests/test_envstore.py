@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+from types import SimpleNamespace
+
+from psana.psexp.envstore import EnvStore
+
+ENV_NAME = 'scan'
+
+def fake_config(algs):
+    """ Config with algs = {alg: [var_name, ...]} in segment 0. """
+    seg = SimpleNamespace(dettype='scan', detid='scanid')
+    for alg, var_names in algs.items():
+        setattr(seg, alg, SimpleNamespace(version=1, **{var_name: SimpleNamespace(_type=9, _rank=0) for var_name in var_names}))
+    return SimpleNamespace(software=SimpleNamespace(**{ENV_NAME: {0: seg}}))
+
+class fake_dgram:
+    def __init__(self, timestamp, vals):
+        """ vals = {alg: {var_name: value}}, None for a dgram without env data. """
+        self._timestamp = timestamp
+        if vals is not None:
+            setattr(self, ENV_NAME, {0: SimpleNamespace(**{alg: SimpleNamespace(**v) for alg, v in vals.items()})})
+
+    def timestamp(self):
+        return self._timestamp
+
+def fake_dgrams(rng, timestamps, algs):
+    """ Each dgram has a random subset of algs (or no env data at all). """
+    dgrams = []
+    for i, ts in enumerate(timestamps):
+        if rng.random() < 0.2:
+            dgrams.append(fake_dgram(ts, None))
+            continue
+        vals = {alg: {var_name: (alg, var_name, i) for var_name in var_names}
+                for alg, var_names in algs.items() if rng.random() < 0.4}
+        dgrams.append(fake_dgram(ts, vals))
+    return dgrams
+
+def backward_walk_values(store, events, env_variable, n_search_steps):
+    """ Per-event backward walk over the env dgrams (reference). """
+    env_values = []
+    for evt in events:
+        event_timestamp = np.array([evt.timestamp], dtype=np.uint64)
+        for env_man in store.env_managers:
+            val = None
+            env_var_loc = env_man.locate_variable(env_variable)
+            if env_var_loc:
+                alg, segment_id = env_var_loc
+                found_pos = np.searchsorted(env_man.timestamps, event_timestamp)[0]
+                if found_pos == env_man.n_items:
+                    found_pos -= 1
+                for p in range(found_pos, found_pos - n_search_steps, -1):
+                    if p < 0:
+                        break
+                    if hasattr(env_man.dgrams[p], store.env_name):
+                        envs = getattr(env_man.dgrams[p], store.env_name)[segment_id]
+                        if hasattr(envs, alg):
+                            val = getattr(getattr(envs, alg), env_variable)
+                            break
+                if val is not None: break
+        env_values.append(val)
+    return env_values
+
+@pytest.mark.parametrize('n_search_steps', [1, 3, 10])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_values(monkeypatch, seed, n_search_steps):
+    # x is in both env managers, y and z in only one and w in none
+    monkeypatch.setenv('PS_N_STEP_SEARCH_STEPS', str(n_search_steps))
+    rng = np.random.default_rng(seed)
+    algs = [{'fast': ['x'], 'slow': ['y']}, {'fast': ['x', 'z']}]
+    store = EnvStore([fake_config(a) for a in algs], ENV_NAME)
+    dgrams = [fake_dgrams(rng, np.arange(10, 310, 10) + 3 * i, a) for i, a in enumerate(algs)]
+
+    # Events before, at (searchsorted side='left') and between the env
+    # timestamps and after the last one
+    events = [SimpleNamespace(timestamp=ts) for ts in range(0, 330)]
+    for n_added in (0, 15, 30):
+        for i, env_dgrams in enumerate(dgrams):
+            for d in env_dgrams[store.env_managers[i].n_items:n_added]:
+                store.add_to(d, i)
+        for var_name in ('x', 'y', 'z', 'w'):
+            expected = backward_walk_values(store, events, var_name, n_search_steps)
+            assert store.values(events, var_name) == expected
+            assert [store.values([evt], var_name)[0] for evt in events] == expected
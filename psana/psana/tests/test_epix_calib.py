@@ -1,5 +1,7 @@
 from psana import DataSource
+import psana.detector.UtilsEpix10ka as uek
 import os
+import pytest
 import numpy as np
 
 def test_epix_calib():
@@ -13,5 +15,63 @@ def test_epix_calib():
         calibsample=image[10][0:5]
         assert np.allclose(correctanswer[nevt][0:5], calibsample, rtol=.001)
 
+def test_epix_calib_out():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    ds = DataSource(files=os.path.join(dir_path,'test_epix_calib.xtc2'))
+    myrun = next(ds.runs())
+    epix = myrun.Detector('epixquad')
+    out = None
+    for nevt,evt in enumerate(myrun.events()):
+        calib = epix.raw.calib(evt)
+        if out is None:
+            out = np.empty(calib.shape, dtype=np.float32)
+        assert epix.raw.calib(evt, out=out) is out
+        assert np.allclose(calib, out)
+
+class fake_epix_raw:
+    _det_name = 'fake_epix10ka'
+    _data_bit_mask = 0x3fff
+
+    def __init__(self, nsegs, seed):
+        rng = np.random.default_rng(seed)
+        shape = (nsegs, 6, 8)
+        self.cbits = rng.integers(0, 64, size=shape)
+        self.data = rng.integers(0, 0x4000, size=shape).astype(np.uint16) | 0x4000
+        self.peds = rng.uniform(100, 200, size=(7,)+shape)
+        self.gain = rng.uniform(0.5, 20, size=(7,)+shape)
+
+    def raw(self, evt): return self.data
+    def _cbits_config_and_data_detector(self, evt): return self.cbits
+    def _common_mode(self): return None
+    def _mask_from_status(self, **kwa): return None
+    def _pedestals(self): return self.peds
+    def _gain(self): return self.gain
+
+    def expected(self):
+        grinds = uek.GAIN_RANGE_INDEX_LUT[self.cbits & 63][None,...]
+        peds = np.concatenate((self.peds, np.zeros_like(self.peds[:1])))
+        gfac = np.concatenate((1/self.gain, np.ones_like(self.gain[:1])))
+        return ((self.data & 0x3fff) - np.take_along_axis(peds, grinds, 0)[0])\
+               * np.take_along_axis(gfac, grinds, 0)[0]
+
+def test_calib_epix10ka_any_new_constants():
+    # tables and buffers follow the constants and the raw shape of det_raw
+    uek.dic_store.pop(fake_epix_raw._det_name, None)
+    det_raw = fake_epix_raw(4, 0)
+    assert np.allclose(uek.calib_epix10ka_any(det_raw, None), det_raw.expected())
+    new = fake_epix_raw(4, 1)
+    det_raw.peds = new.peds
+    assert np.allclose(uek.calib_epix10ka_any(det_raw, None), det_raw.expected())
+    det_raw.gain = new.gain
+    assert np.allclose(uek.calib_epix10ka_any(det_raw, None), det_raw.expected())
+    det_raw = fake_epix_raw(2, 2)
+    assert np.allclose(uek.calib_epix10ka_any(det_raw, None), det_raw.expected())
+    with pytest.raises(ValueError):
+        uek.calib_epix10ka_any(det_raw, None, out=np.empty((4, 6, 8), dtype=np.float32))
+    with pytest.raises(ValueError):
+        uek.calib_epix10ka_any(det_raw, None, out=np.empty((2, 6, 8)))
+
 if __name__ == "__main__":
     test_epix_calib()
+    test_epix_calib_out()
+    test_calib_epix10ka_any_new_constants()
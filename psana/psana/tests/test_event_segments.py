@@ -0,0 +1,64 @@
+import pytest
+from types import SimpleNamespace
+
+from psana.event import Event
+from psana.detector.detector_impl import DetectorImpl
+
+class fake_dgram:
+    def __init__(self, timestamp, dets):
+        """ dets = {det_name: {segment: {drp_class_name: drp_class}}} """
+        self._timestamp = timestamp
+        self._hidden = {0: 'not a detector'}
+        for det_name, segment_dict in dets.items():
+            setattr(self, det_name, {segment: SimpleNamespace(**drp_classes)
+                                     for segment, drp_classes in segment_dict.items()})
+
+    def timestamp(self):
+        return self._timestamp
+
+def det_impl(det_name, drp_class_name, segment_ids):
+    configinfo = SimpleNamespace(configs=[], sorted_segment_ids=sorted(segment_ids),
+                                 uniqueid=None, dettype=None)
+    return DetectorImpl(det_name, drp_class_name, configinfo, {})
+
+def test_det_segments():
+    runinfo = {0: {'runinfo': 'run 1'}}
+    dgrams = [fake_dgram(1, {'xppcspad': {0: {'raw': 'raw0', 'fex': 'fex0'}, 1: {'raw': 'raw1'}},
+                             'runinfo': runinfo}),
+              None, # missing dgram
+              fake_dgram(1, {'xppcspad': {2: {'raw': 'raw2'}}, 'epix': {0: {'raw': 'epix0'}},
+                             'runinfo': runinfo})]
+    evt = Event(dgrams)
+
+    assert evt._get_det_segments('xppcspad', 'raw') == {0: 'raw0', 1: 'raw1', 2: 'raw2'}
+    assert evt._get_det_segments('xppcspad', 'fex') == {0: 'fex0'}
+    assert evt._get_det_segments('xppcspad', 'calib') is None
+    assert evt._get_det_segments('andor', 'raw') is None
+    assert evt._get_det_segments('runinfo', 'runinfo') == {0: 'run 1'}
+    assert evt._det_segments == {('xppcspad', 'raw'): {0: 'raw0', 1: 'raw1', 2: 'raw2'},
+                                 ('xppcspad', 'fex'): {0: 'fex0'},
+                                 ('epix', 'raw'): {0: 'epix0'},
+                                 ('runinfo', 'runinfo'): {0: 'run 1'}}
+
+    # all promised segments must be in the event
+    assert det_impl('xppcspad', 'raw', [0, 1, 2])._segments(evt) == {0: 'raw0', 1: 'raw1', 2: 'raw2'}
+    assert det_impl('xppcspad', 'raw', [0, 1, 2, 3])._segments(evt) is None
+    assert det_impl('xppcspad', 'raw', [0, 1, 3])._segments(evt) is None
+    assert det_impl('xppcspad', 'fex', [0, 1])._segments(evt) is None
+    assert det_impl('andor', 'raw', [0])._segments(evt) is None
+
+    # the segment dicts are looked up again after new dgrams are inserted
+    evt._replace(1, fake_dgram(1, {'xppcspad': {3: {'raw': 'raw3'}}}))
+    evt._complete()
+    assert det_impl('xppcspad', 'raw', [0, 1, 2, 3])._segments(evt) == {0: 'raw0', 1: 'raw1', 2: 'raw2', 3: 'raw3'}
+
+def test_duplicate_segment():
+    dgrams = [fake_dgram(1, {'xppcspad': {0: {'raw': 'raw0'}}}),
+              fake_dgram(1, {'xppcspad': {0: {'raw': 'raw0 again'}}, 'epix': {0: {'raw': 'epix0'}}})]
+    # only the detector with the duplicate segment fails when it is looked up
+    evt = Event(dgrams)
+    assert det_impl('epix', 'raw', [0])._segments(evt) == {0: 'epix0'}
+    with pytest.raises(AssertionError, match='duplicate segment'):
+        det_impl('xppcspad', 'raw', [0])._segments(evt)
+    with pytest.raises(AssertionError, match='duplicate segment'):
+        evt._det_segments
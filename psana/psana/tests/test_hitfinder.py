@@ -0,0 +1,56 @@
+import numpy as np
+from psana.hexanode.HitFinder import HitFinder
+
+PARAMS = {'runtime_u': 90, 'runtime_v': 100, 'tsum_avg_u': 130, 'tsum_avg_v': 141,
+          'tsum_hw_u': 6, 'tsum_hw_v': 6, 'f_u': 1, 'f_v': 1, 'Rmax': 45}
+
+def find_hits_per_mcp(mcp, u1, u2, v1, v2):
+    # Reference: loop over MCP signals and all anode signal pairs
+    xs, ys, ts = [], [], []
+    for t in mcp:
+        pairs = {}
+        for k, s1, s2, rt, avg, hw, f in (('u', u1, u2, 90, 130, 6, 1), ('v', v1, v2, 100, 141, 6, 1)):
+            t1, t2 = (-rt+2*t+avg)/2, (rt+2*t+avg)/2
+            pairs[k] = [(a - b)*f/2 for a in s1 if t1 < a < t2 for b in s2 if t1 < b < t2
+                        if avg - hw < a + b - 2*t < avg + hw]
+        for x in pairs['u']:
+            for y in pairs['v']:
+                if np.sqrt(x**2 + y**2) < PARAMS['Rmax']:
+                    xs.append(x); ys.append(y); ts.append(t)
+    return np.array(xs), np.array(ys), np.array(ts)
+
+def test_hitfinder_batch():
+    rng = np.random.default_rng(0)
+    events = []
+    for nhits in (0, 1, 5, 20):
+        mcp = np.sort(rng.uniform(1500, 4000, nhits))
+        sigs = []
+        for rt, avg in ((90, 130), (100, 141)):
+            pos = rng.uniform(-rt/2, rt/2, nhits)
+            for sgn in (1, -1):
+                sig = np.concatenate([mcp + avg/2 + sgn*pos + rng.normal(0, 1, nhits), rng.uniform(1500, 4100, 3)])
+                sigs.append(np.sort(sig))
+        events.append((mcp, *sigs))
+    # NaN times do not match and do not move the other signals
+    mcp, u1, u2, v1, v2 = [sig.copy() for sig in events[-1]]
+    mcp[3] = u1[5] = v2[0] = np.nan
+    events.insert(2, (mcp, u1, u2, v1, v2))
+
+    hf = HitFinder(PARAMS)
+    hf.FindHitsBatch(*zip(*events))
+    # X, Y, T are new arrays of each call unless reuse=True
+    X, Y, T = hf.GetXYT()
+    nhits = hf.GetNumberOfHits()
+    assert nhits.sum() == X.size > 0
+
+    offsets = np.cumsum(nhits) - nhits
+    for i, event in enumerate(events):
+        expected = find_hits_per_mcp(*event)
+        for reuse in (False, True):
+            hf.FindHits(*event, reuse=reuse)
+            for a, b, c in zip((X, Y, T), hf.GetXYT(), expected):
+                assert np.array_equal(a[offsets[i]:offsets[i]+nhits[i]], c)
+                assert np.array_equal(b, c)
+
+if __name__ == "__main__":
+    test_hitfinder_batch()
@@ -0,0 +1,44 @@
+import numpy as np
+from scipy.optimize import bisect
+from psana.hexanode.PyCFD import PyCFD, PyCFDBatch
+
+def cfd_per_crossing(cfd, wf, wt):
+    # Reference: loop over crossings with scalar bisection
+    wf = wf[(wt>cfd.timerange_low)&(wt<cfd.timerange_high)]
+    wt = wt[(wt>cfd.timerange_low)&(wt<cfd.timerange_high)]
+    wf_1 = wf[:-cfd.delay]
+    wf_cal = wf_1 - cfd.fraction*wf[cfd.delay:]
+    y = cfd.polarity*wf_cal-cfd.walk+cfd.polarity*(cfd.fraction*cfd.offset-cfd.offset)
+    s = np.sign(y)
+    inds = np.where((s[:-1] < s[1:]) & (s[1:] != 0) & ((y[1:] - y[:-1]) >= 1e-8))[0]
+    inds = inds[cfd.polarity*wf_1[inds] > (cfd.threshold+cfd.polarity*cfd.offset)]
+    t_cfd = []
+    for i in inds:
+        t_arr, y_arr = wt[i-1:i+3], y[i-1:i+3]
+        if i < 1 or len(y_arr) != 4: continue
+        t_cfd.append(bisect(cfd.NewtonPolynomial3, t_arr[1], t_arr[2], args=(t_arr, y_arr), xtol=cfd.xtol))
+    return np.array(t_cfd)
+
+def test_pycfd_batch():
+    rng = np.random.default_rng(0)
+    nch, ns = 5, 4000
+    params = [{'sample_interval': 0.25, 'delay': 1.0 + 0.25*ch, 'fraction': 0.35 + 0.1*ch, 'threshold': 5.,
+               'walk': 0.1*ch, 'polarity': 'Negative' if ch%2 else 'Positive',
+               'timerange_low': 10. + ch, 'timerange_high': 950. - ch, 'offset': 0.3*ch} for ch in range(nch)]
+    wts = np.tile(np.arange(ns)*0.25, (nch,1))
+    wfs = rng.normal(0, 1., (nch, ns))
+    for ch in range(nch):
+        for t0 in rng.uniform(0, ns*0.25, 10):
+            wfs[ch] += (-1 if ch%2 else 1)*rng.uniform(10, 100)*np.exp(-0.5*((wts[ch]-t0)/1.5)**2)
+
+    cfds = [PyCFD(p) for p in params]
+    t_cfd, nhits = PyCFDBatch(cfds)(wfs, wts)
+    offsets = np.cumsum(nhits) - nhits
+    assert nhits.sum() > nch
+    for ch, cfd in enumerate(cfds):
+        expected = cfd_per_crossing(cfd, wfs[ch], wts[ch])
+        assert np.array_equal(t_cfd[offsets[ch]:offsets[ch]+nhits[ch]], expected)
+        assert np.array_equal(cfd.CFD(wfs[ch], wts[ch]), expected)
+
+if __name__ == "__main__":
+    test_pycfd_batch()
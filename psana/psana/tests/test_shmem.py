@@ -15,10 +15,11 @@ class Test:
         cmd_args = ['shmemServer','-c',str(client_count),'-n','10','-f',tmp_file,'-p','shmem_test_'+pid,'-s','0x80000']
         return subprocess.Popen(cmd_args)
 
-    def launch_client(self,pid):
+    def launch_client(self,pid,max_leases):
         shmem_file = os.path.dirname(os.path.realpath(__file__))+'/shmem_client.py'  
         cmd_args = ['python',shmem_file,pid]
-        return subprocess.Popen(cmd_args)
+        env = dict(os.environ, PS_SHMEM_MAX_LEASES=max_leases)
+        return subprocess.Popen(cmd_args, env=env)
                 
     @staticmethod
     def setup_input_files(tmp_path):
@@ -28,7 +29,9 @@ class Test:
         subprocess.call(['xtcwriter','-t','-n',str(dgram_count),'-f',str(tmp_file)])
         return tmp_file
         
-    def test_shmem(self, tmp_path):
+    # 0: L1Accepts are copied out of shmem, 4: up to 4 zero-copy L1Accepts per client
+    @pytest.mark.parametrize('max_leases', ['0', '4'])
+    def test_shmem(self, tmp_path, max_leases):
         cli = []
         pid = str(os.getpid())
         tmp_file = self.setup_input_files(tmp_path)
@@ -36,7 +39,7 @@ class Test:
         assert srv != None,"server launch failure"
         try:
             for i in range(client_count):
-              cli.append(self.launch_client(pid))
+              cli.append(self.launch_client(pid,max_leases))
               assert cli[i] != None,"client "+str(i)+ " launch failure"
         except:
             srv.kill()
@@ -1,8 +1,11 @@
 
 
 import os
+import numpy as np
 from setup_input_files import setup_input_files
+import h5py
 import run_smalldata
+from psana.smalldata import ColumnBatch, Server
 
 def test_smalldata(tmp_path):
     setup_input_files(tmp_path) # tmp_path is from pytest
@@ -11,3 +14,41 @@ def test_smalldata(tmp_path):
     return
 
 
+def test_column_batch():
+    batch = [{'timestamp': 1, 'oneint': 1, 'arrfloat': np.ones(2)},
+             {'timestamp': 2, 'twofloat': 2.0},
+             {'timestamp': 3, 'oneint': 3, 'unaligned_int': np.int16(3)}]
+    cbatch = ColumnBatch.from_events(batch)
+    columns = {name: (present, values) for name, present, values in cbatch.columns()}
+    assert np.array_equal(columns['oneint'][0], [True, False, True])
+    assert np.array_equal(columns['oneint'][1], [1, 3])
+    assert columns['arrfloat'][1].shape == (1, 2)
+
+    events = ColumnBatch(cbatch.meta, cbatch.buf.copy()).events()
+    assert len(events) == len(batch)
+    for event_data_dict, expected in zip(events, batch):
+        assert event_data_dict.keys() == expected.keys()
+        for key, value in expected.items():
+            assert type(event_data_dict[key]) == type(value)
+            assert np.array_equal(event_data_dict[key], value)
+
+
+def test_server_writer_thread(tmp_path):
+    batches = [[{'timestamp': i, 'oneint': i, 'arrfloat': np.full(2, i, dtype=np.float32)}
+                if i % 3 else {'timestamp': i} for i in range(i_batch*7, (i_batch+1)*7)]
+               for i_batch in range(10)]
+    results = []
+    for writer_thread in (False, True):
+        filename = str(tmp_path / f'writer_thread_{writer_thread}.h5')
+        server = Server(filename=filename, cache_size=9, writer_thread=writer_thread)
+        for i_batch, batch in enumerate(batches):
+            if i_batch % 2:
+                server.handle_columns(ColumnBatch.from_events(batch))
+            else:
+                server.handle(batch)
+        server.done()
+        with h5py.File(filename, 'r') as f:
+            results.append({name: f[name][:] for name in f})
+    assert results[0].keys() == results[1].keys()
+    for name in results[0]:
+        assert np.array_equal(results[0][name], results[1][name], equal_nan=True)
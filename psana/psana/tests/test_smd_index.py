@@ -0,0 +1,46 @@
+import os
+import numpy as np
+from setup_input_files import setup_input_files
+
+from psana import DataSource
+from psana.psexp import SmdIndex, TransitionId
+
+def test_smd_index(tmp_path, monkeypatch):
+    setup_input_files(tmp_path, n_files=2, gen_run2=False)
+    xtc_dir = str(tmp_path / '.tmp')
+    smd_file = os.path.join(xtc_dir, 'smalldata', 'data-r0001-s00.smd.xtc2')
+
+    fd = os.open(smd_file, os.O_RDONLY)
+    smd_index = SmdIndex(smd_file).load(fd)
+    assert os.path.isfile(smd_index.index_file)
+    assert smd_index.cols['services'][0] == TransitionId.Configure
+
+    # Cached index must give the same columns
+    builds = []
+    build = SmdIndex._build
+    def count_build(self, fd):
+        builds.append(fd)
+        build(self, fd)
+    monkeypatch.setattr(SmdIndex, '_build', count_build)
+    cached_index = SmdIndex(smd_file).load(fd)
+    assert builds == []
+    for key in SmdIndex.columns:
+        assert np.array_equal(smd_index.cols[key], cached_index.cols[key])
+
+    # Same size but modified since the index was built
+    st = os.stat(smd_file)
+    os.utime(smd_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    SmdIndex(smd_file).load(fd)
+    assert builds == [fd]
+    SmdIndex(smd_file).load(fd)
+    assert builds == [fd]
+    os.close(fd)
+
+    l1_timestamps = smd_index.cols['timestamps'][smd_index.cols['services'] == TransitionId.L1Accept]
+    timestamps = l1_timestamps[[1,3]]
+
+    monkeypatch.setenv('PS_SMD_INDEX', '1')
+    ds = DataSource(exp='xpptut13', run=1, dir=xtc_dir, timestamps=timestamps)
+    run = next(ds.runs())
+    evt_timestamps = [evt.timestamp for evt in run.events()]
+    assert np.array_equal(np.asarray(evt_timestamps, dtype=np.uint64), timestamps)
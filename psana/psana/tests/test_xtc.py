@@ -2,6 +2,7 @@ import os, shutil
 import subprocess
 import sys
 import pytest
+import numpy as np
 sys.path = [os.path.abspath(os.path.dirname(__file__))] + sys.path
 from xtc import xtc
 from det import det, detnames, det_container
@@ -66,6 +67,176 @@ class Test:
         run_early_termination = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'run_early_termination.py')
         subprocess.check_call(['python',run_early_termination], env=env)
 
+    def test_bd_mmap(self, tmp_path):
+        setup_input_files(tmp_path)
+
+        env = dict(list(os.environ.items()) + [
+            ('TEST_XTC_DIR', str(tmp_path)),
+            ('PS_BD_MMAP', '1'),
+        ])
+
+        loop_based_exhausted = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ds.py')
+        subprocess.check_call(['python',loop_based_exhausted], env=env)
+
+    def test_bd_prefetch(self, tmp_path):
+        setup_input_files(tmp_path)
+
+        env = dict(list(os.environ.items()) + [
+            ('TEST_XTC_DIR', str(tmp_path)),
+            ('PS_BD_CHUNKSIZE', '4096'),
+            ('PS_BD_PREFETCH_DEPTH', '2'),
+        ])
+
+        loop_based_exhausted = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ds.py')
+        subprocess.check_call(['python',loop_based_exhausted], env=env)
+
+    def test_smd0_prefetch(self, tmp_path):
+        setup_input_files(tmp_path)
+
+        # chunksize is above the size of Configure (42704 bytes) and below the
+        # size of the smd file of stream 0 (44104 bytes) so that chunks are swapped
+        env = dict(list(os.environ.items()) + [
+            ('TEST_XTC_DIR', str(tmp_path)),
+            ('PS_SMD_CHUNKSIZE', '43000'),
+            ('PS_SMD0_PREFETCH', '1'),
+        ])
+
+        loop_based_exhausted = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ds.py')
+        subprocess.check_call(['python',loop_based_exhausted], env=env)
+
+    @pytest.mark.parametrize('n_ranks, n_eb_nodes', [('3', '1'), ('7', '2')])
+    def test_smd0_skip_window_mpi(self, tmp_path, n_ranks, n_eb_nodes):
+        # selected timestamps fall in only some of the smd batches (down to
+        # one event per batch) so that smd0 skips the other batches
+        env = dict(list(os.environ.items()) + [
+            ('TEST_XTC_DIR', str(tmp_path)),
+            ('PS_SRV_NODES', '0'),
+            ('PS_EB_NODES', n_eb_nodes),
+        ])
+
+        run_steps = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'run_steps_w_ts_filter.py')
+        subprocess.check_call(['mpirun','-n',n_ranks,'python',run_steps], env=env)
+
+    def test_bd_prefetch_abandon(self, tmp_path, monkeypatch):
+        # prefetched reads are waited for when the events are abandoned and
+        # reads of chunks that are not used do not stop the events
+        import gc, threading, time, weakref
+        from psana.psexp import event_manager
+        from psana.psexp.event_manager import EventManager, ExitId
+        setup_input_files(tmp_path)
+        monkeypatch.setenv('PS_BD_CHUNKSIZE', '4096')
+        monkeypatch.setenv('PS_BD_PREFETCH_DEPTH', '2')
+
+        pread = event_manager._pread
+        in_flight = []
+        def failing_prefetch_pread(fd, size, offset, **kwargs):
+            if threading.current_thread() is threading.main_thread():
+                return pread(fd, size, offset, **kwargs)
+            in_flight.append(offset)
+            time.sleep(0.2)
+            in_flight.remove(offset)
+            return bytearray()
+        monkeypatch.setattr(event_manager, '_pread', failing_prefetch_pread)
+        evt_mans = []
+        init = EventManager.__init__
+        def record_init(self, *args, **kwargs):
+            init(self, *args, **kwargs)
+            evt_mans.append(weakref.ref(self))
+        monkeypatch.setattr(EventManager, '__init__', record_init)
+
+        def first_event():
+            ds = DataSource(exp='xpptut13', run=1, dir=str(tmp_path / '.tmp'))
+            myrun = next(ds.runs())
+            evt = next(myrun.events())
+            evt_man = evt_mans[-1]()
+            assert sum(len(queue) for queue in evt_man.prefetched) > 0
+            return evt_man
+
+        evt_man = first_event()
+        evt_man.close()
+        assert in_flight == []
+        assert evt_man.exit_id == ExitId.NoError
+        del evt_man
+        gc.collect()
+        assert evt_mans[-1]() is None
+
+        first_event()
+        gc.collect()
+        assert evt_mans[-1]() is None
+        assert in_flight == []
+
+    @pytest.mark.parametrize('names_id', [None, -1])
+    def test_smd_indexer(self, tmp_path, monkeypatch, names_id):
+        # the compiled smd indexer fills the same arrays as creating every smd
+        # dgram and leaves batches with an unknown smdinfo NamesId to the latter
+        from psana.psexp import event_manager, PacketFooter
+        from psana.psexp.event_manager import EventManager
+        setup_input_files(tmp_path)
+        if names_id is not None:
+            monkeypatch.setattr(event_manager, 'smdinfo_names_id', lambda config: names_id)
+
+        n_stepped = [0]
+        get_offset_and_size = EventManager._get_offset_and_size
+        step_through_smd_view = EventManager._step_through_smd_view
+        def step_through(self, smd_chunk_pf):
+            n_stepped[0] += 1
+            step_through_smd_view(self, smd_chunk_pf)
+        def check_offset_and_size(self):
+            get_offset_and_size(self)
+            names = ['smd_offset_array', 'smd_size_array', 'bd_offset_array', 'bd_size_array',
+                     'new_chunk_id_array', 'cutoff_flag_array', 'services']
+            arrays = [getattr(self, name).copy() for name in names]
+            smd_chunk_pf = PacketFooter(view=self.smd_view)
+            self._alloc_offset_and_size_arrays(smd_chunk_pf.n_packets)
+            step_through_smd_view(self, smd_chunk_pf)
+            for name, array in zip(names, arrays):
+                assert np.array_equal(getattr(self, name), array), name
+        monkeypatch.setattr(EventManager, '_get_offset_and_size', check_offset_and_size)
+        monkeypatch.setattr(EventManager, '_step_through_smd_view', step_through)
+
+        ds = DataSource(exp='xpptut13', run=1, dir=str(tmp_path / '.tmp'), batch_size=3)
+        myrun = next(ds.runs())
+        assert sum(1 for evt in myrun.events()) > 0
+        if names_id is None:
+            assert n_stepped[0] == 0
+        else:
+            assert n_stepped[0] > 0
+
+    def test_dgram_lazy(self, tmp_path):
+        setup_input_files(tmp_path)
+
+        env = dict(list(os.environ.items()) + [
+            ('TEST_XTC_DIR', str(tmp_path)),
+            ('PS_DGRAM_LAZY', '1'),
+        ])
+
+        loop_based_exhausted = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ds.py')
+        subprocess.check_call(['python',loop_based_exhausted], env=env)
+
+    @pytest.mark.parametrize('prefetch', ['0', '1'])
+    def test_dm_chunksize(self, xtc_file, monkeypatch, prefetch):
+        # single-file mode reading 100-byte blocks (grown for bigger dgrams)
+        # gives the same events as reading dgram by dgram
+        def events(chunksize):
+            monkeypatch.setenv('PS_DM_CHUNKSIZE', chunksize)
+            monkeypatch.setenv('PS_SMD0_PREFETCH', prefetch)
+            ds = DataSource(files=xtc_file)
+            myrun = next(ds.runs())
+            return [(evt.timestamp, [bytes(d) for d in evt._dgrams]) for evt in myrun.events()]
+        expected = events('0')
+        assert len(expected) > 0
+        assert events('100') == expected
+
+    @pytest.mark.parametrize('max_timestamps', ['0', '3'])
+    def test_dm_timestamps(self, xtc_file, monkeypatch, max_timestamps):
+        from psana.dgrammanager import DgramManager
+        monkeypatch.setenv('PS_DM_MAX_TIMESTAMPS', max_timestamps)
+        dm = DgramManager(xtc_file)
+        expected = [evt.timestamp for evt in dm]
+        if max_timestamps != '0':
+            expected = expected[-int(max_timestamps):]
+        assert dm.get_timestamps().tolist() == expected
+
     def test_detnames(self, xtc_file):
         # for now just check that the various detnames don't crash
         for flag in ['-r','-e','-s','-i']:
@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.cluster.hierarchy
+import psana.xtcav.ClusteringUtils as cu
+
+def cluster_variance_per_group(assignments, data, num_clusters):
+    # Reference: loop over groups as in the old calculateClusterVariance
+    d = 0
+    for group in range(num_clusters):
+        points = data[assignments == group,:]
+        d += np.sum(np.linalg.norm(points - np.mean(points, axis=0), axis=1)**2)
+    return d
+
+def test_gap_statistic_linkage_cache():
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-10, 10, (4, 12))
+    X = centers[rng.integers(0, 4, 120)] + rng.normal(size=(120, 12))
+
+    ks = list(range(2, 20))
+    for method, distance in cu.TREE_METHODS.items():
+        groups = scipy.cluster.hierarchy.cut_tree(cu.linkageTree(X, distance), n_clusters=ks)
+        expected = [np.log(cluster_variance_per_group(groups[:,i], X, k)) for i, k in enumerate(ks)]
+        assert np.allclose(cu.logClusterVariances(X, ks, method), expected, rtol=1e-12)
+        assert cu.linkageTree(X.copy(), distance) is cu.linkageTree(X, distance)
+        assert np.array_equal(cu.hierarchicalClustering(X, 5, distance), groups[:,3])
+
+    np.random.seed(0)
+    opt_serial = cu.findOptGroups(X, 20, use_SVD=False, nproc=1)
+    np.random.seed(0)
+    opt_parallel = cu.findOptGroups(X, 20, use_SVD=False, nproc=2)
+    assert opt_serial == opt_parallel == 4
+
+def test_get_pool(monkeypatch):
+    # serial unless asked for processes, which are spawned (not forked in MPI ranks)
+    monkeypatch.delenv('PS_XTCAV_NPROC', raising=False)
+    assert cu.getPool() is None
+    monkeypatch.setenv('PS_XTCAV_NPROC', '3')
+    pool = cu.getPool(num_tasks=2)
+    try:
+        assert pool._max_workers == 2
+        assert pool._mp_context.get_start_method() == 'spawn'
+    finally:
+        pool.shutdown()
+    assert cu.getPool(nproc=1) is None
+
+if __name__ == "__main__":
+    test_gap_statistic_linkage_cache()
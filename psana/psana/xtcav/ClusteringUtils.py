@@ -1,11 +1,17 @@
+import os
+import hashlib
+import collections
+import concurrent.futures
+import multiprocessing
 import numpy as np
 import scipy.interpolate
+import scipy.cluster.hierarchy
 import time
 import cv2
 import scipy.io
 import math
 import psana.xtcav.Constants
-from sklearn.cluster import AgglomerativeClustering, KMeans
+from sklearn.cluster import KMeans
 from sklearn import metrics
 
 
@@ -66,35 +72,105 @@ def oldGroupingMethod(X, num_groups):
     return group
 
 
+# distance of hierarchical clustering methods, other methods do not build a linkage tree
+TREE_METHODS = {'hierarchical': 'euclidean', 'cosine': 'cosine', 'l1': 'l1'}
+SCIPY_METRICS = {'l1': 'cityblock'}
+
+LINKAGE_CACHE_SIZE = 64
+_linkage_cache = collections.OrderedDict()
+
+
+def linkageTree(X, distance='euclidean'):
+    """
+    Linkage tree of hierarchical clustering, which can be cut at any number of clusters.
+    Trees are cached by content of X, so that clustering the same profiles again does not rebuild the tree
+    Arguments:
+      X: profiles to group
+      distance: 'euclidean' for ward linkage, otherwise average linkage with this distance
+    Output
+      Z: linkage matrix in scipy.cluster.hierarchy format
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    key = (hashlib.sha1(X.data).hexdigest(), X.shape, distance)
+    Z = _linkage_cache.get(key)
+    if Z is not None:
+        _linkage_cache.move_to_end(key)
+        return Z
+    if distance == 'euclidean':
+        Z = scipy.cluster.hierarchy.linkage(X, method='ward')
+    else:
+        Z = scipy.cluster.hierarchy.linkage(X, method='average', metric=SCIPY_METRICS.get(distance, distance))
+    _linkage_cache[key] = Z
+    if len(_linkage_cache) > LINKAGE_CACHE_SIZE:
+        _linkage_cache.popitem(last=False)
+    return Z
+
+
 def hierarchicalClustering(X, num_clusters, distance='euclidean'):
     """
-    wrapper function for sklearn agglomerative clustering algorithm
+    agglomerative clustering, ward linkage for euclidean distance and average linkage otherwise,
+    cuts the cached linkage tree of X
+    """
+    return scipy.cluster.hierarchy.cut_tree(linkageTree(X, distance), n_clusters=[num_clusters])[:,0]
+
+
+def getPool(nproc=None, num_tasks=None):
+    """
+    Process pool for the gap statistic, None if it should be calculated serially
+    Workers are spawned rather than forked since the caller may be an MPI rank
+    Arguments:
+      nproc: number of processes, by default from environment variable PS_XTCAV_NPROC (serial if not set)
+      num_tasks: maximal number of tasks running at once
+    """
+    if nproc is None:
+        nproc = int(os.environ.get('PS_XTCAV_NPROC', '1'))
+    if num_tasks is not None:
+        nproc = min(nproc, num_tasks)
+    if nproc <= 1:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(max_workers=nproc,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+
+
+def mapTasks(pool, func, *iterables):
+    return list(pool.map(func, *iterables) if pool is not None else map(func, *iterables))
+
+
+def logClusterVariances(X, nums_clusters, method='hierarchical'):
+    """
+    Log of intercluster variance of X grouped into each of nums_clusters groups,
+    hierarchical methods cut one linkage tree at all numbers of clusters
     """
-    linkage = 'ward' if distance == 'euclidean' else 'average'
-    model = AgglomerativeClustering(n_clusters=num_clusters, linkage=linkage, affinity=distance)
-    model.fit(X)
-    return model.labels_
+    if method in ('old', 'kmeans'):
+        return [np.log(calculateClusterVariance(getGroups(X, n, method=method), X, n)) for n in nums_clusters]
+    distance = TREE_METHODS.get(method, 'euclidean')
+    Z = linkageTree(X, distance)
+    if distance == 'euclidean':
+        #ward merge of distance d increases intercluster variance by d**2/2, k clusters are left after n-k merges
+        variance = np.concatenate(([0.], np.cumsum(np.square(Z[:,2])/2)))
+        return [np.log(variance[X.shape[0]-n]) for n in nums_clusters]
+    groups = scipy.cluster.hierarchy.cut_tree(Z, n_clusters=nums_clusters)
+    return [np.log(calculateClusterVariance(groups[:,i], X, n)) for i, n in enumerate(nums_clusters)]
 
 
-def findOptGroups(X, max_num, method='hierarchical', B=30, use_SVD=True):
+def findOptGroups(X, max_num, method='hierarchical', B=30, use_SVD=True, nproc=None):
     """
     Helper function to find optimal # of groups for profiles using the Gap Statistic
+    Reference sets are clustered in parallel processes, see getPool
     Arguments:
       X: profiles to group
       B: number of reference groups to generate
       max_num: maximum number of groups allowed
+      nproc: number of processes
     Output
       opt: the optimal number of groups for this data
     """
     num_profiles, t = X.shape
-    rand_cluster_variance = {}
-    true_cluster_variance = {}
-    sd = {}
 
     if use_SVD:
         #use the SVD of profiles to cluster. Speeds things up a lot...
         num_features = max(30, max_num) # use minimum of 30 features
-        u, s, vt = np.linalg.svd(X.T)
+        u, s, vt = np.linalg.svd(X.T, full_matrices=False)
         W = u[:, 0:num_features - 1]
         X = np.matmul(X, W)
 
@@ -111,36 +187,51 @@ def findOptGroups(X, max_num, method='hierarchical', B=30, use_SVD=True):
         rand_sample = np.matmul(rand_sample, vt) + column_mean
         reference_sets.append(rand_sample)
 
-    gap_statistic = {}
-    sd = {}
-    
     min_clusters = 2
     step = 1 if max_num - min_clusters <= 15 else 2 if max_num - min_clusters <= 30 else 3 #choose step size of 1, 2 or 3
-    clusters = list(range(min_clusters+step, max_num+step, step))
-    gap_statistic[min_clusters], _ = calculateGapStatistic(min_clusters, X, reference_sets, method=method)
-    
-    for clus in clusters:
-        gap_statistic[clus], sd[clus] = calculateGapStatistic(clus, X, reference_sets, method=method)
-        if gap_statistic[clus] - sd[clus]*step < gap_statistic[clus-step]:
-            return clus-step
-    return max_num
+    all_clusters = list(range(min_clusters+step, max_num+step, step))
+    clusters = [clus for clus in all_clusters if clus < num_profiles] # can not cluster into more groups than profiles
+    opt_max = max_num if len(clusters) == len(all_clusters) else ([min_clusters] + clusters)[-1]
+
+    pool = getPool(nproc, B)
+    try:
+        if method in ('old', 'kmeans'):
+            #no linkage tree, cluster reference sets in parallel for one number of clusters at a time
+            gap_statistic = {}
+            gap_statistic[min_clusters], _ = calculateGapStatistic(min_clusters, X, reference_sets, method=method, pool=pool)
+            for clus in clusters:
+                gap_statistic[clus], sd = calculateGapStatistic(clus, X, reference_sets, method=method, pool=pool)
+                if gap_statistic[clus] - sd*step < gap_statistic[clus-step]:
+                    return clus-step
+            return opt_max
 
+        #one linkage tree per data set cut at all numbers of clusters, reference sets in parallel
+        nums_clusters = [min_clusters] + clusters
+        true_variance = np.array(logClusterVariances(X, nums_clusters, method))
+        rand_variance = np.array(mapTasks(pool, logClusterVariances, reference_sets,\
+                                          [nums_clusters]*B, [method]*B))
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
-def calculateGapStatistic(n, X, reference_sets, method='hierarchical'):
+    gap_statistic = np.mean(rand_variance, axis=0) - true_variance
+    sd = np.std(rand_variance, axis=0) * np.sqrt(1+1./B)
+    for i in range(1, len(nums_clusters)):
+        if gap_statistic[i] - sd[i]*step < gap_statistic[i-1]:
+            return nums_clusters[i-1]
+    return opt_max
+
+
+def calculateGapStatistic(n, X, reference_sets, method='hierarchical', pool=None):
     """
     Calculation of gap statistic for specific number of clusters
     https://statweb.stanford.edu/~gwalther/gap
 
     """
     B = len(reference_sets)
-    groups = getGroups(X, n, method=method)
-    true_cluster_variance = np.log(calculateClusterVariance(groups, X, n))
-    rand_variance = []
-    num_profiles = X.shape[0]
+    true_cluster_variance = logClusterVariances(X, [n], method)[0]
     #fit to B random reference datasets
-    for k in range(B):        
-        groups = getGroups(reference_sets[k], n, method=method)
-        rand_variance.append(np.log(calculateClusterVariance(groups, reference_sets[k], n)))
+    rand_variance = [v[0] for v in mapTasks(pool, logClusterVariances, reference_sets, [[n]]*B, [method]*B)]
     rand_cluster_variance = np.mean(rand_variance)
     sd = np.std(rand_variance)* np.sqrt(1+1./B)
     gap_statistic = rand_cluster_variance - true_cluster_variance
@@ -151,12 +242,13 @@ def calculateClusterVariance(assignments, data, num_clusters):
     """
     Calculation of intercluster variance
     """
-    d = 0
-    for group in range(num_clusters):
-        points = data[assignments == group,:]
-        center = np.mean(points, axis = 0)
-        d += sum(np.apply_along_axis(lambda x: np.linalg.norm(x - center)**2, 1, points))
-    return d
+    sel = (assignments >= 0) & (assignments < num_clusters)
+    assignments, data = assignments[sel], data[sel]
+    counts = np.bincount(assignments, minlength=num_clusters)
+    centers = np.zeros((num_clusters, data.shape[1]), dtype=np.float64)
+    np.add.at(centers, assignments, data)
+    centers /= np.maximum(counts, 1)[:,np.newaxis]
+    return np.sum(np.square(data - centers[assignments]))
 
 def getPercentile(data, percentile=0.9):
     a = np.cumsum(data, axis=0)
@@ -189,7 +281,8 @@ def generateRandSample(bounding_box, num_profiles):
     """
     generates a random sample of the same structure as the input data
     """
-    return np.apply_along_axis(lambda l : np.random.uniform(l[0], l[1], num_profiles), 1, bounding_box).T
+    bounding_box = np.array(bounding_box, dtype=np.float64).reshape(-1, 2)
+    return np.random.uniform(bounding_box[:,0:1], bounding_box[:,1:2], (len(bounding_box), num_profiles)).T
 
 
 def getBoundingBox(X):
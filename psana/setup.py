@@ -273,6 +273,14 @@ if 'DGRAM' in BUILD_LIST :
     )
     CYTHON_EXTS.append(ext)
 
+    ext = Extension("psana.smdindexer",
+                    sources=["psana/smdindexer.pyx"],
+                    include_dirs=["psana",np.get_include()],
+                    extra_compile_args=extra_c_compile_args,
+                    extra_link_args=extra_link_args,
+    )
+    CYTHON_EXTS.append(ext)
+
     ext = Extension("psana.parallelreader",
                     sources=["psana/parallelreader.pyx"],
                     include_dirs=["psana"],
@@ -11,6 +11,8 @@
 #include <errno.h>
 #include <fcntl.h>
 #include <string.h>
+#include <stdlib.h>
+#include <vector>
 #include <numpy/arrayobject.h>
 #include <numpy/ndarraytypes.h>
 #include <structmember.h>
@@ -45,6 +47,20 @@ struct PyDgramObject {
     NamesIter* namesIter;   // only nonzero in the config dgram
     ssize_t size;           // size of dgram - for allocating dgram of any size
     int max_retries;        // set no. of retries when reading data (default=0)
+    int lazy;               // config dgram only: decode L1Accept fields on access (PS_DGRAM_LAZY=1)
+};
+
+// Container for the fields of one detector/segment/alg (e.g. xppcspad[0].raw)
+// that are only decoded from the ShapesData on the first attribute access.
+struct PyLazyContainerObject {
+    PyObject_HEAD
+    PyObject* dict;
+    PyObject* configDgram;          // owns the NamesLookup
+    PyObject* pycontainertype;
+    PyObject* dgrambytes;           // base object of the field arrays
+    Py_buffer buf;                  // keeps the dgram bytes in place
+    std::vector<size_t>* offsets;   // offsets of the ShapesData in buf
+    bool decoded;
 };
 
 static void addObjToPyObj(PyObject* parent, const char* name, PyObject* obj, PyObject* pycontainertype) {
@@ -244,13 +260,13 @@ static void dictAssignConfig(PyDgramObject* pyDgram, NamesLookup& namesLookup)
 }
 
 // return an "enum object" (with a value/dict that can be added to the pydgram
-static PyObject* createEnum(const char* enumname, PyDgramObject* pyDgram, DescData& descdata) {
+static PyObject* createEnum(const char* enumname, PyObject* pycontainertype, DescData& descdata) {
     char tempName[TMPSTRINGSIZE];
     const char* enumtype = strchr(enumname,EnumDelim)+1;
     Names& names = descdata.nameindex().names();
 
     // make a container
-    PyObject* parent = PyObject_CallObject(pyDgram->contInfo.pycontainertype, NULL);
+    PyObject* parent = PyObject_CallObject(pycontainertype, NULL);
     // add the dict associated with the enum to the container
     // fill in the dict and the value
     PyObject* dict = PyDict_New();
@@ -291,6 +307,182 @@ static PyObject* createEnum(const char* enumname, PyDgramObject* pyDgram, DescDa
     return parent;
 }
 
+// return the python object for field i (0 for types that don't get added,
+// e.g. enumdict). varName is changed to tempName for enums.
+static PyObject* createField(DescData& descdata, unsigned i, PyObject* pycontainertype,
+                             PyObject* dgrambytes, const char*& varName, char* tempName)
+{
+    Name& name = descdata.nameindex().names().get(i);
+    PyObject* newobj=0; // some types don't get added here (e.g. enumdict)
+
+    if (name.rank() == 0 || name.type()==Name::CHARSTR) {
+        switch (name.type()) {
+        case Name::UINT8: {
+            const auto tempVal = descdata.get_value<uint8_t>(varName);
+            newobj = Py_BuildValue("B", tempVal);
+            break;
+        }
+        case Name::UINT16: {
+            const auto tempVal = descdata.get_value<uint16_t>(varName);
+            newobj = Py_BuildValue("H", tempVal);
+            break;
+        }
+        case Name::UINT32: {
+            const auto tempVal = descdata.get_value<uint32_t>(varName);
+            newobj = Py_BuildValue("I", tempVal);
+            break;
+        }
+        case Name::UINT64: {
+            const auto tempVal = descdata.get_value<uint64_t>(varName);
+            newobj = Py_BuildValue("K", tempVal);
+            break;
+        }
+        case Name::INT8: {
+            const auto tempVal = descdata.get_value<int8_t>(varName);
+            newobj = Py_BuildValue("b", tempVal);
+            break;
+        }
+        case Name::INT16: {
+            const auto tempVal = descdata.get_value<int16_t>(varName);
+            newobj = Py_BuildValue("h", tempVal);
+            break;
+        }
+        case Name::INT32: {
+            const auto tempVal = descdata.get_value<int32_t>(varName);
+            // cpo: thought that "l" (long int) would work here
+            // as well, but empirically it doesn't.
+            newobj = Py_BuildValue("i", tempVal);
+            break;
+        }
+        case Name::INT64: {
+            const auto tempVal = descdata.get_value<int64_t>(varName);
+            newobj = Py_BuildValue("L", tempVal);
+            break;
+        }
+        case Name::FLOAT: {
+            const auto tempVal = descdata.get_value<float>(varName);
+            newobj = Py_BuildValue("f", tempVal);
+            break;
+        }
+        case Name::DOUBLE: {
+            const auto tempVal = descdata.get_value<double>(varName);
+            newobj = Py_BuildValue("d", tempVal);
+            break;
+        }
+        case Name::CHARSTR: {
+            if (name.rank()!=1)
+                throw std::runtime_error("dgram.cc: string with rank != 1");
+            auto arr = descdata.get_array<char>(i);
+            uint32_t* shape = descdata.shape(name);
+            if (strlen(arr.data())>shape[0])
+                throw std::runtime_error("dgram.cc: unterminated string");
+            newobj = Py_BuildValue("s", arr.data());
+            break;
+        }
+        case Name::ENUMVAL: {
+            newobj = createEnum(varName, pycontainertype, descdata);
+
+            // overwrite the delimiter with the null character
+            // so the value's python name doesn't include the dict
+            // name (which follows the EnumDelim).
+            strncpy(tempName,varName,TMPSTRINGSIZE-1);
+            char* delim = strchr(tempName,EnumDelim);
+            if (!delim) throw std::runtime_error("dgram.cc: failed to find delimitor in enum");
+
+            *delim = '\0';
+            // tell the object adder to use our modified name
+            varName = tempName;
+            break;
+        }
+        default: {
+            break;
+        }
+        }
+    } else {
+        npy_intp dims[name.rank()];
+        uint32_t* shape = descdata.shape(name);
+        for (unsigned j = 0; j < name.rank(); j++) {
+            dims[j] = shape[j];
+        }
+        switch (name.type()) {
+        case Name::UINT8: {
+            auto arr = descdata.get_array<uint8_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_UINT8, arr.data());
+            break;
+        }
+        case Name::UINT16: {
+            auto arr = descdata.get_array<uint16_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_UINT16, arr.data());
+            break;
+        }
+        case Name::UINT32: {
+            auto arr = descdata.get_array<uint32_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_UINT32, arr.data());
+            break;
+        }
+        case Name::UINT64: {
+            auto arr = descdata.get_array<uint64_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_UINT64, arr.data());
+            break;
+        }
+        case Name::INT8: {
+            auto arr = descdata.get_array<int8_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_INT8, arr.data());
+            break;
+        }
+        case Name::INT16: {
+            auto arr = descdata.get_array<int16_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_INT16, arr.data());
+            break;
+        }
+        case Name::INT32: {
+            auto arr = descdata.get_array<int32_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_INT32, arr.data());
+            break;
+        }
+        case Name::INT64: {
+            auto arr = descdata.get_array<int64_t>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_INT64, arr.data());
+            break;
+        }
+        case Name::FLOAT: {
+            auto arr = descdata.get_array<float>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_FLOAT, arr.data());
+            break;
+        }
+        case Name::DOUBLE: {
+            auto arr = descdata.get_array<double>(i);
+            newobj = PyArray_SimpleNewFromData(name.rank(), dims,
+                                               NPY_DOUBLE, arr.data());
+            break;
+        }
+        default: {
+            throw std::runtime_error("dgram.cc: Unsupported array type");
+            break;
+        }
+        }
+        if (PyArray_SetBaseObject((PyArrayObject*)newobj, dgrambytes) < 0) {
+            printf("Failed to set BaseObject for numpy array.\n");
+        }
+        // PyArray_SetBaseObject steals a reference to the dgrambytes
+        // but we want the dgram to also keep a reference to it as well.
+        Py_INCREF(dgrambytes);
+
+        // make the raw data arrays read-only
+        PyArray_CLEARFLAGS((PyArrayObject*)newobj, NPY_ARRAY_WRITEABLE);
+    }
+    return newobj;
+}
+
 static void dictAssign(PyDgramObject* pyDgram, DescData& descdata, Xtc* myXtc)
 {
     Names& names = descdata.nameindex().names();
@@ -299,175 +491,9 @@ static void dictAssign(PyDgramObject* pyDgram, DescData& descdata, Xtc* myXtc)
     char keyName[2*TMPSTRINGSIZE];
     char tempName[TMPSTRINGSIZE];
     for (unsigned i = 0; i < names.num(); i++) {
-        Name& name = names.get(i);
-        const char* varName = name.name();
-        PyObject* newobj=0; // some types don't get added here (e.g. enumdict)
-
-        if (name.rank() == 0 || name.type()==Name::CHARSTR) {
-            switch (name.type()) {
-            case Name::UINT8: {
-                const auto tempVal = descdata.get_value<uint8_t>(varName);
-                newobj = Py_BuildValue("B", tempVal);
-                break;
-            }
-            case Name::UINT16: {
-                const auto tempVal = descdata.get_value<uint16_t>(varName);
-                newobj = Py_BuildValue("H", tempVal);
-                break;
-            }
-            case Name::UINT32: {
-                const auto tempVal = descdata.get_value<uint32_t>(varName);
-                newobj = Py_BuildValue("I", tempVal);
-                break;
-            }
-            case Name::UINT64: {
-                const auto tempVal = descdata.get_value<uint64_t>(varName);
-                newobj = Py_BuildValue("K", tempVal);
-                break;
-            }
-            case Name::INT8: {
-                const auto tempVal = descdata.get_value<int8_t>(varName);
-                newobj = Py_BuildValue("b", tempVal);
-                break;
-            }
-            case Name::INT16: {
-                const auto tempVal = descdata.get_value<int16_t>(varName);
-                newobj = Py_BuildValue("h", tempVal);
-                break;
-            }
-            case Name::INT32: {
-                const auto tempVal = descdata.get_value<int32_t>(varName);
-                // cpo: thought that "l" (long int) would work here
-                // as well, but empirically it doesn't.
-                newobj = Py_BuildValue("i", tempVal);
-                break;
-            }
-            case Name::INT64: {
-                const auto tempVal = descdata.get_value<int64_t>(varName);
-                newobj = Py_BuildValue("L", tempVal);
-                break;
-            }
-            case Name::FLOAT: {
-                const auto tempVal = descdata.get_value<float>(varName);
-                newobj = Py_BuildValue("f", tempVal);
-                break;
-            }
-            case Name::DOUBLE: {
-                const auto tempVal = descdata.get_value<double>(varName);
-                newobj = Py_BuildValue("d", tempVal);
-                break;
-            }
-            case Name::CHARSTR: {
-                if (name.rank()!=1)
-                    throw std::runtime_error("dgram.cc: string with rank != 1");
-                auto arr = descdata.get_array<char>(i);
-                uint32_t* shape = descdata.shape(name);
-                if (strlen(arr.data())>shape[0])
-                    throw std::runtime_error("dgram.cc: unterminated string");
-                newobj = Py_BuildValue("s", arr.data());
-                break;
-            }
-            case Name::ENUMVAL: {
-                newobj = createEnum(varName, pyDgram, descdata);
-
-                // overwrite the delimiter with the null character
-                // so the value's python name doesn't include the dict
-                // name (which follows the EnumDelim).
-                strncpy(tempName,varName,TMPSTRINGSIZE-1);
-                char* delim = strchr(tempName,EnumDelim);
-                if (!delim) throw std::runtime_error("dgram.cc: failed to find delimitor in enum");
-
-                *delim = '\0';
-                // tell the object adder to use our modified name
-                varName = tempName;
-                break;
-            }
-            default: {
-                break;
-            }
-            }
-        } else {
-            npy_intp dims[name.rank()];
-            uint32_t* shape = descdata.shape(name);
-            for (unsigned j = 0; j < name.rank(); j++) {
-                dims[j] = shape[j];
-            }
-            switch (name.type()) {
-            case Name::UINT8: {
-                auto arr = descdata.get_array<uint8_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_UINT8, arr.data());
-                break;
-            }
-            case Name::UINT16: {
-                auto arr = descdata.get_array<uint16_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_UINT16, arr.data());
-                break;
-            }
-            case Name::UINT32: {
-                auto arr = descdata.get_array<uint32_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_UINT32, arr.data());
-                break;
-            }
-            case Name::UINT64: {
-                auto arr = descdata.get_array<uint64_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_UINT64, arr.data());
-                break;
-            }
-            case Name::INT8: {
-                auto arr = descdata.get_array<int8_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_INT8, arr.data());
-                break;
-            }
-            case Name::INT16: {
-                auto arr = descdata.get_array<int16_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_INT16, arr.data());
-                break;
-            }
-            case Name::INT32: {
-                auto arr = descdata.get_array<int32_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_INT32, arr.data());
-                break;
-            }
-            case Name::INT64: {
-                auto arr = descdata.get_array<int64_t>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_INT64, arr.data());
-                break;
-            }
-            case Name::FLOAT: {
-                auto arr = descdata.get_array<float>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_FLOAT, arr.data());
-                break;
-            }
-            case Name::DOUBLE: {
-                auto arr = descdata.get_array<double>(i);
-                newobj = PyArray_SimpleNewFromData(name.rank(), dims,
-                                                   NPY_DOUBLE, arr.data());
-                break;
-            }
-            default: {
-                throw std::runtime_error("dgram.cc: Unsupported array type");
-                break;
-            }
-            }
-            if (PyArray_SetBaseObject((PyArrayObject*)newobj, pyDgram->dgrambytes) < 0) {
-                printf("Failed to set BaseObject for numpy array.\n");
-            }
-            // PyArray_SetBaseObject steals a reference to the dgrambytes
-            // but we want the dgram to also keep a reference to it as well.
-            Py_INCREF(pyDgram->dgrambytes);
-
-            // make the raw data arrays read-only
-            PyArray_CLEARFLAGS((PyArrayObject*)newobj, NPY_ARRAY_WRITEABLE);
-        }
+        const char* varName = names.get(i).name();
+        PyObject* newobj = createField(descdata, i, pyDgram->contInfo.pycontainertype,
+                                       pyDgram->dgrambytes, varName, tempName);
         if (newobj) {
             snprintf(keyName,sizeof(keyName),"%s%s%s%s%s",
                      names.detName(),PyNameDelim,names.alg().name(),
@@ -478,12 +504,192 @@ static void dictAssign(PyDgramObject* pyDgram, DescData& descdata, Xtc* myXtc)
     }
 }
 
+static void lazycontainer_dealloc(PyLazyContainerObject* self)
+{
+    Py_XDECREF(self->dict);
+    Py_XDECREF(self->configDgram);
+    Py_XDECREF(self->pycontainertype);
+    if (self->buf.buf) PyBuffer_Release(&(self->buf));
+    Py_XDECREF(self->dgrambytes);
+    delete self->offsets;
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject* lazycontainer_new(PyTypeObject* type, PyObject* args, PyObject* kwds)
+{
+    PyLazyContainerObject* self;
+    self = (PyLazyContainerObject*)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->dict = PyDict_New();
+        self->offsets = new std::vector<size_t>;
+        self->decoded = true; // nothing to decode until a ShapesData is added
+    }
+    return (PyObject*)self;
+}
+
+// decode all fields of the ShapesData into the container attributes
+static int lazycontainer_decode(PyLazyContainerObject* self)
+{
+    // set first: adding nested fields below does attribute lookups on self
+    self->decoded = true;
+    char tempName[TMPSTRINGSIZE];
+    NamesLookup& namesLookup = ((PyDgramObject*)self->configDgram)->namesIter->namesLookup();
+    try {
+        for (size_t offset : *self->offsets) {
+            ShapesData& shapesdata = *(ShapesData*)((char*)self->buf.buf + offset);
+            DescData descdata(shapesdata, namesLookup[shapesdata.namesId()]);
+            Names& names = descdata.nameindex().names();
+            for (unsigned i = 0; i < names.num(); i++) {
+                const char* varName = names.get(i).name();
+                PyObject* newobj = createField(descdata, i, self->pycontainertype,
+                                               self->dgrambytes, varName, tempName);
+                if (newobj) addObjToPyObj((PyObject*)self, varName, newobj, self->pycontainertype);
+            }
+        }
+    } catch (const std::exception& e) {
+        PyErr_SetString(PyExc_RuntimeError, e.what());
+        return -1;
+    } catch (const char* e) {
+        PyErr_SetString(PyExc_RuntimeError, e);
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject* lazycontainer_getattro(PyLazyContainerObject* self, PyObject* name)
+{
+    if (!self->decoded && lazycontainer_decode(self) < 0) return NULL;
+    return PyObject_GenericGetAttr((PyObject*)self, name);
+}
+
+static PyMemberDef lazycontainer_members[] = {
+    { (char*)"__dict__",
+      T_OBJECT_EX, offsetof(PyLazyContainerObject, dict),
+      0,
+      (char*)"attribute dictionary" },
+    { NULL }
+};
+
+static PyTypeObject dgram_LazyContainerType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "psana.dgram.LazyContainer", /* tp_name */
+    sizeof(PyLazyContainerObject), /* tp_basicsize */
+    0, /* tp_itemsize */
+    (destructor)lazycontainer_dealloc, /* tp_dealloc */
+    0, /* tp_print */
+    0, /* tp_getattr */
+    0, /* tp_setattr */
+    0, /* tp_compare */
+    0, /* tp_repr */
+    0, /* tp_as_number */
+    0, /* tp_as_sequence */
+    0, /* tp_as_mapping */
+    0, /* tp_hash */
+    0, /* tp_call */
+    0, /* tp_str */
+    (getattrofunc)lazycontainer_getattro, /* tp_getattro */
+    0, /* tp_setattro */
+    0, /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT, /* tp_flags */
+    0, /* tp_doc */
+    0, /* tp_traverse */
+    0, /* tp_clear */
+    0, /* tp_richcompare */
+    0, /* tp_weaklistoffset */
+    0, /* tp_iter */
+    0, /* tp_iternext */
+    0, /* tp_methods */
+    lazycontainer_members, /* tp_members */
+    0, /* tp_getset */
+    0, /* tp_base */
+    0, /* tp_dict */
+    0, /* tp_descr_get */
+    0, /* tp_descr_set */
+    offsetof(PyLazyContainerObject, dict), /* tp_dictoffset */
+    0, /* tp_init */
+    0, /* tp_alloc */
+    lazycontainer_new, /* tp_new */
+};
+
+// same as dictAssign, but only adds the (undecoded) alg container
+// to parent.detname[segment]
+static void lazyAssign(PyDgramObject* pyDgram, PyDgramObject* configDgram, DescData& descdata, Xtc* myXtc)
+{
+    Names& names = descdata.nameindex().names();
+    PyObject* pycontainertype = pyDgram->contInfo.pycontainertype;
+
+    // enumdicts alone don't add anything (see createField)
+    bool hasFields = false;
+    for (unsigned i = 0; i < names.num(); i++) {
+        if (names.get(i).type() != Name::ENUMDICT) {
+            hasFields = true;
+            break;
+        }
+    }
+    if (!hasFields) return;
+
+    // get (or make) the segment container, see addObjHierarchy
+    PyObject* dict;
+    if (!PyObject_HasAttrString((PyObject*)pyDgram, names.detName())) {
+        dict = PyDict_New();
+        int fail = PyObject_SetAttrString((PyObject*)pyDgram, names.detName(), dict);
+        if (fail) printf("Dgram: failed to set container attribute\n");
+    } else {
+        dict = PyObject_GetAttrString((PyObject*)pyDgram, names.detName());
+    }
+    Py_DECREF(dict); // transfer ownership to parent
+
+    PyObject* pySeg = Py_BuildValue("i", names.segment());
+    PyObject* container;
+    if (!(container=PyDict_GetItem(dict,pySeg))) {
+        container = PyObject_CallObject(pycontainertype, NULL);
+        PyDict_SetItem(dict,pySeg,container);
+        Py_DECREF(container); // transfer ownership to parent
+    }
+    Py_DECREF(pySeg);
+
+    const char* algName = names.alg().name();
+    PyLazyContainerObject* lazy;
+    PyObject* algObj = PyObject_GetAttrString(container, algName);
+    if (algObj == NULL) {
+        PyErr_Clear();
+        lazy = (PyLazyContainerObject*)lazycontainer_new(&dgram_LazyContainerType, NULL, NULL);
+        if (PyObject_GetBuffer(pyDgram->dgrambytes, &(lazy->buf), PyBUF_SIMPLE) == -1) {
+            Py_DECREF(lazy);
+            throw "lazyAssign: unable to get dgram buffer\n";
+        }
+        Py_INCREF(pyDgram->dgrambytes);
+        lazy->dgrambytes = pyDgram->dgrambytes;
+        Py_INCREF(configDgram);
+        lazy->configDgram = (PyObject*)configDgram;
+        Py_INCREF(pycontainertype);
+        lazy->pycontainertype = pycontainertype;
+        int fail = PyObject_SetAttrString(container, algName, (PyObject*)lazy);
+        if (fail) printf("Dgram: failed to set lazy container attribute\n");
+        Py_DECREF(lazy); // transfer ownership to parent
+    } else if (Py_TYPE(algObj) == &dgram_LazyContainerType) {
+        lazy = (PyLazyContainerObject*)algObj;
+        Py_DECREF(algObj); // we just want the pointer, not a new reference
+    } else {
+        // fields of this alg were already added (not expected)
+        Py_DECREF(algObj);
+        dictAssign(pyDgram, descdata, myXtc);
+        return;
+    }
+
+    lazy->offsets->push_back((char*)myXtc - (char*)lazy->buf.buf);
+    lazy->decoded = false;
+
+    setXtcForSegment((PyObject*)pyDgram, pycontainertype, names.detName(), names.segment(), myXtc);
+}
+
 class PyConvertIter : public XtcIterator
 {
 public:
     enum { Stop, Continue };
-    PyConvertIter(Xtc* xtc, const void* bufEnd, PyDgramObject* pyDgram, NamesLookup& namesLookup) :
-        XtcIterator(xtc, bufEnd), _pyDgram(pyDgram), _namesLookup(namesLookup)
+    PyConvertIter(Xtc* xtc, const void* bufEnd, PyDgramObject* pyDgram, PyDgramObject* configDgram, bool lazy) :
+        XtcIterator(xtc, bufEnd), _pyDgram(pyDgram), _configDgram(configDgram),
+        _namesLookup(configDgram->namesIter->namesLookup()), _lazy(lazy)
     {
     }
 
@@ -504,7 +710,11 @@ public:
             // in some sense.
             if (_namesLookup.count(namesId)>0) {
                 DescData descdata(shapesdata, _namesLookup[namesId]);
-                dictAssign(_pyDgram, descdata, xtc);
+                if (_lazy) {
+                    lazyAssign(_pyDgram, _configDgram, descdata, xtc);
+                } else {
+                    dictAssign(_pyDgram, descdata, xtc);
+                }
             } else {
                 printf("*** Corrupt xtc: namesid 0x%x not found in NamesLookup\n",(int)namesId);
                 throw "invalid namesid";
@@ -519,7 +729,9 @@ public:
 
 private:
     PyDgramObject* _pyDgram;
+    PyDgramObject* _configDgram;
     NamesLookup&      _namesLookup;
+    bool           _lazy;
 };
 
 static void assignDict(PyDgramObject* self, PyDgramObject* configDgram) {
@@ -535,13 +747,20 @@ static void assignDict(PyDgramObject* self, PyDgramObject* configDgram) {
         configDgram->namesIter->iterate();
 
         dictAssignConfig(configDgram, configDgram->namesIter->namesLookup());
+
+        const char* lazyEnv = getenv("PS_DGRAM_LAZY");
+        configDgram->lazy = (lazyEnv != NULL && strcmp(lazyEnv, "1") == 0);
     } else {
         self->namesIter = 0; // in case dgram was not created via dgram_init
     }
 
+    // only the (many) L1Accept dgrams are decoded lazily
+    bool lazy = !isConfig && configDgram->lazy &&
+        self->dgram->service() == TransitionId::L1Accept;
+
     auto size = sizeof(Dgram) + self->dgram->xtc.sizeofPayload();
     const void* bufEnd = (char*)(self->dgram) + size;
-    PyConvertIter iter(&self->dgram->xtc, bufEnd, self, configDgram->namesIter->namesLookup());
+    PyConvertIter iter(&self->dgram->xtc, bufEnd, self, configDgram, lazy);
     iter.iterate();
 }
 
@@ -967,6 +1186,10 @@ PyMODINIT_FUNC PyInit_dgram(void)
         return NULL;
     }
 
+    if (PyType_Ready(&dgram_LazyContainerType) < 0) {
+        return NULL;
+    }
+
     m = PyModule_Create(&dgrammodule);
     if (m == NULL) {
         return NULL;
@@ -974,6 +1197,8 @@ PyMODINIT_FUNC PyInit_dgram(void)
 
     Py_INCREF(&dgram_DgramType);
     PyModule_AddObject(m, "Dgram", (PyObject*)&dgram_DgramType);
+    Py_INCREF(&dgram_LazyContainerType);
+    PyModule_AddObject(m, "LazyContainer", (PyObject*)&dgram_LazyContainerType);
     return m;
 }
 #else
@@ -1,5 +1,14 @@
 import psdaq.configdb.configdb as cdb
+from psdaq.control.ControlDef import create_msg
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 import json
+import logging
+import zmq
+
+# timeout (ms) for replies of the control level config service, which only
+# serves cached configs (misses are replied with an error right away)
+config_service_timeout = 5000
 
 # json2xtc conversion depends on these being present with ':RO'
 # (and the :RO does not appear in the xtc names)
@@ -29,8 +38,34 @@ def get_config(connect_json,cfgtype,detname,detsegm):
     cfg_dbase = control_info['cfg_dbase'].rsplit('/', 1)
     db_url = cfg_dbase[0]
     db_name =cfg_dbase[1]
+    if 'config_service' in control_info:
+        # configs of all segments are read once by the control level at configure
+        cfg = get_config_from_service(control_info['config_service'], cfgtype, detname+'_%d'%detsegm)
+        if cfg is not None:
+            return cfg
     return get_config_with_params(db_url, instrument, db_name, cfgtype, detname+'_%d'%detsegm)
 
+# returns the config from the config service of control.py (see ConfigCache)
+# or None if the service fails or does not have the config cached
+def get_config_from_service(endpoint, cfgtype, detname):
+    context = zmq.Context.instance()
+    sock = context.socket(zmq.REQ)
+    sock.linger = 0
+    sock.RCVTIMEO = config_service_timeout
+    try:
+        sock.connect(endpoint)
+        sock.send_json(create_msg('getconfig', body={'alias': cfgtype, 'device': detname}))
+        reply = sock.recv_json()
+        if 'err_info' in reply['body']:
+            logging.info('config service %s: %s' % (endpoint, reply['body']['err_info']))
+            return None
+        return reply['body']['config']
+    except Exception as ex:
+        logging.warning('config service %s failed for %s/%s: %s' % (endpoint, cfgtype, detname, ex))
+        return None
+    finally:
+        sock.close()
+
 def get_config_with_params(db_url, instrument, db_name, cfgtype, detname):
     create = False
     mycdb = cdb.configdb(db_url, instrument, create, db_name)
@@ -42,6 +77,82 @@ def get_config_with_params(db_url, instrument, db_name, cfgtype, detname):
 
     return cfg_no_RO_names
 
+# Device configs (with :RO names removed) of one configdb, read once for all
+# segments of a partition. Configs of an alias are cached by the configdb key
+# of the alias, which is incremented by modify_device, so that modified
+# configs are read again by the next prefetch.
+class ConfigCache:
+    def __init__(self, db_url, instrument, db_name, max_workers=16):
+        self.db_url = db_url
+        self.instrument = instrument
+        self.db_name = db_name
+        self.max_workers = max_workers
+        self.keys = {}      # alias -> configdb key of the cached configs
+        self.configs = {}   # (alias, device) -> config
+        self.lock = Lock()
+
+    def _read(self, alias, device):
+        return get_config_with_params(self.db_url, self.instrument, self.db_name, alias, device)
+
+    # drop cached configs of alias (all if None), called with lock held
+    def _drop(self, alias):
+        for k in [k for k in self.configs if alias is None or k[0] == alias]:
+            del self.configs[k]
+        if alias is None:
+            self.keys.clear()
+        else:
+            self.keys.pop(alias, None)
+
+    def invalidate(self, alias=None):
+        with self.lock:
+            self._drop(alias)
+
+    # Read configs of devices which are not cached for the current key of alias.
+    # Devices without config are skipped, they get the error when they read it.
+    def prefetch(self, alias, devices):
+        mycdb = cdb.configdb(self.db_url, self.instrument, False, self.db_name)
+        key = mycdb.get_key(alias)
+        if not isinstance(key, int):
+            # configs can't be invalidated without key, segments read them
+            logging.warning('ConfigCache: no configdb key for %s, configs not cached' % alias)
+            self.invalidate(alias)
+            return
+        with self.lock:
+            if self.keys.get(alias) != key:
+                self._drop(alias)
+            missing = [d for d in set(devices) if (alias, d) not in self.configs]
+        if not missing:
+            return
+
+        def read(device):
+            try:
+                return self._read(alias, device)
+            except Exception as ex:
+                logging.warning('ConfigCache: %s/%s not cached: %s' % (alias, device, ex))
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as pool:
+            cfgs = list(pool.map(read, missing))
+        with self.lock:
+            self.keys[alias] = key
+            for device, cfg in zip(missing, cfgs):
+                if cfg is not None:
+                    self.configs[(alias, device)] = cfg
+
+    # Returns the cached config or None. Configs are not read here so that
+    # the caller does not wait for configdb, segments read missing configs.
+    def get(self, alias, device):
+        with self.lock:
+            return self.configs.get((alias, device))
+
+    # modify_device of configdb, which also drops the cached configs of alias
+    def modify_device(self, alias, value):
+        mycdb = cdb.configdb(self.db_url, self.instrument, False, self.db_name)
+        try:
+            return mycdb.modify_device(alias, value)
+        finally:
+            self.invalidate(alias)
+
 def get_config_json(*args):
     return json.dumps(get_config(*args))
 
@@ -156,6 +156,29 @@ class DaqControl:
 
         return r1
 
+    #
+    # DaqControl.getLatency - get histograms of reply latencies
+    #
+    # Returns {'edges': upper bin edges (ms), 'counts': {transition: {client: counts}}}
+    # where the last count of a client is for latencies above the last edge
+    # and for clients that did not reply before the timeout.
+    #
+    def getLatency(self):
+        r1 = None
+        try:
+            msg = create_msg('getlatency')
+            self.fast_req.send_json(msg)
+            reply = self.fast_req.recv_json()
+        except Exception as ex:
+            print('getLatency() Exception: %s' % ex)
+        else:
+            try:
+                r1 = reply['body']
+            except Exception as ex:
+                print('getLatency() Exception: %s' % ex)
+
+        return r1
+
     #
     # DaqControl.getStatus - get status
     #
@@ -12,12 +12,14 @@ import argparse
 import requests
 from requests.auth import HTTPBasicAuth
 import logging
+import bisect
 from psalg.utils.syslog import SysLog
 from p4p.client.thread import Context
 import epics
-from threading import Thread, Event, Condition
+from threading import Thread, Event, Condition, Lock
 from copy import deepcopy
 import dgramCreate as dc
+from psdaq.configdb.get_config import ConfigCache
 from psdaq.control.ControlDef import ControlDef, create_msg, error_msg, warning_msg, step_msg, \
                                   progress_msg, fileReport_msg, front_pub_port, step_pub_port, \
                                   back_pub_port, front_rep_port, back_pull_port, fast_rep_port
@@ -35,6 +37,31 @@ def set2csv(seg_set):
             seg_csv += f",{element}"    # append
     return seg_csv
 
+class LatencyHistograms:
+    """Histograms of reply latencies (ms) per transition and client"""
+    # upper bin edges (ms), the last bin counts larger latencies
+    edges = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000]
+
+    def __init__(self):
+        self.counts = {}    # transition -> 'level/alias' -> counts per bin
+        self.lock = Lock()  # read by the fastreply thread
+
+    def add(self, transition, client, latency):
+        self._count(transition, client, bisect.bisect_left(self.edges, latency))
+
+    # clients that did not reply before the timeout
+    def add_timeout(self, transition, client):
+        self._count(transition, client, len(self.edges))
+
+    def _count(self, transition, client, i):
+        with self.lock:
+            counts = self.counts.setdefault(transition, {}).setdefault(client, [0] * (len(self.edges) + 1))
+            counts[i] += 1
+
+    def get(self):
+        with self.lock:
+            return {'edges': self.edges, 'counts': deepcopy(self.counts)}
+
 class PvInfo:
     """PV"""
     def __init__(self, name, desc):
@@ -384,7 +411,8 @@ def wait_for_answers(socket, wait_time, msg_id):
             logging.error('recv_json(): %s' % ex)
             continue
         else:
-            logging.debug('recv_json(): %s' % msg)
+            logging.debug('recv_json(): %s', msg)
+        remaining = max(0, int(wait_time - 1000*(time.time() - start)))
 
         # handle async reports
         if msg['header']['key'] in report_keys:
@@ -400,7 +428,6 @@ def wait_for_answers(socket, wait_time, msg_id):
         else:
             logging.error('unexpected msg_id: got %s but expected %s' %
                           (msg['header']['msg_id'], msg_id))
-        remaining = max(0, int(wait_time - 1000*(time.time() - start)))
 
 def levels_to_activedet(src):
     dst = {"activedet": {}}
@@ -524,6 +551,7 @@ class CollectionManager():
         self.cydgram = dc.CyDgram()
         self.step_done = Event()
         self.readoutCumulative = 0
+        self.latency = LatencyHistograms()  # reply latencies per transition and client
 
         # instantiate DaqPVA object
         self.pva = DaqPVA(platform=self.platform, xpm_master=self.xpm_master, pv_base=self.pv_base, report_error=self.report_error)
@@ -590,6 +618,10 @@ class CollectionManager():
             self.station = self.platform
         logging.debug('instrument=%s, station=%d' % (self.instrument, self.station))
 
+        # configs of the drp segments, read once at configure and served by handle_getconfig
+        db_url, db_name = self.cfg_dbase.rsplit('/', 1)
+        self.config_cache = ConfigCache(db_url, self.instrument, db_name)
+
         self.experiment_name = self.get_experiment()
         if self.experiment_name:
             self.last_run_number = self.get_last_run_number()
@@ -608,7 +640,9 @@ class CollectionManager():
         }
         self.handle_fast = {
             'getinstrument': self.handle_getinstrument,
-            'getblock': self.handle_getblock
+            'getblock': self.handle_getblock,
+            'getconfig': self.handle_getconfig,
+            'getlatency': self.handle_getlatency
         }
         self.lastTransition = 'reset'
         self.recording = False
@@ -806,12 +840,17 @@ class CollectionManager():
     #
     # confirm_response -
     #
-    def confirm_response(self, socket, wait_time, msg_id, ids, *, progress_txt=None):
+    def confirm_response(self, socket, wait_time, msg_id, ids, *, progress_txt=None, latency_txt=None):
         global report_keys
-        logging.debug('confirm_response(): ids = %s' % ids)
+        logging.debug('confirm_response(): ids = %s', ids)
         msgs = []
         reports = []
         error_flag = False
+        # clients as in rollcall, e.g. 'drp/cam_0', for the latency histograms
+        clients = {xid: level + '/' + item[xid]['proc_info']['alias']
+                   for level, item in self.cmstate_levels().items() for xid in item
+                   if 'proc_info' in item[xid]}
+        start = time.time()
         begin_time = datetime.now(timezone.utc)
         end_time = begin_time + timedelta(milliseconds=wait_time)
         while len(ids) > 0 and datetime.now(timezone.utc) < end_time and not error_flag:
@@ -831,13 +870,18 @@ class CollectionManager():
                 elif msg['header']['sender_id'] in ids:
                     msgs.append(msg)
                     ids.remove(msg['header']['sender_id'])
-                    logging.debug('confirm_response(): removed %s from ids' % msg['header']['sender_id'])
+                    logging.debug('confirm_response(): removed %s from ids', msg['header']['sender_id'])
+                    if latency_txt is not None:
+                        self.latency.add(latency_txt, clients.get(msg['header']['sender_id'], msg['header']['sender_id']),
+                                         1000*(time.time() - start))
                 else:
-                    logging.debug('confirm_response(): %s not in ids' % msg['header']['sender_id'])
+                    logging.debug('confirm_response(): %s not in ids', msg['header']['sender_id'])
                 if error_flag or len(ids) == 0:
                     break
         for ii in ids:
             logging.debug('id %s did not respond' % ii)
+            if latency_txt is not None and not error_flag:
+                self.latency.add_timeout(latency_txt, clients.get(ii, ii))
         return ids, msgs, reports
 
     #
@@ -1030,7 +1074,7 @@ class CollectionManager():
         ids = self.filter_active_set(self.ids)
         ids = self.filter_level('drp', ids) | self.filter_level('meb', ids)
         # make sure all the clients respond to transition before timeout
-        missing, answers, reports = self.confirm_response(self.back_pull, self.phase2_timeout, None, ids, progress_txt=transition+' phase 2')
+        missing, answers, reports = self.confirm_response(self.back_pull, self.phase2_timeout, None, ids, progress_txt=transition+' phase 2', latency_txt=transition+' phase 2')
         try:
             self.process_reports(reports)
         except ConfigDBError as ex:
@@ -1051,7 +1095,7 @@ class CollectionManager():
         self.back_pub.send_multipart([b'all', json.dumps(msg)])
 
         # make sure all the clients respond to alloc message with their connection info
-        retlist, answers, reports = self.confirm_response(self.back_pull, 5000, msg['header']['msg_id'], ids)
+        retlist, answers, reports = self.confirm_response(self.back_pull, 5000, msg['header']['msg_id'], ids, latency_txt='alloc')
         self.process_reports(reports)
         ret = len(retlist)
         if ret:
@@ -1163,7 +1207,7 @@ class CollectionManager():
         msg = create_msg('dealloc')
         self.back_pub.send_multipart([b'partition', json.dumps(msg)])
 
-        retlist, answers, reports = self.confirm_response(self.back_pull, 30000, msg['header']['msg_id'], ids, progress_txt='dealloc')
+        retlist, answers, reports = self.confirm_response(self.back_pull, 30000, msg['header']['msg_id'], ids, progress_txt='dealloc', latency_txt='dealloc')
         self.process_reports(reports)
         dealloc_ok = (self.check_answers(answers) == 0)
         ret = len(retlist)
@@ -1357,7 +1401,7 @@ class CollectionManager():
             msg = create_msg('connect', body=self.filter_active_dict(self.cmstate_levels()))
             self.back_pub.send_multipart([b'partition', json.dumps(msg)])
 
-            retlist, answers, reports = self.confirm_response(self.back_pull, 20000, msg['header']['msg_id'], ids, progress_txt='connect')
+            retlist, answers, reports = self.confirm_response(self.back_pull, 20000, msg['header']['msg_id'], ids, progress_txt='connect', latency_txt='connect')
             self.process_reports(reports)
             connect_ok = (self.check_answers(answers) == 0)
             ret = len(retlist)
@@ -1377,7 +1421,7 @@ class CollectionManager():
         msg = create_msg('disconnect')
         self.back_pub.send_multipart([b'partition', json.dumps(msg)])
 
-        retlist, answers, reports = self.confirm_response(self.back_pull, 30000, msg['header']['msg_id'], ids, progress_txt='disconnect')
+        retlist, answers, reports = self.confirm_response(self.back_pull, 30000, msg['header']['msg_id'], ids, progress_txt='disconnect', latency_txt='disconnect')
         self.process_reports(reports)
         disconnect_ok = (self.check_answers(answers) == 0)
         ret = len(retlist)
@@ -1470,6 +1514,26 @@ class CollectionManager():
         reply = xtc_bytes[12:]
         return create_msg('block', body=reply.hex())
 
+    # histograms of reply latencies per transition (latency text) and client
+    def handle_getlatency(self, body):
+        logging.debug('handle_getlatency()')
+        return create_msg('latency', body=self.latency.get())
+
+    # runs in the fastreply thread, only cached configs are served so that
+    # it never waits for configdb (segments read missing configs themselves)
+    def handle_getconfig(self, body):
+        try:
+            cfg = self.config_cache.get(body['alias'], body['device'])
+        except Exception as ex:
+            msg = f'getconfig: {ex}'
+            logging.error(msg)
+            return error_msg(msg)
+        if cfg is None:
+            msg = f'getconfig: {body["alias"]}/{body["device"]} not cached'
+            logging.debug(msg)
+            return error_msg(msg)
+        return create_msg('config', body={'config': cfg})
+
     def handle_selectplatform(self, body):
         logging.debug('handle_selectplatform()')
         if self.state != 'unallocated':
@@ -1697,6 +1761,7 @@ class CollectionManager():
             self.cmstate['control'][0]['control_info']['cfg_dbase'] = self.cfg_dbase
             self.cmstate['control'][0]['control_info']['instrument'] = self.instrument
             self.cmstate['control'][0]['control_info']['slow_update_rate'] = self.slow_update_rate
+            self.cmstate['control'][0]['control_info']['config_service'] = 'tcp://%s:%d' % (socket.gethostname(), fast_rep_port(self.platform))
             self.cmstate['control'][0]['proc_info']['alias'] = self.alias
             self.cmstate['control'][0]['proc_info']['host'] = socket.gethostname()
             self.cmstate['control'][0]['proc_info']['pid'] = os.getpid()
@@ -1962,7 +2027,7 @@ class CollectionManager():
             return True
 
         # make sure all the clients respond to transition before timeout
-        retlist, answers, reports = self.confirm_response(self.back_pull, timeout, msg['header']['msg_id'], ids, progress_txt=transition)
+        retlist, answers, reports = self.confirm_response(self.back_pull, timeout, msg['header']['msg_id'], ids, progress_txt=transition, latency_txt=transition)
         self.process_reports(reports)
         answers_ok = (self.check_answers(answers) == 0)
         ret = len(retlist)
@@ -1979,6 +2044,12 @@ class CollectionManager():
 
     def condition_configure(self):
         logging.debug('condition_configure: phase1Info = %s' % self.phase1Info)
+        # read the configs of all drp segments once, before they ask for them
+        drp_aliases = [item['proc_info']['alias'] for item in self.filter_active_dict(self.cmstate_levels()).get('drp', {}).values()]
+        try:
+            self.config_cache.prefetch(self.config_alias, drp_aliases)
+        except Exception as ex:
+            logging.warning('condition_configure(): config prefetch failed: %s' % ex)
         # phase 1
         ok = self.condition_common('configure', 60000,
                                    body={'config_alias': self.config_alias, 'trigger_config': self.trigger_config})
@@ -2204,6 +2275,9 @@ class CollectionManager():
             socks = dict(self.fast_poller.poll(500))        # timeout (ms)
             if self.fast_rep in socks and socks[self.fast_rep] == zmq.POLLIN:
                 self.service_fast()
+                # serve queued requests (e.g. getconfig of all segments) without waiting
+                while self.fast_rep.poll(0) == zmq.POLLIN:
+                    self.service_fast()
             if self.threads_exit.is_set():
                 break
 
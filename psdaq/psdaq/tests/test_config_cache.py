@@ -0,0 +1,68 @@
+import json
+from threading import Thread
+import zmq
+import psdaq.configdb.get_config as gc
+from psdaq.control.control import CollectionManager
+from types import SimpleNamespace
+
+class fake_configdb(object):
+    key = 1
+    reads = []
+
+    def __init__(self, url, hutch, create=False, root="NONE"):
+        pass
+
+    def get_key(self, alias=None, hutch=None, session=None):
+        return fake_configdb.key
+
+    def get_configuration(self, alias, device, hutch=None):
+        fake_configdb.reads.append((alias, device))
+        return {'detName:RO': device[:-2], 'user': {'gain:RO': fake_configdb.key}}
+
+    def modify_device(self, alias, value, hutch=None):
+        fake_configdb.key += 1
+        return fake_configdb.key
+
+def test_config_cache(monkeypatch):
+    monkeypatch.setattr(gc.cdb, 'configdb', fake_configdb)
+    cache = gc.ConfigCache('https://configdb/ws', 'tst', 'configDB')
+    devices = ['cam_%d' % i for i in range(20)]
+
+    cache.prefetch('BEAM', devices)
+    cache.prefetch('BEAM', devices)
+    assert sorted(fake_configdb.reads) == sorted(('BEAM', d) for d in devices)
+    assert cache.get('BEAM', 'cam_3') == {'detName:RO': 'cam', 'user': {'gain': 1}}
+    assert len(fake_configdb.reads) == 20
+
+    # a new key of the alias (modify_device from any client) invalidates its configs
+    fake_configdb.key += 1
+    cache.prefetch('BEAM', devices[:2])
+    assert len(fake_configdb.reads) == 22
+    assert cache.get('BEAM', 'cam_0')['user']['gain'] == 2
+    cache.modify_device('BEAM', {})
+    assert cache.configs == {}
+
+    # segments get the cached configs from the config service of control.py
+    cache.prefetch('BEAM', devices)
+    n_reads = len(fake_configdb.reads)
+    collection = SimpleNamespace(config_cache=cache)
+    context = zmq.Context.instance()
+    rep = context.socket(zmq.REP)
+    port = rep.bind_to_random_port('tcp://127.0.0.1')
+    def serve(n):
+        for i in range(n):
+            rep.send_json(CollectionManager.handle_getconfig(collection, rep.recv_json()['body']))
+    server = Thread(target=serve, args=(2,))
+    server.start()
+    control_info = {'instrument': 'tst', 'cfg_dbase': 'https://configdb/ws/configDB',
+                    'config_service': 'tcp://127.0.0.1:%d' % port}
+    connect_json = json.dumps({'body': {'control': {'0': {'control_info': control_info}}}})
+    assert gc.get_config(connect_json, 'BEAM', 'cam', 5) == {'detName:RO': 'cam', 'user': {'gain': 3}}
+    assert len(fake_configdb.reads) == n_reads
+
+    # the service does not read a config that is not cached, the segment reads it
+    assert gc.get_config(connect_json, 'BEAM', 'cam', 25) == {'detName:RO': 'cam_', 'user': {'gain': 3}}
+    assert fake_configdb.reads[n_reads:] == [('BEAM', 'cam_25')]
+    assert ('BEAM', 'cam_25') not in cache.configs
+    server.join()
+    rep.close()
@@ -0,0 +1,73 @@
+import time
+from threading import Thread, Event
+import zmq
+from psdaq.control.ControlDef import create_msg, warning_msg
+from psdaq.control.control import LatencyHistograms, CollectionManager, wait_for_answers
+
+def test_latency_histograms():
+    latency = LatencyHistograms()
+    n_bins = len(LatencyHistograms.edges) + 1
+    for ms in (0.5, 1, 1.5, 60000, 60001):
+        latency.add('configure', 'drp/cam_0', ms)
+    latency.add_timeout('configure', 'drp/cam_0')
+    latency.add_timeout('alloc', 'teb/teb0')
+
+    hists = latency.get()
+    assert hists['edges'] == LatencyHistograms.edges
+    assert hists['counts']['configure']['drp/cam_0'] == [2, 1] + [0] * (n_bins - 4) + [1, 2]
+    assert hists['counts']['alloc']['teb/teb0'] == [0] * (n_bins - 1) + [1]
+
+    # the histograms returned are copies
+    hists['counts']['alloc']['teb/teb0'][0] = 5
+    assert latency.get()['counts']['alloc']['teb/teb0'][0] == 0
+
+def socket_pair():
+    context = zmq.Context.instance()
+    pull = context.socket(zmq.PULL)
+    port = pull.bind_to_random_port('tcp://127.0.0.1')
+    push = context.socket(zmq.PUSH)
+    push.connect('tcp://127.0.0.1:%d' % port)
+    return pull, push
+
+def test_wait_for_answers_reports():
+    # a stream of reports does not extend the wait past wait_time
+    pull, push = socket_pair()
+    done = Event()
+    def send_reports():
+        # stops after 2 s if the wait is extended
+        for i in range(200):
+            if done.is_set(): break
+            push.send_json(warning_msg('still here'))
+            time.sleep(0.01)
+    start = time.time()
+    sender = Thread(target=send_reports)
+    sender.start()
+    try:
+        msgs = list(wait_for_answers(pull, 200, None))
+        elapsed = time.time() - start
+    finally:
+        done.set()
+        sender.join()
+    assert len(msgs) > 0
+    assert elapsed < 1
+    push.close(linger=0)
+    pull.close(linger=0)
+
+def test_confirm_response_latency():
+    # latencies are recorded with latency_txt, clients that time out in the last bin
+    pull, push = socket_pair()
+    collection = CollectionManager.__new__(CollectionManager)
+    collection.latency = LatencyHistograms()
+    levels = {'drp': {1: {'proc_info': {'alias': 'cam_0'}},
+                      2: {'proc_info': {'alias': 'cam_1'}}}}
+    collection.cmstate_levels = lambda: levels
+    push.send_json(create_msg('alloc', msg_id='0', sender_id=1))
+
+    missing, answers, reports = collection.confirm_response(pull, 300, '0', {1, 2}, latency_txt='alloc')
+    assert missing == {2}
+    assert len(answers) == 1 and reports == []
+    counts = collection.latency.get()['counts']['alloc']
+    assert sum(counts['drp/cam_0'][:-1]) == 1 and counts['drp/cam_0'][-1] == 0
+    assert counts['drp/cam_1'] == [0] * len(LatencyHistograms.edges) + [1]
+    push.close(linger=0)
+    pull.close(linger=0)